@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from pyspark.sql.functions import pandas_udf
+from pyspark.sql.types import *
+
+# Vectorized CSV parsing on whole Arrow batches. Values that do not convert become null,
+# the same as a failed CAST on the JVM path.
+
+INTEGER_DTYPES = {LongType: "Int64", IntegerType: "Int32", ShortType: "Int16", ByteType: "Int8"}
+FLOAT_DTYPES = {FloatType: "float32", DoubleType: "float64"}
+JVM_TRIM = "".join(map(chr, range(0x21))) + "\x7f"
+LONG_MIN, LONG_MAX = np.iinfo("int64").min, np.iinfo("int64").max
+
+def convert_integers(values, dtype):
+  # the rules of the JVM string to integer cast: surrounding whitespace and control characters are
+  # trimmed, a fraction is truncated, exponents, other text and overflow are null
+  parts = values.str.strip(JVM_TRIM).str.extract(r"^([+-]?)([0-9]*)(\.[0-9]*)?$")
+  literal = ((parts[1].str.len() > 0) | (parts[2].str.len() > 0)).to_numpy(dtype=bool)
+  digits = parts[1].str.lstrip("0").fillna("")
+  length = digits.str.len().to_numpy()
+  exact = literal & (length <= 18)
+  data = np.zeros(len(values), dtype="int64")
+  data[exact] = digits[exact].replace("", "0").astype("int64").to_numpy()
+  negative = (parts[0] == "-").to_numpy(dtype=bool)
+  data[negative] = -data[negative]
+  # 19 digits may still fit a long, parse them one by one
+  for idx in np.flatnonzero(literal & (length == 19)):
+    number = int(parts[0].iat[idx] + digits.iat[idx])
+    if LONG_MIN <= number <= LONG_MAX:
+      data[idx], exact[idx] = number, True
+  info = np.iinfo(dtype.lower())
+  valid = exact & (data >= info.min) & (data <= info.max)
+  return pd.Series(pd.arrays.IntegerArray(data.astype(dtype.lower()), ~valid), index=values.index)
+
+def convert_series(values, data_type, timestamp_format="%Y-%m-%d %H:%M:%S"):
+  if type(data_type) in INTEGER_DTYPES:
+    return convert_integers(values, INTEGER_DTYPES[type(data_type)])
+  if type(data_type) in FLOAT_DTYPES:
+    return pd.to_numeric(values.str.strip(), errors="coerce").astype(FLOAT_DTYPES[type(data_type)])
+  if isinstance(data_type, TimestampType):
+    return pd.to_datetime(values.str.strip(), format=timestamp_format, errors="coerce")
+  if isinstance(data_type, BooleanType):
+    return values.str.strip().str.lower().map({"true": True, "false": False})
+  if isinstance(data_type, StringType):
+    return values
+  raise TypeError("Unsupported type for the pandas parser: {}".format(data_type))
+
+def csv_to_frame(values, schema):
+  """Split a Series of CSV strings once and convert every column of `schema`."""
+  parts = values.str.split(",", expand=True).reindex(columns=range(len(schema)))
+  return pd.DataFrame({field.name: convert_series(parts[idx].astype(object), field.dataType) \
+                       for idx, field in enumerate(schema)}, index=values.index)
+
+def csv_parser_udf(schema):
+  @pandas_udf(schema)
+  def parse(values: pd.Series) -> pd.DataFrame:
+    return csv_to_frame(values, schema)
+  return parse
@@ -0,0 +1,88 @@
+import json
+import threading
+from pyspark.sql.streaming import StreamingQueryListener
+from hadoop_fs import read_text, write_text
+
+# Adaptive maxOffsetsPerTrigger. The Kafka source reads the cap once when a query starts,
+# so the controller watches each batch, derives the cap that would finish a batch in the
+# target duration, and asks for a query restart when the current cap is far off. The last
+# decision is persisted so the next job run starts from it instead of the full backlog.
+# Only the query passed to query_started is watched, the events of other queries in the
+# session (the hotspots query, a stopped predecessor) are ignored.
+
+class OffsetCapController(StreamingQueryListener):
+  def __init__(self, spark, state_path, target_batch_seconds=10.0, initial_cap=100000, \
+               min_cap=1000, max_cap=50000000, max_step=2.0, smoothing=0.5, restart_ratio=2.0, patience=3):
+    self.spark = spark
+    self.state_path = state_path
+    self.target_ms = target_batch_seconds * 1000
+    self.min_cap, self.max_cap = min_cap, max_cap
+    self.max_step, self.smoothing = max_step, smoothing
+    self.restart_ratio, self.patience = restart_ratio, patience
+    self.restart_requested = threading.Event()
+    self.off_target = 0
+    self.run_id = None
+    saved = read_text(spark, state_path)
+    self.cap = json.loads(saved)["maxOffsetsPerTrigger"] if saved else initial_cap
+    self.recommended = self.cap
+    print("offset controller: starting with maxOffsetsPerTrigger={} ({})".format( \
+      self.cap, "restored from " + state_path if saved else "initial value"))
+
+  def query_started(self, query):
+    """Call with every query started with the current cap."""
+    self.run_id = str(query.runId)
+    self.restart_requested.clear()
+    self.off_target = 0
+    self.recommended = self.cap
+
+  def onQueryStarted(self, event):
+    pass
+
+  def onQueryProgress(self, event):
+    progress = event.progress
+    if str(progress.runId) != self.run_id:
+      return
+    # the cap applies to each Kafka source on its own, e.g. to the rides and to the fares of ride-fares
+    rows = max([source.numInputRows for source in progress.sources], default=progress.numInputRows)
+    duration = progress.batchDuration
+    if not rows or duration <= 0:
+      return
+    # rows/ms the cluster sustained in this batch, scaled to the target batch duration
+    ideal = rows / float(duration) * self.target_ms
+    capped = rows >= 0.9 * self.cap
+    if not capped and duration <= self.target_ms:
+      # the source had less than the cap, the batch size says nothing about capacity
+      ideal = max(ideal, self.recommended)
+    step = min(max(ideal, self.recommended / self.max_step), self.recommended * self.max_step)
+    smoothed = self.smoothing * step + (1 - self.smoothing) * self.recommended
+    self.recommended = int(min(max(smoothed, self.min_cap), self.max_cap))
+    ratio = max(self.recommended, self.cap) / float(min(self.recommended, self.cap))
+    # raising the cap only pays off while batches are actually hitting it
+    worth_restart = ratio >= self.restart_ratio and (capped or self.recommended < self.cap)
+    self.off_target = self.off_target + 1 if worth_restart else 0
+    print("offset controller: batch={} rows={} durationMs={} cap={} recommended={}{}".format( \
+      progress.batchId, rows, duration, self.cap, self.recommended, \
+      " -> restart" if self.off_target >= self.patience else ""))
+    if self.off_target >= self.patience:
+      self.apply()
+      self.restart_requested.set()
+
+  def onQueryIdle(self, event):
+    pass
+
+  def onQueryTerminated(self, event):
+    if str(event.runId) == self.run_id:
+      self.apply()
+
+  def apply(self):
+    self.cap = self.recommended
+    write_text(self.spark, self.state_path, json.dumps({"maxOffsetsPerTrigger": self.cap}))
+
+  def await_termination_or_restart(self, query, poll_seconds=5):
+    """Block until the query ends (returns False) or the controller wants a new cap (stops it, returns True)."""
+    while not query.awaitTermination(poll_seconds):
+      if self.restart_requested.is_set():
+        print("offset controller: restarting query with maxOffsetsPerTrigger={}".format(self.cap))
+        query.stop()
+        return True
+    return False
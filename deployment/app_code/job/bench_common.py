@@ -0,0 +1,100 @@
+import json
+import time
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import array, col, concat_ws, date_format, element_at, expr, format_string, lit, when
+
+def local_spark(app_name, shuffle_partitions=4, conf=None):
+  builder = SparkSession.builder \
+    .master("local[*]") \
+    .appName(app_name) \
+    .config("spark.sql.shuffle.partitions", shuffle_partitions) \
+    .config("spark.ui.enabled", "false")
+  for key, value in (conf or {}).items():
+    builder = builder.config(key, value)
+  return builder.getOrCreate()
+
+def run_batches(query, batches, timeout=600):
+  """Let a started query run until it reported `batches` progress events, then stop it."""
+  deadline = time.time() + timeout
+  while len(query.recentProgress) < batches and time.time() < deadline:
+    if query.exception() is not None:
+      raise query.exception()
+    time.sleep(0.5)
+  progress = query.recentProgress
+  query.stop()
+  return progress
+
+def percentile(values, pct):
+  if not values:
+    return None
+  ordered = sorted(values)
+  idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+  return ordered[idx]
+
+def summarize(values):
+  return {"p50": percentile(values, 50), "p95": percentile(values, 95), \
+          "p99": percentile(values, 99), "max": max(values) if values else None}
+
+def segment_mean(values, start, end):
+  """Mean of the values between two fractions of the run, e.g. 0.75 and 1.0 for the last quarter."""
+  part = values[int(len(values) * start):int(len(values) * end)]
+  return sum(part) / float(len(part)) if part else None
+
+def write_results(path, results):
+  with open(path, "w") as fp:
+    json.dump(results, fp, indent=2, default=str)
+  print("Results written to {}".format(path))
+
+def taxi_ride_values(sdf, drivers, id_col="value", time_col="timestamp"):
+  """taxiRidesSchema-shaped CSV values built from a numeric id and a timestamp column,
+  e.g. the output of the rate source."""
+  ride_id = col(id_col)
+  driver_id = ride_id % drivers + 2013000000
+
+  def coordinate(base, salt):
+    return format_string("%.6f", lit(base) + (ride_id * salt % 10000) / 10000.0 * 0.3)
+
+  return sdf.select(concat_ws(",", \
+    ride_id.cast("string"), when(ride_id % 2 == 0, lit("START")).otherwise(lit("END")), \
+    date_format(col(time_col), "yyyy-MM-dd HH:mm:ss"), \
+    date_format(col(time_col) - expr("INTERVAL 15 MINUTES"), "yyyy-MM-dd HH:mm:ss"), \
+    coordinate(-74.05, 7919), coordinate(40.6, 104729), coordinate(-74.05, 1299709), coordinate(40.6, 15485863), \
+    (ride_id % 6 + 1).cast("string"), (driver_id + 100000).cast("string"), driver_id.cast("string")).alias("value"))
+
+def taxi_fare_values(sdf, drivers, id_col="value", time_col="timestamp"):
+  """taxiFaresSchema-shaped CSV values, the fare of the ride taxi_ride_values builds from the same id and time."""
+  ride_id = col(id_col)
+  driver_id = ride_id % drivers + 2013000000
+  tip = ride_id * 7 % 1000 / 100.0
+  return sdf.select(concat_ws(",", \
+    ride_id.cast("string"), (driver_id + 100000).cast("string"), driver_id.cast("string"), \
+    date_format(col(time_col) - expr("INTERVAL 15 MINUTES"), "yyyy-MM-dd HH:mm:ss"), \
+    when(ride_id % 3 == 0, lit("CASH")).otherwise(lit("CARD")), \
+    format_string("%.2f", tip), lit("0.00"), format_string("%.2f", tip + ride_id % 40 + 2.5)).alias("value"))
+
+COMMON_WORDS = ["the", "and", "a", "to", "it", "i", "is", "this", "of", "for", "great", "in", "my", "not", "but", \
+                "with", "was", "that", "you", "good", "very", "on", "product", "love", "as", "have", "so", "one"]
+
+def review_rows(spark, rows, vocabulary=200000, partitions=None):
+  """Amazon-reviews-shaped rows whose review_body follows a steep Zipf-like word distribution, with
+  capitalized words, trailing punctuation and <br /> tags, about 600 bytes of body text per row."""
+  common = "array({})".format(", ".join("'{}'".format(word) for word in COMMON_WORDS))
+  word = "CASE WHEN s.t < {0} THEN element_at({1}, CAST(s.t AS INT) + 1) ELSE concat('w', CAST(s.t AS STRING)) END" \
+    .format(len(COMMON_WORDS), common)
+  body = """array_join(transform(transform(sequence(1, 30 + CAST(pmod(id, 120) AS INT)),
+      i -> named_struct('i', i, 't', floor(pow(pmod(xxhash64(id, i), 1000000) / 1000000.0, 4) * {0}))),
+      s -> concat(
+        IF(pmod(xxhash64(id, s.i, 1), 7) = 0, initcap({1}), {1}),
+        CASE pmod(xxhash64(id, s.i, 2), 40) WHEN 0 THEN ',' WHEN 1 THEN '!' WHEN 2 THEN '.' WHEN 3 THEN ' <br />'
+          ELSE '' END)), ' ')""".format(vocabulary, word)
+  return spark.range(0, rows, numPartitions=partitions or spark.sparkContext.defaultParallelism) \
+    .select(lit("US").alias("marketplace"), (col("id") % 1000003).cast("string").alias("customer_id"), \
+            format_string("R%012d", col("id")).alias("review_id"), \
+            format_string("B%09d", col("id") % 50021).alias("product_id"), \
+            format_string("Product %d", col("id") % 50021).alias("product_title"), \
+            element_at(array(lit("Books"), lit("Toys"), lit("Electronics"), lit("Home")), \
+                       (col("id") % 4 + 1).cast("int")).alias("product_category"), \
+            (col("id") % 5 + 1).cast("int").alias("star_rating"), (col("id") % 13).cast("int").alias("helpful_votes"), \
+            format_string("Review headline %d", col("id") % 997).alias("review_headline"), \
+            expr(body).alias("review_body"), \
+            expr("date_add(DATE'2015-01-01', CAST(pmod(id, 365) AS INT))").alias("review_date"))
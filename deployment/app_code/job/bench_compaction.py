@@ -0,0 +1,66 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from pyspark.sql.functions import count, expr
+from bench_common import local_spark, run_batches, summarize, taxi_ride_values, write_results
+from compact_lake import compact
+from lake_sink import lake_writer
+from stream_parser import parse_csv_value
+from taxi_schema import taxiRidesSchema
+
+# Local benchmark of compact_lake.py: a streaming lake_sink.py table written with short triggers,
+# its data file count and scan time, then the same after compaction. The row count and checksum
+# are compared to check that the compacted table is the same data.
+# Usage: python bench_compaction.py --batches 60 --source-partitions 8 --output bench_compaction.json
+
+def data_files(path):
+  return sum(1 for folder, _, names in os.walk(path) if "_spark_metadata" not in folder \
+             for name in names if name.endswith(".parquet"))
+
+def scan(spark, path, repeats):
+  # a fresh DataFrame each time, so the metadata log and file footers are read again
+  timings, result = [], None
+  for _ in range(repeats):
+    started = time.time()
+    result = spark.read.parquet(path).agg(count("*").alias("rows"), expr("sum(rideId)").alias("checksum")).first()
+    timings.append((time.time() - started) * 1000)
+  return {"dataFiles": data_files(path), "rows": result["rows"], "checksum": result["checksum"], \
+          "scanMs": summarize(timings)}
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows-per-second", type=int, default=2000)
+  parser.add_argument("--source-partitions", type=int, default=8, help="files per trigger and partition")
+  parser.add_argument("--batches", type=int, default=60)
+  parser.add_argument("--trigger-seconds", type=int, default=1)
+  parser.add_argument("--target-mb", type=float, default=128)
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--output", default="bench_compaction.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Compaction benchmark", conf={"spark.sql.session.timeZone": "UTC"})
+  table = tempfile.mkdtemp(prefix="bench_lake_")
+  source = spark.readStream.format("rate") \
+    .option("rowsPerSecond", args.rows_per_second) \
+    .option("numPartitions", args.source_partitions) \
+    .load()
+  rides = parse_csv_value(taxi_ride_values(source, 10000), taxiRidesSchema)
+  query = lake_writer(rides, table, tempfile.mkdtemp(prefix="bench_lake_checkpoint_"), time_col="startTime") \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+  run_batches(query, args.batches)
+
+  before = scan(spark, table, args.repeats)
+  started = time.time()
+  # the query is stopped, so the hours it was writing are closed too
+  report = compact(spark, table, int(args.target_mb * 1024 * 1024), datetime.max)
+  compaction_ms = (time.time() - started) * 1000
+  after = scan(spark, table, args.repeats)
+  for label, result in [("before", before), ("after", after)]:
+    print("{:>7}: files={dataFiles:6} rows={rows} scan p50={scanMs[p50]:.0f}ms".format(label, **result))
+  if (before["rows"], before["checksum"]) != (after["rows"], after["checksum"]):
+    raise AssertionError("Compaction changed the table: {} -> {}".format(before, after))
+  write_results(args.output, {"arguments": vars(args), "before": before, "after": after, \
+                              "compactionMs": compaction_ms, "partitions": report})
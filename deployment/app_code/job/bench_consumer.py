@@ -0,0 +1,117 @@
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from pyspark.sql.functions import current_timestamp
+from bench_common import local_spark, run_batches, summarize, taxi_ride_values, write_results
+from rides_pipeline import driver_window_counts
+from state_store import state_operator_summary
+from stream_parser import parse_csv_value
+from taxi_schema import taxiRidesSchema
+
+# Offline throughput benchmark of the msk_consumer.py pipeline (parse, watermark, driver window count)
+# on Spark local mode, fed by the rate source or by pre-generated files instead of Kafka.
+# Usage: python bench_consumer.py --rates 1000 10000 50000 --shuffle-partitions 4 16 64 --output after.json
+#        python bench_consumer.py --compare before.json --output after.json
+
+def rate_source(spark, rate, args):
+  source = spark.readStream.format("rate").option("rowsPerSecond", rate).load()
+  return taxi_ride_values(source, args.drivers)
+
+def file_source(spark, rate, args):
+  if args.input_dir:
+    # files of load_generator.py, e.g. with driver skew or late events
+    return spark.readStream.format("text").option("maxFilesPerTrigger", args.files_per_trigger).load(args.input_dir)
+  # one file per trigger interval worth of rows, read one file per micro-batch
+  folder = tempfile.mkdtemp(prefix="bench_rides_")
+  rows = rate * args.trigger_seconds
+  ids = spark.range(rows * (args.batches + 1), numPartitions=args.batches + 1)
+  taxi_ride_values(ids.withColumn("timestamp", current_timestamp()), args.drivers, id_col="id") \
+    .write.mode("overwrite").text(folder)
+  return spark.readStream.format("text").option("maxFilesPerTrigger", 1).load(folder)
+
+SOURCES = {"rate": rate_source, "file": file_source}
+
+def run(spark, rate, partitions, args):
+  spark.conf.set("spark.sql.shuffle.partitions", partitions)
+  values = SOURCES[args.source](spark, rate, args)
+  rides = parse_csv_value(values, taxiRidesSchema, method=args.parser, overrides={"timestamp": current_timestamp()})
+  counts = driver_window_counts(rides, args.aggregation)
+  query = counts.writeStream \
+    .format("noop") \
+    .outputMode("append") \
+    .option("checkpointLocation", tempfile.mkdtemp(prefix="bench_consumer_")) \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+  progress = [p for p in run_batches(query, args.batches + 1)[1:] if p["numInputRows"] > 0]
+  state = [state_operator_summary(p)[0] for p in progress if p.get("stateOperators")]
+  return {
+    "source": args.source,
+    "rate": rate,
+    "shufflePartitions": partitions,
+    "batches": len(progress),
+    "rowsPerSecond": sum(p["numInputRows"] for p in progress) / \
+                     max(sum(p["durationMs"]["triggerExecution"] for p in progress) / 1000.0, 0.001),
+    "batchDurationMs": summarize([p["durationMs"]["triggerExecution"] for p in progress]),
+    "addBatchMs": summarize([p["durationMs"].get("addBatch", 0) for p in progress]),
+    "stateRows": max([s["numRowsTotal"] for s in state] or [0]),
+    "stateMemoryBytes": max([s["memoryUsedBytes"] for s in state] or [0]),
+  }
+
+def git_revision():
+  try:
+    return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+  except Exception:
+    return None
+
+def compare(baseline_path, results):
+  with open(baseline_path) as fp:
+    baseline = {(r["source"], r["rate"], r["shufflePartitions"]): r for r in json.load(fp)["results"]}
+  print("{:>8} {:>10} {:>10} {:>14} {:>14} {:>9}".format( \
+    "rate", "partitions", "metric", "before", "after", "change"))
+  for result in results:
+    before = baseline.get((result["source"], result["rate"], result["shufflePartitions"]))
+    if not before:
+      continue
+    for metric, old, new in [("rows/s", before["rowsPerSecond"], result["rowsPerSecond"]), \
+                             ("p95 ms", before["batchDurationMs"]["p95"], result["batchDurationMs"]["p95"])]:
+      if old and new is not None:
+        print("{:>8} {:>10} {:>10} {:>14.1f} {:>14.1f} {:>+8.1f}%".format( \
+          result["rate"], result["shufflePartitions"], metric, old, new, (new - old) * 100.0 / old))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--source", choices=list(SOURCES), default="rate")
+  parser.add_argument("--rates", type=int, nargs="+", default=[1000, 10000, 50000], help="input rows per second")
+  parser.add_argument("--shuffle-partitions", type=int, nargs="+", default=[4, 16, 64])
+  parser.add_argument("--drivers", type=int, default=10000)
+  parser.add_argument("--input-dir", help="read the file source from load_generator.py output instead")
+  parser.add_argument("--files-per-trigger", type=int, default=1)
+  parser.add_argument("--parser", choices=["split", "from_csv", "pandas"], default="split")
+  parser.add_argument("--aggregation", choices=["window", "pane"], default="window")
+  parser.add_argument("--trigger-seconds", type=int, default=5)
+  parser.add_argument("--batches", type=int, default=12)
+  parser.add_argument("--compare", help="results file of an earlier run to print the change against")
+  parser.add_argument("--output", default="bench_consumer.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Consumer benchmark")
+  results = []
+  for rate in args.rates:
+    for partitions in args.shuffle_partitions:
+      result = run(spark, rate, partitions, args)
+      print("rate={rate:7} partitions={shufflePartitions:4} rows/s={rowsPerSecond:10.1f} stateRows={stateRows}".format( \
+        **result))
+      results.append(result)
+  write_results(args.output, {
+    "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    "gitRevision": git_revision(),
+    "sparkVersion": spark.version,
+    "python": platform.python_version(),
+    "arguments": vars(args),
+    "results": results,
+  })
+  if args.compare:
+    compare(args.compare, results)
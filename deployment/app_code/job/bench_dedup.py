@@ -0,0 +1,75 @@
+import argparse
+import tempfile
+from pyspark.sql.functions import col, current_timestamp, when
+from bench_common import local_spark, run_batches, segment_mean, summarize, taxi_ride_values, write_results
+from dedup import drop_duplicate_events
+from stream_parser import parse_csv_value
+from taxi_schema import taxiRidesSchema
+
+# Local check of the dedup stage under a steady duplicate rate: every --duplicate-every-th rate
+# source row repeats the event --lag rows earlier instead of a new one. The deduplicated rows are
+# checked against the distinct events the source produced, and the dedup state rows and memory
+# are recorded per batch; they level off at the TTL times the event rate.
+# Usage: python bench_dedup.py --rows-per-second 2000 --duplicate-every 10 --ttl "30 seconds"
+
+def expected_events(rows, duplicate_every, lag):
+  # copies replace rows v with v % duplicate_every == 0 and v >= lag, and repeat row v - lag
+  copies = len(range(duplicate_every * -(-lag // duplicate_every), rows, duplicate_every))
+  return rows - copies
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows-per-second", type=int, default=2000)
+  parser.add_argument("--duplicate-every", type=int, default=10, help="10 is a 10% duplicate rate")
+  parser.add_argument("--lag", type=int, default=2003, help="rows between an event and its copy, not a multiple of --duplicate-every")
+  parser.add_argument("--ttl", default="30 seconds")
+  parser.add_argument("--batches", type=int, default=90)
+  parser.add_argument("--trigger-seconds", type=int, default=2)
+  parser.add_argument("--output", default="bench_dedup.json")
+  args = parser.parse_args()
+  if args.lag % args.duplicate_every == 0:
+    parser.error("--lag must not be a multiple of --duplicate-every, a copy would repeat a copy")
+
+  spark = local_spark("Dedup benchmark", conf={"spark.sql.streaming.numRecentProgressUpdates": args.batches + 10})
+  source = spark.readStream.format("rate").option("rowsPerSecond", args.rows_per_second).load()
+  value = col("value")
+  event_ids = source.select(when((value % args.duplicate_every == 0) & (value >= args.lag), value - args.lag) \
+                            .otherwise(value).alias("value"), "timestamp")
+  rides = parse_csv_value(taxi_ride_values(event_ids, 10000), taxiRidesSchema, \
+                          overrides={"timestamp": current_timestamp()})
+  dropped = spark.sparkContext.accumulator(0)
+  query = drop_duplicate_events(rides, args.ttl, dropped=dropped) \
+    .writeStream \
+    .format("memory") \
+    .queryName("deduped") \
+    .outputMode("append") \
+    .option("checkpointLocation", tempfile.mkdtemp(prefix="bench_dedup_")) \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+  progress = run_batches(query, args.batches)
+
+  input_rows = sum(p["numInputRows"] for p in progress)
+  deduped = spark.table("deduped")
+  output_rows = deduped.count()
+  distinct_rows = deduped.select("rideId", "isStart").distinct().count()
+  expected = expected_events(input_rows, args.duplicate_every, args.lag)
+  state = [p["stateOperators"][0] for p in progress if p.get("stateOperators")]
+  result = {
+    "arguments": vars(args),
+    "inputRows": input_rows,
+    "outputRows": output_rows,
+    "distinctOutputEvents": distinct_rows,
+    "expectedEvents": expected,
+    "droppedCopies": dropped.value,
+    "correct": output_rows == distinct_rows == expected and dropped.value == input_rows - expected,
+    "stateRows": [op["numRowsTotal"] for op in state],
+    "stateMemoryBytes": [op["memoryUsedBytes"] for op in state],
+    "stateRowsSecondQuarter": segment_mean([op["numRowsTotal"] for op in state], 0.25, 0.5),
+    "stateRowsLastQuarter": segment_mean([op["numRowsTotal"] for op in state], 0.75, 1.0),
+    "batchDurationMs": summarize([p["durationMs"]["triggerExecution"] for p in progress]),
+  }
+  print("input={inputRows} output={outputRows} expected={expectedEvents} dropped={droppedCopies} correct={correct} " \
+        "state rows second quarter={stateRowsSecondQuarter} last quarter={stateRowsLastQuarter}".format(**result))
+  write_results(args.output, result)
+  if not result["correct"]:
+    raise AssertionError("Deduplicated output does not match the distinct source events")
@@ -0,0 +1,66 @@
+import argparse
+import time
+import zlib
+from pyspark.sql.functions import avg, col, length, lit, struct, timestamp_seconds
+from bench_common import local_spark, summarize, write_results
+from output_encoder import OUTPUT_FORMATS, encode_for_kafka
+
+# Local benchmark of the Kafka output encodings on driver window count rows:
+# bytes per record (raw and zlib-compressed per producer batch) and serialization cost.
+# Usage: python bench_encoder.py --rows 2000000 --output bench_encoder.json
+# avro needs spark-avro, e.g. PYSPARK_SUBMIT_ARGS="--packages org.apache.spark:spark-avro_2.12:3.4.1 pyspark-shell"
+
+def window_counts(spark, rows, drivers):
+  return spark.range(rows) \
+    .select((col("id") % drivers + 2013000000).alias("driverId"), \
+            struct(timestamp_seconds((col("id") / drivers).cast("long") * 5).alias("start"), \
+                   timestamp_seconds((col("id") / drivers).cast("long") * 5 + 10).alias("end")).alias("window"), \
+            (col("id") % 97 + 1).alias("count"))
+
+def compressed_bytes_per_record(encoded, sample, batch_records):
+  values = [row.value if isinstance(row.value, (bytes, bytearray)) else row.value.encode("utf-8") \
+            for row in encoded.limit(sample).collect()]
+  batches = [b"".join(values[idx:idx + batch_records]) for idx in range(0, len(values), batch_records)]
+  return sum(len(zlib.compress(batch)) for batch in batches) / float(max(len(values), 1))
+
+def run(spark, rows_df, output_format, args):
+  encoded = encode_for_kafka(rows_df, output_format, args.key)
+  timings = []
+  for _ in range(args.repeat):
+    started = time.time()
+    encoded.write.format("noop").mode("overwrite").save()
+    timings.append(time.time() - started)
+  sizes = encoded.select(avg(length("value")).alias("value"), \
+                         avg(length("key")).alias("key") if "key" in encoded.columns else lit(0).alias("key")).first()
+  return {
+    "format": output_format,
+    "key": args.key,
+    "rows": args.rows,
+    "valueBytesPerRecord": sizes.value,
+    "keyBytesPerRecord": sizes.key,
+    "zlibBytesPerRecord": compressed_bytes_per_record(encoded, args.sample, args.batch_records),
+    "serializeNsPerRecord": summarize([seconds * 1e9 / args.rows for seconds in timings]),
+  }
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows", type=int, default=2000000)
+  parser.add_argument("--drivers", type=int, default=10000)
+  parser.add_argument("--formats", nargs="+", default=OUTPUT_FORMATS, choices=OUTPUT_FORMATS)
+  parser.add_argument("--key", default="driverId")
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--sample", type=int, default=100000, help="records collected for the compressed size")
+  parser.add_argument("--batch-records", type=int, default=1000, help="records per compressed producer batch")
+  parser.add_argument("--output", default="bench_encoder.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Output encoder benchmark")
+  rows_df = window_counts(spark, args.rows, args.drivers).cache()
+  rows_df.count()
+  results = []
+  for output_format in args.formats:
+    result = run(spark, rows_df, output_format, args)
+    print("{format:5} value={valueBytesPerRecord:6.1f}B compressed={zlibBytesPerRecord:6.1f}B " \
+          "serialize p50={ns:8.1f}ns/record".format(ns=result["serializeNsPerRecord"]["p50"], **result))
+    results.append(result)
+  write_results(args.output, results)
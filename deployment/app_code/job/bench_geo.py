@@ -0,0 +1,63 @@
+import argparse
+import time
+import numpy as np
+from pyspark.sql.functions import col, rand
+from bench_common import local_spark, write_results
+from geo_grid import grid_cells, with_grid_cells
+
+# Per-row cost of the grid cell binning: the NumPy kernel alone over batches of several sizes,
+# and unless --no-spark, the pandas UDF in Spark local mode against the same query without it.
+# Usage: python bench_geo.py --resolution 16 --rows 1000000 --output bench_geo.json
+
+def kernel_ns_per_row(batch_size, resolution, repeats, rng):
+  lon = -74.05 + rng.random(batch_size) * 0.3
+  lat = 40.6 + rng.random(batch_size) * 0.3
+  grid_cells(lon, lat, resolution)
+  timings = []
+  for _ in range(repeats):
+    started = time.perf_counter()
+    grid_cells(lon, lat, resolution)
+    timings.append((time.perf_counter() - started) * 1e9 / batch_size)
+  return min(timings), float(np.median(timings))
+
+def spark_ns_per_row(rows, resolution, repeats):
+  spark = local_spark("Geo grid benchmark")
+  points = spark.range(rows).select(col("id"), \
+    (rand(1) * 0.3 - 74.05).cast("float").alias("startLon"), (rand(2) * 0.3 + 40.6).cast("float").alias("startLat"), \
+    (rand(3) * 0.3 - 74.05).cast("float").alias("endLon"), (rand(4) * 0.3 + 40.6).cast("float").alias("endLat")).cache()
+  points.count()
+
+  def run(df):
+    timings = []
+    for _ in range(repeats):
+      started = time.perf_counter()
+      df.write.format("noop").mode("overwrite").save()
+      timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+  baseline, binned = run(points), run(with_grid_cells(points, resolution))
+  # two cells per row (start and end), the difference is the UDF including the Arrow round trip
+  return {"baselineSeconds": baseline, "udfSeconds": binned, \
+          "nsPerCell": (binned - baseline) * 1e9 / (2 * rows)}
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--resolution", type=int, default=16)
+  parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+  parser.add_argument("--rows", type=int, default=1000000, help="rows of the Spark run")
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--no-spark", action="store_true")
+  parser.add_argument("--output", default="bench_geo.json")
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(42)
+  kernel = []
+  for batch_size in args.batch_sizes:
+    best, median = kernel_ns_per_row(batch_size, args.resolution, args.repeats, rng)
+    kernel.append({"batchSize": batch_size, "nsPerRowBest": best, "nsPerRowMedian": median})
+    print("kernel batch={:8} ns/row best={:7.1f} median={:7.1f}".format(batch_size, best, median))
+  result = {"arguments": vars(args), "kernel": kernel}
+  if not args.no_spark:
+    result["spark"] = spark_ns_per_row(args.rows, args.resolution, args.repeats)
+    print("spark pandas UDF ns/cell={nsPerCell:.1f}".format(**result["spark"]))
+  write_results(args.output, result)
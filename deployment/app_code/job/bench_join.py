@@ -0,0 +1,80 @@
+import argparse
+import tempfile
+import time
+from pyspark.sql.functions import current_timestamp
+from bench_common import local_spark, run_batches, segment_mean, summarize, taxi_fare_values, taxi_ride_values, \
+  write_results
+from join_state import join_side_rows
+from rides_pipeline import ride_fare_join
+from stream_parser import parse_csv_value
+from taxi_schema import taxiFaresSchema, taxiRidesSchema
+
+# Local benchmark of the rides-fares stream-stream join over a long synthetic run: join state rows
+# and evictions per batch, rows per side counted from the checkpoint every --side-every batches.
+# Odd ride ids are END events and their fares never match, so the state only stays flat if the
+# watermarks evict unmatched rows too.
+# Usage: python bench_join.py --rows-per-second 2000 --batches 240 --output bench_join.json
+
+def sample_side_rows(spark, query, checkpoint, batches, every):
+  """Waits for `batches` batches, counting the rows per join side every `every` batches meanwhile."""
+  samples, next_sample = [], every
+  while len(query.recentProgress) < batches:
+    if query.exception() is not None:
+      raise query.exception()
+    last = query.lastProgress
+    if last and last["batchId"] >= next_sample:
+      samples.append(dict(join_side_rows(spark, checkpoint, last["batchId"] + 1), batchId=last["batchId"]))
+      print("batch={batchId} leftRows={left} rightRows={right}".format(**samples[-1]))
+      next_sample = last["batchId"] + every
+    time.sleep(0.5)
+  return samples
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows-per-second", type=int, default=2000)
+  parser.add_argument("--drivers", type=int, default=10000)
+  parser.add_argument("--watermark", default="30 seconds")
+  parser.add_argument("--bound", default="30 seconds")
+  parser.add_argument("--batches", type=int, default=240)
+  parser.add_argument("--trigger-seconds", type=int, default=2)
+  parser.add_argument("--side-every", type=int, default=20)
+  parser.add_argument("--output", default="bench_join.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Join benchmark", conf={"spark.sql.streaming.numRecentProgressUpdates": args.batches + 10})
+  rides = parse_csv_value(taxi_ride_values(spark.readStream.format("rate") \
+    .option("rowsPerSecond", args.rows_per_second).load(), args.drivers), taxiRidesSchema, \
+    overrides={"timestamp": current_timestamp()})
+  fares = parse_csv_value(taxi_fare_values(spark.readStream.format("rate") \
+    .option("rowsPerSecond", args.rows_per_second).load(), args.drivers), taxiFaresSchema, \
+    overrides={"timestamp": current_timestamp()})
+  checkpoint = tempfile.mkdtemp(prefix="bench_join_")
+  query = ride_fare_join(rides, fares, args.watermark, args.watermark, args.bound) \
+    .writeStream \
+    .format("noop") \
+    .outputMode("append") \
+    .option("checkpointLocation", checkpoint) \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+
+  sides = sample_side_rows(spark, query, checkpoint, args.batches, args.side_every)
+  progress = run_batches(query, args.batches)
+
+  joins = [(p["batchId"], p["stateOperators"][0], p) for p in progress if p.get("stateOperators")]
+  state_rows = [op["numRowsTotal"] for _, op, _ in joins]
+  result = {
+    "arguments": vars(args),
+    "batches": len(joins),
+    "stateRows": [{"batchId": batch_id, "rows": op["numRowsTotal"], "evicted": op["numRowsRemoved"], \
+                   "droppedByWatermark": op["numRowsDroppedByWatermark"], "memoryBytes": op["memoryUsedBytes"], \
+                   "joinedRows": p.get("sink", {}).get("numOutputRows")} for batch_id, op, p in joins],
+    "sideRows": sides,
+    "evictedTotal": sum(op["numRowsRemoved"] for _, op, _ in joins),
+    # flat state: the last quarter holds about as many rows as the second one
+    "stateRowsSecondQuarter": segment_mean(state_rows, 0.25, 0.5),
+    "stateRowsLastQuarter": segment_mean(state_rows, 0.75, 1.0),
+    "batchDurationMs": summarize([p["durationMs"]["triggerExecution"] for _, _, p in joins]),
+  }
+  print("state rows: second quarter {stateRowsSecondQuarter} last quarter {stateRowsLastQuarter} " \
+        "evicted {evictedTotal}".format(**result))
+  write_results(args.output, result)
@@ -0,0 +1,62 @@
+import argparse
+import tempfile
+import time
+from pyspark.sql.functions import *
+from bench_common import local_spark, summarize, write_results
+from bench_triggers import rides_from_rate
+
+# Local benchmark of append versus update output mode for the driverId window count. Rides carry
+# their rate-source time as event time; every emitted (driverId, window) row records the newest
+# ride it counts, and its latency is the time the batch was written minus that ride's time.
+# Append holds a window back until the watermark passes its end, update writes it on every change.
+# Usage: python bench_output_mode.py --rows-per-second 5000 --seconds 120 --output bench_output_mode.json
+
+class LatencySink:
+  """foreachBatch function that computes the batch and records per-row latencies."""
+
+  def __init__(self):
+    self.latencies, self.rows, self.keys = [], 0, set()
+
+  def __call__(self, batch_df, batch_id):
+    rows = batch_df.select("driverId", expr("unix_millis(window.start)").alias("windowStart"), \
+                           expr("unix_millis(latestEvent)").alias("latestEvent")).collect()
+    written_ms = int(time.time() * 1000)
+    self.latencies += [written_ms - row.latestEvent for row in rows]
+    self.rows += len(rows)
+    self.keys.update((row.driverId, row.windowStart) for row in rows)
+
+def run(spark, mode, args):
+  # the consumer's window count, plus the newest event of each window to measure against
+  counts = rides_from_rate(spark, args) \
+    .withWatermark("timestamp", args.watermark) \
+    .groupBy("driverId", window("timestamp", args.window, args.slide)) \
+    .agg(count(lit(1)).alias("count"), max("timestamp").alias("latestEvent"))
+  sink = LatencySink()
+  query = counts.writeStream \
+    .outputMode(mode) \
+    .foreachBatch(sink) \
+    .option("checkpointLocation", tempfile.mkdtemp(prefix="bench_output_mode_")) \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+  time.sleep(args.seconds)
+  query.stop()
+  return {"outputMode": mode, "rows": sink.rows, "windows": len(sink.keys), \
+          "rowsPerWindow": sink.rows / float(len(sink.keys)) if sink.keys else None, \
+          "latencyMs": summarize(sink.latencies)}
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows-per-second", type=int, default=5000)
+  parser.add_argument("--seconds", type=int, default=120, help="run time of each output mode")
+  parser.add_argument("--window", default="10 seconds")
+  parser.add_argument("--slide", default="5 seconds")
+  parser.add_argument("--watermark", default="10 seconds")
+  parser.add_argument("--trigger-seconds", type=int, default=1)
+  parser.add_argument("--output", default="bench_output_mode.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Output mode benchmark")
+  results = [run(spark, mode, args) for mode in ["append", "update"]]
+  for result in results:
+    print("{outputMode}: rows={rows} windows={windows} rowsPerWindow={rowsPerWindow} latencyMs={latencyMs}".format(**result))
+  write_results(args.output, {"arguments": vars(args), "results": results})
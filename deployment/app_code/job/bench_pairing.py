@@ -0,0 +1,77 @@
+import argparse
+import tempfile
+from pyspark.sql.functions import col, expr, floor, lit, when
+from bench_common import local_spark, percentile, run_batches, summarize, write_results
+from ride_pairing import pair_ride_events
+
+# Local benchmark of the START/END pairing: state rows (open rides), state memory per open ride
+# and trips emitted per batch. Even rate source values are START events of ride value/2, odd values
+# the END of the ride started --open-rides rides earlier, so about that many rides are open at a
+# time; every --missing-every-th ride never ends and is flushed by its timeout. Every --null-every-th
+# ride has a null passengerCnt (it must still pair) and the next one an END without driverId (it is
+# dropped and the ride flushed as incomplete), the query must survive both.
+# Usage: python bench_pairing.py --rows-per-second 5000 --open-rides 20000 --output bench_pairing.json
+
+def ride_events(source, open_rides, missing_every, null_every=0):
+  value, ts = col("value"), col("timestamp")
+  is_start = value % 2 == 0
+  ride_id = when(is_start, floor(value / 2)).otherwise(floor(value / 2) - open_rides)
+
+  def coordinate(base, salt):
+    return lit(base) + (ride_id * salt % 10000) / 10000.0 * 0.3
+
+  return source.select(ride_id.cast("long").alias("rideId"), \
+    when(is_start, lit("START")).otherwise(lit("END")).alias("isStart"), \
+    when(is_start, lit(None)).otherwise(ts).cast("timestamp").alias("endTime"), \
+    when(is_start, ts).otherwise(ts - expr("INTERVAL 1 MINUTE")).alias("startTime"), \
+    coordinate(-74.05, 7919).cast("float").alias("startLon"), coordinate(40.6, 104729).cast("float").alias("startLat"), \
+    coordinate(-74.05, 1299709).cast("float").alias("endLon"), coordinate(40.6, 15485863).cast("float").alias("endLat"), \
+    when(null_rides(ride_id, null_every, 1), lit(None)).otherwise(ride_id % 6 + 1).cast("short").alias("passengerCnt"), \
+    when(null_rides(ride_id, null_every, 2) & ~is_start, lit(None)).otherwise(ride_id % 10000 + 2013000000) \
+      .cast("long").alias("driverId")) \
+    .where((col("rideId") >= 0) & (is_start | (col("rideId") % missing_every != 0)))
+
+def null_rides(ride_id, null_every, offset):
+  return (ride_id % null_every == offset) if null_every else lit(False)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows-per-second", type=int, default=5000)
+  parser.add_argument("--open-rides", type=int, default=20000)
+  parser.add_argument("--missing-every", type=int, default=20)
+  parser.add_argument("--null-every", type=int, default=50, help="0 leaves every field set")
+  parser.add_argument("--watermark", default="10 seconds")
+  parser.add_argument("--max-ride-duration", default="2 minutes")
+  parser.add_argument("--batches", type=int, default=60)
+  parser.add_argument("--trigger-seconds", type=int, default=2)
+  parser.add_argument("--output", default="bench_pairing.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Pairing benchmark", conf={"spark.sql.streaming.numRecentProgressUpdates": args.batches + 10})
+  source = spark.readStream.format("rate").option("rowsPerSecond", args.rows_per_second).load()
+  trips = pair_ride_events(ride_events(source, args.open_rides, args.missing_every, args.null_every), \
+                           args.watermark, args.max_ride_duration)
+  query = trips.writeStream \
+    .format("noop") \
+    .outputMode("append") \
+    .option("checkpointLocation", tempfile.mkdtemp(prefix="bench_pairing_")) \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+  progress = [p for p in run_batches(query, args.batches)[1:] if p.get("stateOperators")]
+
+  state = [p["stateOperators"][0] for p in progress]
+  # the state store map is what an open ride costs, measured once the number of open rides has settled
+  settled = [op for op in state[len(state) // 2:] if op["numRowsTotal"]]
+  per_ride = [op["memoryUsedBytes"] / float(op["numRowsTotal"]) for op in settled]
+  result = {
+    "arguments": vars(args),
+    "batches": len(progress),
+    "openRides": [op["numRowsTotal"] for op in state],
+    "stateMemoryBytes": [op["memoryUsedBytes"] for op in state],
+    "memoryBytesPerOpenRide": percentile(per_ride, 50),
+    "trips": sum(p.get("sink", {}).get("numOutputRows", 0) for p in progress),
+    "batchDurationMs": summarize([p["durationMs"]["triggerExecution"] for p in progress]),
+  }
+  print("open rides p50={} memory per open ride p50={} bytes, {} trips".format( \
+    percentile(result["openRides"], 50), result["memoryBytesPerOpenRide"], result["trips"]))
+  write_results(args.output, result)
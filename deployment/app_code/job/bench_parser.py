@@ -0,0 +1,107 @@
+import argparse
+from pyspark.sql.types import *
+from pyspark.sql.functions import *
+from bench_common import local_spark, run_batches, summarize, write_results
+from stream_parser import parse_csv_value
+from taxi_schema import taxiRidesSchema
+
+# Local benchmark: per-field withColumn loop versus the single projection parsers (JVM and pandas).
+# Before timing, the pandas parser must convert INTEGER_CASES exactly like the JVM cast.
+# Usage: python bench_parser.py --widths 10 50 200 --output bench_parser.json
+#        python bench_parser.py --taxi --messy-fraction 0.1 --parsers single_select pandas
+
+FIELD_TYPES = [LongType(), FloatType(), StringType(), TimestampType()]
+# 19-digit longs and their overflow, decimals, exponents, padding and other text
+INTEGER_CASES = ["42", " -7 ", "+3", "007", "12.7", "-12.7", "12.", ".5", "+", "", "1e3", "12e", "0x10", "n/a", \
+                 "9223372036854775807", "-9223372036854775808", "9223372036854775808", "1234567890123456789", \
+                 "-1234567890123456789", "99999999999999999999", "000000000000000000042", "2147483648", "32768"]
+
+def synthetic_schema(width):
+  return StructType([StructField("f{}".format(idx), FIELD_TYPES[idx % len(FIELD_TYPES)]) for idx in range(width)])
+
+def synthetic_value(sdf, schema, messy_fraction=0.0, keep=()):
+  items = []
+  for idx, field in enumerate(schema):
+    if isinstance(field.dataType, (LongType, IntegerType, ShortType)):
+      item = ((col("value") + idx) % 30000).cast("string")
+    elif isinstance(field.dataType, (FloatType, DoubleType)):
+      item = (col("value") * 0.5).cast("string")
+    elif isinstance(field.dataType, TimestampType):
+      item = date_format(col("timestamp"), "yyyy-MM-dd HH:mm:ss")
+    else:
+      item = lit("START")
+    if messy_fraction > 0:
+      # padded, empty and unparsable values, the cases where the two parsers differ most in cost
+      item = when(rand() < messy_fraction, element_at(array(lit(" n/a "), lit(""), concat(lit(" "), item)), \
+                                                    (rand() * 3).cast("int") + 1)).otherwise(item)
+    items.append(item)
+  return sdf.select(concat_ws(",", *items).alias("value"), *keep)
+
+def parse_with_columns(sdf, schema):
+  # the original msk_consumer.py loop, kept here as the baseline
+  col = split(sdf['value'], ',')
+  for idx, field in enumerate(schema):
+    sdf = sdf.withColumn(field.name, col.getItem(idx).cast(field.dataType))
+  return sdf.select([field.name for field in schema])
+
+PARSERS = {
+  "withColumn_loop": parse_with_columns,
+  "single_select": lambda sdf, schema: parse_csv_value(sdf, schema, method="split"),
+  "from_csv": lambda sdf, schema: parse_csv_value(sdf, schema, method="from_csv"),
+  "pandas": lambda sdf, schema: parse_csv_value(sdf, schema, method="pandas"),
+}
+
+def check_integer_cases(spark):
+  schema = StructType([StructField("long", LongType()), StructField("int", IntegerType()), \
+                       StructField("short", ShortType())])
+  values = spark.createDataFrame([(",".join([case] * 3),) for case in INTEGER_CASES], "value string")
+  jvm, pandas = [parse_csv_value(values, schema, method=method, keep=[col("value")]).collect() \
+                 for method in ("split", "pandas")]
+  differ = [(row.value, tuple(row), tuple(other)) for row, other in zip(jvm, pandas) if row != other]
+  if differ:
+    raise AssertionError("pandas integer parsing differs from the JVM cast: {}".format(differ))
+
+def run(spark, name, schema, args):
+  source = spark.readStream.format("rate").option("rowsPerSecond", args.rows_per_second).load()
+  parsed = PARSERS[name](synthetic_value(source, schema, args.messy_fraction), schema)
+  query = parsed.writeStream \
+    .format("noop") \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+  # the first batch includes codegen warm-up, leave it out of the figures
+  progress = run_batches(query, args.batches + 1)[1:]
+  return {
+    "parser": name,
+    "fields": len(schema),
+    "messyFraction": args.messy_fraction,
+    "batches": len(progress),
+    "queryPlanningMs": summarize([p["durationMs"].get("queryPlanning", 0) for p in progress]),
+    "addBatchMs": summarize([p["durationMs"].get("addBatch", 0) for p in progress]),
+    "triggerExecutionMs": summarize([p["durationMs"].get("triggerExecution", 0) for p in progress]),
+    "processedRowsPerSecond": summarize([p["processedRowsPerSecond"] for p in progress]),
+  }
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--widths", type=int, nargs="*", default=[10, 50, 200])
+  parser.add_argument("--taxi", action="store_true", help="also run the real taxiRidesSchema")
+  parser.add_argument("--messy-fraction", type=float, default=0.0)
+  parser.add_argument("--parsers", nargs="+", default=list(PARSERS), choices=list(PARSERS))
+  parser.add_argument("--rows-per-second", type=int, default=20000)
+  parser.add_argument("--trigger-seconds", type=int, default=2)
+  parser.add_argument("--batches", type=int, default=20)
+  parser.add_argument("--output", default="bench_parser.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Parser benchmark")
+  if "pandas" in args.parsers:
+    check_integer_cases(spark)
+  schemas = [synthetic_schema(width) for width in args.widths] + ([taxiRidesSchema] if args.taxi else [])
+  results = []
+  for schema in schemas:
+    for name in args.parsers:
+      result = run(spark, name, schema, args)
+      print("{parser:16} fields={fields:4} planning p50={p:>6}ms addBatch p50={a:>6}ms".format( \
+        p=result["queryPlanningMs"]["p50"], a=result["addBatchMs"]["p50"], **result))
+      results.append(result)
+  write_results(args.output, results)
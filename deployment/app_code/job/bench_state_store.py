@@ -0,0 +1,63 @@
+import argparse
+import tempfile
+from pyspark.sql.functions import col
+from bench_common import local_spark, run_batches, summarize, write_results
+from rides_pipeline import driver_window_counts
+from state_store import STATE_STORE_PROVIDERS, state_store_conf, state_operator_summary
+
+# Local benchmark: HDFS-backed versus RocksDB state store for the driverId window count,
+# sweeping the number of distinct drivers.
+# Usage: python bench_state_store.py --drivers 10000 100000 1000000 --output bench_state_store.json
+
+def used_heap_bytes(spark):
+  # local mode runs the executors inside the driver JVM
+  runtime = spark._jvm.java.lang.Runtime.getRuntime()
+  return runtime.totalMemory() - runtime.freeMemory()
+
+def run(spark, provider, drivers, args):
+  for key, value in state_store_conf(provider).items():
+    spark.conf.set(key, value)
+  rides = spark.readStream.format("rate").option("rowsPerSecond", args.rows_per_second).load() \
+    .select((col("value") % drivers).alias("driverId"), col("timestamp"))
+  counts = driver_window_counts(rides)
+  query = counts.writeStream \
+    .format("noop") \
+    .outputMode("append") \
+    .option("checkpointLocation", tempfile.mkdtemp(prefix="bench_state_")) \
+    .trigger(processingTime="{} seconds".format(args.trigger_seconds)) \
+    .start()
+  progress = run_batches(query, args.batches + 1)[1:]
+  spark._jvm.System.gc()
+  state = [state_operator_summary(p)[0] for p in progress if p.get("stateOperators")]
+  return {
+    "provider": provider,
+    "drivers": drivers,
+    "batches": len(progress),
+    "batchDurationMs": summarize([p["durationMs"]["triggerExecution"] for p in progress]),
+    "commitTimeMs": summarize([s["commitTimeMs"] for s in state]),
+    "stateRows": max([s["numRowsTotal"] for s in state] or [0]),
+    "stateMemoryBytes": max([s["memoryUsedBytes"] for s in state] or [0]),
+    "heapUsedBytes": used_heap_bytes(spark),
+  }
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--drivers", type=int, nargs="+", default=[10000, 100000, 1000000])
+  parser.add_argument("--providers", nargs="+", default=list(STATE_STORE_PROVIDERS), choices=list(STATE_STORE_PROVIDERS))
+  parser.add_argument("--rows-per-second", type=int, default=200000)
+  parser.add_argument("--trigger-seconds", type=int, default=5)
+  parser.add_argument("--batches", type=int, default=10)
+  parser.add_argument("--shuffle-partitions", type=int, default=8)
+  parser.add_argument("--output", default="bench_state_store.json")
+  args = parser.parse_args()
+
+  spark = local_spark("State store benchmark", args.shuffle_partitions)
+  results = []
+  for drivers in args.drivers:
+    for provider in args.providers:
+      result = run(spark, provider, drivers, args)
+      print("{provider:8} drivers={drivers:8} stateRows={stateRows:9} heap={heapUsedBytes:12} " \
+            "batch p50={b}ms commit p50={c}ms".format( \
+        b=result["batchDurationMs"]["p50"], c=result["commitTimeMs"]["p50"], **result))
+      results.append(result)
+  write_results(args.output, results)
@@ -0,0 +1,118 @@
+import argparse
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pyspark.sql.functions import *
+from bench_common import local_spark, run_batches, summarize, write_results
+from bench_parser import synthetic_value
+from rides_pipeline import driver_window_counts
+from stream_parser import parse_csv_value
+from taxi_schema import taxiRidesSchema
+from triggers import apply_trigger
+
+# Local benchmark of the trigger modes on taxi-ride CSV records.
+#  - map-only parse and forward (the continuous variant) under every trigger: throughput and sink lag,
+#    i.e. wall clock time minus the source row time when the row becomes visible in the sink
+#  - the driverId window count under the micro-batch triggers: throughput and batch duration
+#  - availableNow drains a pre-generated backlog of files and reports the drain time
+# Usage: python bench_triggers.py --rows-per-second 5000 --seconds 60 --output bench_triggers.json
+
+class SinkLagProbe(threading.Thread):
+  def __init__(self, spark, table, interval):
+    super().__init__(daemon=True)
+    self.spark, self.table, self.interval = spark, table, interval
+    self.lags, self.rows, self.running = [], 0, True
+
+  def run(self):
+    while self.running:
+      try:
+        row = self.spark.sql("SELECT count(*) AS rows, max(sourceTime) AS latest FROM {}".format(self.table)).first()
+      except Exception:
+        row = None
+      if row and row.rows > self.rows:
+        self.rows = row.rows
+        self.lags.append((datetime.now() - row.latest).total_seconds() * 1000)
+      time.sleep(self.interval)
+
+def rides_from_rate(spark, args):
+  # a continuous query keeps a core busy per source partition, one core is left for the sink lag probe
+  cores = spark.sparkContext.defaultParallelism
+  partitions = cores - 1 if cores > 1 else 1
+  rate = spark.readStream.format("rate").option("rowsPerSecond", args.rows_per_second) \
+    .option("numPartitions", partitions).load()
+  values = synthetic_value(rate, taxiRidesSchema, keep=[col("timestamp").alias("sourceTime")])
+  return parse_csv_value(values, taxiRidesSchema, overrides={"timestamp": col("sourceTime")}) \
+    .withColumn("sourceTime", col("timestamp"))
+
+def map_only(spark, mode, interval, args):
+  table = "map_only_{}".format(mode)
+  rides = rides_from_rate(spark, args)
+  # the record is encoded as for Kafka, only its size is kept so the memory sink stays small
+  writer = rides.select(length(to_json(struct("*"))).alias("bytes"), "sourceTime") \
+    .writeStream.format("memory").queryName(table).outputMode("append")
+  query = apply_trigger(writer, mode, interval).start()
+  probe = SinkLagProbe(spark, table, args.probe_seconds)
+  probe.start()
+  started = time.time()
+  time.sleep(args.seconds)
+  probe.running = False
+  query.stop()
+  elapsed = time.time() - started
+  return {"pipeline": "map_only", "trigger": mode, "interval": interval, "rows": probe.rows, \
+          "rowsPerSecond": probe.rows / elapsed, "sinkLagMs": summarize(probe.lags)}
+
+def aggregation(spark, mode, interval, args):
+  writer = driver_window_counts(rides_from_rate(spark, args)).writeStream.format("noop").outputMode("append") \
+    .option("checkpointLocation", tempfile.mkdtemp(prefix="bench_trigger_"))
+  query = apply_trigger(writer, mode, interval).start()
+  progress = run_batches(query, args.batches + 1)[1:]
+  return {"pipeline": "window_count", "trigger": mode, "interval": interval, \
+          "processedRowsPerSecond": summarize([p["processedRowsPerSecond"] for p in progress]), \
+          "batchDurationMs": summarize([p["durationMs"]["triggerExecution"] for p in progress])}
+
+def available_now(spark, args):
+  backlog = tempfile.mkdtemp(prefix="bench_backlog_")
+  rows = spark.range(args.backlog_rows, numPartitions=args.backlog_files) \
+    .select(col("id").alias("value"), current_timestamp().alias("timestamp"))
+  synthetic_value(rows, taxiRidesSchema).write.mode("overwrite").text(backlog)
+  results = []
+  for pipeline in ["map_only", "window_count"]:
+    rides = parse_csv_value(spark.readStream.format("text").option("maxFilesPerTrigger", args.max_files_per_trigger) \
+                            .load(backlog), taxiRidesSchema)
+    output = rides.select(to_json(struct("*")).alias("value")) if pipeline == "map_only" else driver_window_counts(rides)
+    started = time.time()
+    query = apply_trigger(output.writeStream.format("noop").outputMode("append") \
+      .option("checkpointLocation", tempfile.mkdtemp(prefix="bench_trigger_")), "availableNow").start()
+    query.awaitTermination()
+    elapsed = time.time() - started
+    results.append({"pipeline": pipeline, "trigger": "availableNow", "rows": args.backlog_rows, \
+                    "drainSeconds": elapsed, "rowsPerSecond": args.backlog_rows / elapsed, \
+                    "batches": len(query.recentProgress)})
+  return results
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows-per-second", type=int, default=5000)
+  parser.add_argument("--seconds", type=int, default=60, help="run time of each map-only query")
+  parser.add_argument("--intervals", nargs="+", default=["1 second", "5 seconds"], help="processingTime intervals")
+  parser.add_argument("--continuous-interval", default="1 second")
+  parser.add_argument("--batches", type=int, default=10)
+  parser.add_argument("--backlog-rows", type=int, default=5000000)
+  parser.add_argument("--backlog-files", type=int, default=50)
+  parser.add_argument("--max-files-per-trigger", type=int, default=5)
+  parser.add_argument("--probe-seconds", type=float, default=0.1)
+  parser.add_argument("--cores", type=int, \
+    help="local cores, by default all; the continuous mode needs at least 2, one of them for the sink lag probe")
+  parser.add_argument("--output", default="bench_triggers.json")
+  args = parser.parse_args()
+
+  spark = local_spark("Trigger benchmark", conf={"spark.master": "local[{}]".format(args.cores)} if args.cores else None)
+  micro_batch = [("default", None)] + [("processingTime", interval) for interval in args.intervals]
+  results = [map_only(spark, mode, interval, args) for mode, interval in micro_batch]
+  results.append(map_only(spark, "continuous", args.continuous_interval, args))
+  results += [aggregation(spark, mode, interval, args) for mode, interval in micro_batch]
+  results += available_now(spark, args)
+  for result in results:
+    print(result)
+  write_results(args.output, results)
@@ -0,0 +1,105 @@
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from bench_common import local_spark, review_rows, write_results
+from event_log_report import analyze, event_logs
+from word_tokenizer import heavy_hitters, legacy_word_counts, token_arrays, word_counts
+
+# Local benchmark of the wordcount variants on generated review Parquet at several scales (GB of
+# review_body text): the original query, the regex tokenizer with Spark's partial aggregation or
+# the per-partition pandas count, each with and without salting the heavy hitters. Wall time is
+# the median of --repeats runs writing to the noop sink; shuffle write, spill and the task skew
+# (max / median task time) of its most skewed stage come from the event log. The regex tokenizer
+# must split TOKENIZER_CASES into their words and the regex variants must agree on the word count
+# checksum.
+# Usage: python bench_wordcount.py --scales-gb 1 10 --data-dir /tmp/reviews --output bench_wordcount.json
+
+BODY_BYTES_PER_ROW = 630
+# review text and its words, <br /> tags after a space or punctuation must not leave a "br"
+TOKENIZER_CASES = [("Nice <br />more", ["nice", "more"]), ("Nice.<br/>More!", ["nice", "more"]), \
+                   ("great, <br /><br>great", ["great", "great"]), ("end <br />", ["end"]), \
+                   ("a<b 'quoted' don't", ["a", "b", "quoted", "don't"])]
+
+def variants(df, salt_buckets, top):
+  def salted(combine):
+    return lambda: word_counts(df, combine=combine, salt_buckets=salt_buckets, heavy=heavy_hitters(df, top=top))
+
+  return [("legacy", lambda: legacy_word_counts(df)), \
+          ("regex", lambda: word_counts(df)), \
+          ("regex+salt", salted("spark")), \
+          ("partition", lambda: word_counts(df, combine="partition")), \
+          ("partition+salt", salted("partition"))]
+
+def checksum(counts):
+  return counts.selectExpr("count(*) AS words", "sum(`count`) AS tokens", \
+                          "sum(xxhash64(words, `count`)) AS hash").first().asDict()
+
+def check_tokenizer(spark):
+  df = spark.createDataFrame([(text,) for text, _ in TOKENIZER_CASES], "review_body string")
+  found = [[token for token in row.tokens if token] for row in token_arrays(df).collect()]
+  differ = [(text, expected, tokens) for (text, expected), tokens in zip(TOKENIZER_CASES, found) if tokens != expected]
+  if differ:
+    raise AssertionError("regex tokenizer splits differ from the expected words: {}".format(differ))
+
+def reviews(spark, data_dir, scale_gb):
+  path = os.path.join(data_dir, "reviews_{}gb".format(scale_gb))
+  if not os.path.exists(path):
+    rows = int(scale_gb * 1024 ** 3 / BODY_BYTES_PER_ROW)
+    review_rows(spark, rows, partitions=max(8, int(scale_gb * 8))).write.parquet(path)
+  return path
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--scales-gb", type=float, nargs="+", default=[1, 10])
+  parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "bench_reviews"), \
+    help="generated Parquet is kept here and reused by later runs")
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--salt-buckets", type=int, default=16)
+  parser.add_argument("--heavy-hitters", type=int, default=50)
+  parser.add_argument("--shuffle-partitions", type=int, default=200)
+  parser.add_argument("--output", default="bench_wordcount.json")
+  args = parser.parse_args()
+
+  log_dir = tempfile.mkdtemp(prefix="bench_wordcount_events_")
+  spark = local_spark("Wordcount benchmark", args.shuffle_partitions, \
+                      {"spark.eventLog.enabled": "true", "spark.eventLog.dir": "file://" + log_dir})
+  check_tokenizer(spark)
+  results = []
+  for scale in args.scales_gb:
+    path = reviews(spark, args.data_dir, scale)
+    df = spark.read.parquet(path)
+    text_bytes = df.selectExpr("sum(length(review_body))").first()[0]
+    checksums = {}
+    for name, build in variants(df, args.salt_buckets, args.heavy_hitters):
+      timings = []
+      for repeat in range(args.repeats):
+        spark.sparkContext.setJobDescription("{}GB {} #{}".format(scale, name, repeat))
+        started = time.time()
+        build().write.format("noop").mode("overwrite").save()
+        timings.append(time.time() - started)
+      spark.sparkContext.setJobDescription("{}GB {} check".format(scale, name))
+      if name != "legacy":
+        checksums[name] = checksum(build())
+      results.append({"scaleGb": scale, "variant": name, "textBytes": text_bytes, \
+                      "seconds": statistics.median(timings), "secondsAll": timings, "checksum": checksums.get(name)})
+      print("{}GB {:15} {:8.2f}s".format(scale, name, results[-1]["seconds"]))
+    if len({tuple(sorted(value.items())) for value in checksums.values()}) > 1:
+      raise AssertionError("word counts differ between variants: {}".format(checksums))
+  spark.stop()
+
+  # shuffle, spill and skew per variant from the event log, averaged over the repeats
+  stages = [stage for files in event_logs(log_dir) for stage in analyze(files)["stages"]]
+  for result in results:
+    prefix = "{}GB {} #".format(result["scaleGb"], result["variant"])
+    runs = [stage for stage in stages if (stage["job"] or "").startswith(prefix)]
+    result.update(shuffleWriteBytes=sum(stage["shuffleWriteBytes"] for stage in runs) // args.repeats, \
+                  spillBytes=sum(stage["spillBytes"] for stage in runs) // args.repeats, \
+                  maxTaskSkew=max([stage["skew"] for stage in runs if stage["skew"]], default=None))
+  for result in results:
+    print("{scaleGb}GB {variant:15} {seconds:8.2f}s shuffleWrite={shuffleWriteBytes} spill={spillBytes} " \
+          "maxTaskSkew={maxTaskSkew}".format(**result))
+  write_results(args.output, {"arguments": vars(args), "results": results})
+  shutil.rmtree(log_dir, ignore_errors=True)
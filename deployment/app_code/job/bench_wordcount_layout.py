@@ -0,0 +1,98 @@
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from pyspark.sql.functions import col
+from bench_common import local_spark, write_results
+from bench_wordcount import reviews
+from event_log_report import analyze, event_logs
+from word_tokenizer import legacy_word_counts, word_counts
+from wordcount_table import read_schemas, top_words, write_counts
+
+# Local benchmark of the wordcount input scan and output layout on generated review Parquet.
+#  - scan: input bytes of reading whole review rows, of the original query and of the wordcount
+#    query, with the ReadSchema of each plan
+#  - layout: the same counts written with the default writer and with write_counts (sorted on count,
+#    --target-file-mb files, optionally --prefix-length folders): file count and bytes, and the
+#    read latency and input bytes of a top-100 query, a full sort for the default layout and
+#    top_words for the sorted one, whose result must match a full sort of the same table
+# Usage: python bench_wordcount_layout.py --scale-gb 1 --target-file-mb 16 --output bench_wordcount_layout.json
+
+def table_files(path):
+  sizes = [os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) \
+           for name in files if name.startswith("part-")]
+  return {"files": len(sizes), "bytes": sum(sizes)}
+
+def timed(spark, description, action, repeats):
+  timings = []
+  for repeat in range(repeats):
+    spark.sparkContext.setJobDescription("{} #{}".format(description, repeat))
+    started = time.time()
+    result = action()
+    timings.append(time.time() - started)
+  return statistics.median(timings), result
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--scale-gb", type=float, default=1)
+  parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "bench_reviews"))
+  parser.add_argument("--target-file-mb", type=int, default=16)
+  parser.add_argument("--prefix-length", type=int, default=0)
+  parser.add_argument("--compression", default="snappy")
+  parser.add_argument("--top", type=int, default=100)
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--output", default="bench_wordcount_layout.json")
+  args = parser.parse_args()
+
+  log_dir = tempfile.mkdtemp(prefix="bench_layout_events_")
+  work_dir = tempfile.mkdtemp(prefix="bench_layout_")
+  spark = local_spark("Wordcount layout benchmark", 200, \
+                      {"spark.eventLog.enabled": "true", "spark.eventLog.dir": "file://" + log_dir})
+  path = reviews(spark, args.data_dir, args.scale_gb)
+  reviews_df = spark.read.parquet(path)
+
+  scans = {"full rows": reviews_df, "original query": legacy_word_counts(reviews_df), \
+           "wordcount": word_counts(reviews_df.select("review_body"))}
+  results = {"scan": {}, "layout": {}}
+  for name, df in scans.items():
+    seconds, _ = timed(spark, "scan " + name, lambda: df.write.format("noop").mode("overwrite").save(), 1)
+    results["scan"][name] = {"readSchema": read_schemas(df), "seconds": seconds}
+
+  tables = {"default": os.path.join(work_dir, "default"), "sorted": os.path.join(work_dir, "sorted")}
+  counts = word_counts(reviews_df.select("review_body")).cache()
+  counts.count()
+  counts.write.parquet(tables["default"])
+  write_counts(counts, tables["sorted"], args.compression, args.prefix_length, args.target_file_mb)
+
+  def full_sort(table):
+    return lambda: spark.read.parquet(table).select("words", "count") \
+      .orderBy(col("count").desc(), col("words")).limit(args.top).collect()
+
+  for name, read in [("default", full_sort(tables["default"])), \
+                     ("sorted", lambda: top_words(spark, tables["sorted"], args.top))]:
+    seconds, rows = timed(spark, "top " + name, read, args.repeats)
+    results["layout"][name] = dict(table_files(tables[name]), topSeconds=seconds, \
+                                   top=[(row.words, row["count"]) for row in rows])
+  spark.sparkContext.setJobDescription("check")
+  if results["layout"]["sorted"]["top"] != [(row.words, row["count"]) for row in full_sort(tables["sorted"])()]:
+    raise AssertionError("top_words differs from a full sort of the sorted table")
+  spark.stop()
+
+  stages = [stage for files in event_logs(log_dir) for stage in analyze(files)["stages"]]
+
+  def input_bytes(description, repeats):
+    return sum(stage["inputBytes"] for stage in stages if (stage["job"] or "").startswith(description + " #")) \
+      // repeats
+
+  for name, scan in results["scan"].items():
+    scan["inputBytes"] = input_bytes("scan " + name, 1)
+    print("scan {:15} {:>14} bytes {:7.2f}s {}".format(name, scan["inputBytes"], scan["seconds"], scan["readSchema"]))
+  for name, layout in results["layout"].items():
+    layout["topInputBytes"] = input_bytes("top " + name, args.repeats)
+    print("layout {:8} files={files} bytes={bytes} top{top} read={topSeconds:.3f}s inputBytes={topInputBytes}".format( \
+      name, top=args.top, **{key: value for key, value in layout.items() if key != "top"}))
+  write_results(args.output, dict(results, arguments=vars(args)))
+  shutil.rmtree(log_dir, ignore_errors=True)
+  shutil.rmtree(work_dir, ignore_errors=True)
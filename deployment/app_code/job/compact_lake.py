@@ -0,0 +1,160 @@
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pyspark.sql import SparkSession
+from hadoop_fs import delete, list_files, read_text, rename, write_text_atomic
+from lake_sink import PARTITION_COLUMNS
+
+# Compacts the small files of a lake_sink.py table. Closed date/hour partitions are bin-packed
+# into files of about --target-mb, then the streaming sink's _spark_metadata log is rewritten to
+# list the new files instead of the ones they replace, and the replaced files are deleted.
+#
+# Spark readers of the table path only read the files in _spark_metadata, so the log is updated
+# in place: the latest compact file and the batch files after it are rewritten atomically, no new
+# batch id is added (the sink would take it for an already committed batch and skip its data).
+# Run it while the consumer is stopped, e.g. between --trigger availableNow runs; it aborts when
+# the sink commits a batch while it runs.
+# Usage: python compact_lake.py s3://${S3BUCKET}/lake/driver_counts --target-mb 128 --grace-minutes 15
+
+LOG_DIR = "_spark_metadata"
+LOG_VERSION = "v1"
+
+def log_batch_files(spark, table_path):
+  """batch id -> log file name, e.g. {8: "8", 9: "9.compact", 10: "10"}."""
+  batches = {}
+  for status in list_files(spark, "{}/{}".format(table_path, LOG_DIR)):
+    name = status["name"]
+    batch_id = name[:-len(".compact")] if name.endswith(".compact") else name
+    if batch_id.isdigit():
+      batches[int(batch_id)] = name
+  return batches
+
+def read_log(spark, table_path):
+  """The log files a reader merges (latest compact file and the batches after it),
+  as (latest batch id, {log file name: [file entries]})."""
+  batches = log_batch_files(spark, table_path)
+  if not batches:
+    return None, {}
+  latest = max(batches)
+  compacts = [batch_id for batch_id, name in batches.items() if name.endswith(".compact")]
+  first = max(compacts) if compacts else min(batches)
+  entries = {}
+  for batch_id in range(first, latest + 1):
+    name = batches[batch_id]
+    lines = read_text(spark, "{}/{}/{}".format(table_path, LOG_DIR, name)).splitlines()
+    if not lines or lines[0] != LOG_VERSION:
+      raise ValueError("Unsupported metadata log file {}".format(name))
+    entries[name] = [json.loads(line) for line in lines[1:] if line.strip()]
+  return latest, entries
+
+def partition_of(file_path):
+  """"date=2024-01-31/hour=7" of a data file path, None outside a date/hour partition."""
+  parts = file_path.rstrip("/").split("/")[-len(PARTITION_COLUMNS) - 1:-1]
+  if [part.partition("=")[0] for part in parts] != PARTITION_COLUMNS:
+    return None
+  return "/".join(parts)
+
+def partition_end(partition):
+  values = dict(part.split("=", 1) for part in partition.split("/"))
+  return datetime.strptime(values["date"], "%Y-%m-%d") + timedelta(hours=int(values["hour"]) + 1)
+
+def bin_pack(files, target_bytes):
+  """First-fit decreasing groups of files, each group at most target_bytes unless one file is larger."""
+  bins = []
+  for entry in sorted(files, key=lambda entry: -entry["size"]):
+    for group in bins:
+      if group["size"] + entry["size"] <= target_bytes:
+        group["files"].append(entry)
+        group["size"] += entry["size"]
+        break
+    else:
+      bins.append({"files": [entry], "size": entry["size"]})
+  return [group["files"] for group in bins if len(group["files"]) > 1]
+
+def compact_group(spark, files, partition_dir, compression):
+  """Rewrites files into one file in partition_dir and returns its log entry."""
+  staging_dir = "{}/_compacting-{}".format(partition_dir, uuid.uuid4())
+  spark.read.parquet(*[entry["path"] for entry in files]) \
+    .coalesce(1) \
+    .write \
+    .option("compression", compression) \
+    .parquet(staging_dir)
+  part = [status for status in list_files(spark, staging_dir) if status["name"].endswith(".parquet")][0]
+  target = "{}/part-compacted-{}{}".format(partition_dir, uuid.uuid4(), part["name"][part["name"].find("."):])
+  rename(spark, part["path"], target)
+  delete(spark, staging_dir, True)
+  status = list_files(spark, target)[0]
+  entry = {key: status[key] for key in ["path", "size", "isDir", "modificationTime", "blockReplication", "blockSize"]}
+  entry["action"] = "add"
+  return entry
+
+def compact(spark, table_path, target_bytes, closed_before, compression="snappy", min_files=2, dry_run=False):
+  table_path = table_path.rstrip("/")
+  latest, log = read_log(spark, table_path)
+  if latest is None:
+    print("No metadata log under {}, nothing to compact".format(table_path))
+    return []
+  by_partition = {}
+  for entries in log.values():
+    for entry in entries:
+      partition = partition_of(entry["path"])
+      if entry.get("action", "add") == "add" and partition and partition_end(partition) <= closed_before:
+        by_partition.setdefault(partition, []).append(entry)
+
+  replaced, added, report = set(), [], []
+  for partition, files in sorted(by_partition.items()):
+    if len(files) < min_files:
+      continue
+    groups = bin_pack(files, target_bytes)
+    report.append({"partition": partition, "files": len(files), "bytes": sum(entry["size"] for entry in files), \
+                   "groups": len(groups), "filesAfter": len(files) - sum(len(group) - 1 for group in groups)})
+    print("{partition}: {files} files, {bytes} bytes -> {filesAfter} files".format(**report[-1]))
+    if dry_run:
+      continue
+    for group in groups:
+      added.append(compact_group(spark, group, "{}/{}".format(table_path, partition), compression))
+      replaced.update(entry["path"] for entry in group)
+  if not added:
+    return report
+
+  if max(log_batch_files(spark, table_path)) != latest:
+    # the sink committed a batch meanwhile, leave the log alone and drop the new files
+    for entry in added:
+      delete(spark, entry["path"])
+    raise RuntimeError("The streaming sink wrote batch {} during compaction, stop the query and rerun".format( \
+      max(log_batch_files(spark, table_path))))
+  last_name = max(log, key=lambda name: int(name.split(".")[0]))
+  for name, entries in log.items():
+    kept = [entry for entry in entries if entry["path"] not in replaced]
+    if name == last_name:
+      kept += added
+    if len(kept) != len(entries) or name == last_name:
+      write_text_atomic(spark, "{}/{}/{}".format(table_path, LOG_DIR, name), \
+        "\n".join([LOG_VERSION] + [json.dumps(entry, separators=(",", ":")) for entry in kept]))
+  for path in replaced:
+    delete(spark, path)
+  return report
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("table_path")
+  parser.add_argument("--target-mb", type=float, default=128)
+  parser.add_argument("--grace-minutes", type=float, default=15, \
+    help="a partition is closed this long after its hour ended, leave room for the watermark delay")
+  parser.add_argument("--include-open-partitions", action="store_true", \
+    help="compact the current hours too, only when the stream will not write them again")
+  parser.add_argument("--min-files", type=int, default=2)
+  parser.add_argument("--compression", default="snappy")
+  parser.add_argument("--dry-run", action="store_true")
+  args = parser.parse_args()
+
+  spark = SparkSession.builder.appName("Lake compaction").config("spark.sql.session.timeZone", "UTC").getOrCreate()
+  closed_before = datetime.max if args.include_open_partitions else \
+    datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=args.grace_minutes)
+  started = time.time()
+  report = compact(spark, args.table_path, int(args.target_mb * 1024 * 1024), closed_before, \
+                   args.compression, args.min_files, args.dry_run)
+  print("{} partitions, {} -> {} files in {:.1f}s".format(len(report), sum(r["files"] for r in report), \
+    sum(r["filesAfter"] for r in report), time.time() - started))
@@ -0,0 +1,83 @@
+from pyspark.sql.streaming import StreamingQueryListener
+from pyspark.sql.streaming.state import GroupStateTimeout
+from pyspark.sql.types import LongType, StructField, StructType
+from pane_window import duration_ms
+
+# Drops repeated ride events (producer retries, a second replay) before any aggregation. Events
+# are keyed on (rideId, isStart); the first copy passes and the key is remembered for a TTL
+# measured in processing time from the first copy, then evicted by its timeout. This is not a
+# watermark horizon: a copy arriving more than the TTL after the first, such as a replay run
+# again later, passes, whatever its event time.
+#
+# dropDuplicates only evicts state when the key includes the watermarked column, and on Spark 3.4
+# a second watermark on the event time would hold back the ingest-time watermark of the window
+# count (the replayed rides keep their original event times), so the key is kept with a
+# processing-time timeout instead. Its state is bounded by the TTL times the event rate,
+# whatever the history.
+
+DEDUP_STATE_SCHEMA = StructType([StructField("firstSeenMs", LongType())])
+
+def first_copies(ttl_ms, dropped=None):
+  def dedup(key, pdfs, state):
+    if state.hasTimedOut:
+      state.remove()
+      return
+    now = state.getCurrentProcessingTimeMs()
+    first_seen = state.get[0] if state.exists else None
+    copies = 0
+    for pdf in pdfs:
+      copies += len(pdf)
+      if first_seen is None and len(pdf):
+        first_seen = now
+        state.update((now,))
+        copies -= 1
+        yield pdf.iloc[:1]
+    # the timeout is cleared on every call with data, set it again to the first copy's expiry
+    state.setTimeoutDuration(max(first_seen + ttl_ms - now, 1))
+    if dropped is not None:
+      dropped.add(copies)
+
+  return dedup
+
+def drop_duplicate_events(rides, ttl="10 minutes", keys=("rideId", "isStart"), dropped=None):
+  """rides without the repeated copies of an event. `dropped` is an optional accumulator
+  that counts the copies removed."""
+  return rides \
+    .groupBy(*keys) \
+    .applyInPandasWithState(first_copies(duration_ms(ttl), dropped), rides.schema, DEDUP_STATE_SCHEMA, \
+                            "append", GroupStateTimeout.ProcessingTimeTimeout)
+
+class DedupReporter(StreamingQueryListener):
+  """Prints the dedup state rows and memory and the copies dropped in each batch of one query.
+  Every query that deduplicates needs its own reporter and `dropped` accumulator."""
+
+  def __init__(self, dropped, operator_name="flatMapGroupsWithState"):
+    self.dropped, self.operator_name = dropped, operator_name
+    self.query_id, self.reported = None, 0
+
+  def watch(self, query):
+    """Report the batches of `query`, the query whose dedup stage adds to self.dropped."""
+    self.query_id = str(query.id)
+    return query
+
+  def onQueryStarted(self, event):
+    pass
+
+  def onQueryProgress(self, event):
+    progress = event.progress
+    if str(progress.id) != self.query_id:
+      return
+    total = self.dropped.value
+    # the dedup runs first, so it is the last stateful operator of the plan
+    for op in reversed(progress.stateOperators):
+      if op.operatorName == self.operator_name:
+        print("batch={} dedup stateRows={} evicted={} memoryBytes={} dropped={} droppedTotal={}".format( \
+          progress.batchId, op.numRowsTotal, op.numRowsRemoved, op.memoryUsedBytes, total - self.reported, total))
+        break
+    self.reported = total
+
+  def onQueryIdle(self, event):
+    pass
+
+  def onQueryTerminated(self, event):
+    pass
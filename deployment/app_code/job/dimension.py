@@ -0,0 +1,107 @@
+import hashlib
+import time
+from pyspark.sql.functions import broadcast, col, count, lit
+from pyspark.sql.streaming import StreamingQueryListener
+from hadoop_fs import list_files
+
+# Stream-static enrichment from Parquet dimension tables (local or S3). A table is read once and
+# cached; every micro-batch broadcasts it from the cache instead of reading S3. After a batch of
+# the enriched query, at most every --dim-check-seconds, the table's files are listed, and when
+# they changed or --dim-refresh-seconds passed the cache is rebuilt with
+# spark.catalog.refreshByPath, which also refreshes the file listing the running query holds, so
+# the next batch joins the new version without a restart. Batches of other queries list nothing.
+
+def data_files(spark, path):
+  """Data files under path and its partition folders, without _/. prefixed files such as _SUCCESS."""
+  files = []
+  for status in list_files(spark, path):
+    if status["name"].startswith(("_", ".")):
+      continue
+    files += data_files(spark, status["path"]) if status["isDir"] else [status]
+  return files
+
+def version_of(spark, path):
+  digest = hashlib.sha1()
+  for status in sorted(data_files(spark, path), key=lambda status: status["path"]):
+    digest.update("{path}|{size}|{modificationTime}\n".format(**status).encode("utf-8"))
+  return digest.hexdigest()[:12]
+
+class DimensionTable:
+  def __init__(self, spark, name, path, key, columns=None, refresh_seconds=300, check_seconds=60):
+    self.spark, self.name, self.path, self.key = spark, name, path, key
+    self.refresh_seconds, self.check_seconds = refresh_seconds, check_seconds
+    table = spark.read.parquet(path)
+    self.columns = columns or [column for column in table.columns if column != key]
+    self.df = table.select(key, *self.columns).dropDuplicates([key]).cache()
+    self.refreshes, self.checks = 0, 0
+    self.load(version_of(spark, path))
+
+  def load(self, version):
+    started = time.time()
+    self.rows = self.df.count()
+    self.load_ms = int((time.time() - started) * 1000)
+    self.version, self.loaded_at = version, time.time()
+    self.checked_at = self.loaded_at
+    # the in-memory relation's size once cached, i.e. what every batch broadcasts
+    self.size_bytes = int(self.df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+    print("dimension {}: version={} rows={} broadcastBytes={} loadMs={}".format( \
+      self.name, self.version, self.rows, self.size_bytes, self.load_ms))
+
+  def refresh_if_stale(self):
+    now = time.time()
+    expired = now - self.loaded_at >= self.refresh_seconds
+    # listing the files is a LIST request per partition folder on S3, so it is not done every batch
+    if not expired and now - self.checked_at < self.check_seconds:
+      return False
+    self.checks += 1
+    self.checked_at = now
+    version = version_of(self.spark, self.path)
+    if version == self.version and not expired:
+      return False
+    self.spark.catalog.refreshByPath(self.path)
+    self.refreshes += 1
+    self.load(version)
+    return True
+
+  def join(self, stream):
+    """stream with the dimension columns, null when the key is not in the table. Matches are
+    counted as observed metrics named after the table."""
+    clashes = [column for column in self.columns if column in stream.columns]
+    if clashes:
+      raise ValueError("Dimension {} columns {} are already in the stream".format(self.name, clashes))
+    enriched = stream.join(broadcast(self.df), self.key, "left")
+    return enriched.observe(self.name, count(lit(1)).alias("rows"), count(col(self.columns[0])).alias("hits"))
+
+class DimensionRefresher(StreamingQueryListener):
+  """Checks the tables after the batches of the enriched query and prints their hit rate,
+  refreshes and broadcast size."""
+
+  def __init__(self, tables):
+    self.tables, self.query_id = tables, None
+
+  def watch(self, query):
+    """Check the tables after the batches of `query`, the query the tables are joined onto."""
+    self.query_id = str(query.id)
+    return query
+
+  def onQueryStarted(self, event):
+    pass
+
+  def onQueryProgress(self, event):
+    progress = event.progress
+    if str(progress.id) != self.query_id:
+      return
+    observed = progress.observedMetrics or {}
+    for table in self.tables:
+      metrics = observed.get(table.name)
+      rows, hits = (metrics["rows"], metrics["hits"]) if metrics else (0, 0)
+      refreshed = table.refresh_if_stale()
+      print("batch={} dimension={} rows={} hits={} hitRate={} version={} refreshes={} broadcastBytes={}{}".format( \
+        progress.batchId, table.name, rows, hits, "{:.3f}".format(hits / float(rows)) if rows else "-", \
+        table.version, table.refreshes, table.size_bytes, " refreshed" if refreshed else ""))
+
+  def onQueryIdle(self, event):
+    pass
+
+  def onQueryTerminated(self, event):
+    pass
@@ -0,0 +1,282 @@
+import argparse
+import gzip
+import io
+import json
+import os
+import re
+
+# Offline summary of Spark event logs (spark.eventLog.dir, e.g. hdfs:///var/log/spark/apps on EMR,
+# or the logs under the cluster's s3://<bucket>/elasticmapreduce/ prefix copied locally), for the
+# consumer and the wordcount job. Per application it reports
+#  - stages: wall time, tasks, task skew (max / median task time), shuffle read and write, spill,
+#    GC time and input bytes
+#  - micro-batches: wall time from the query progress events, or from the batch's jobs when the
+#    log has none, and the stage figures summed per batch
+#  - operators: the SQL timing metrics (scan, sort, aggregation build, ...) summed per plan node
+# The summary is printed as tables and written as JSON; --compare prints the change of the totals
+# against the JSON of an earlier run.
+# Usage: python event_log_report.py <event log file or folder> --output report.json [--compare before.json]
+
+PROGRESS_EVENT = "org.apache.spark.sql.streaming.StreamingQueryListener$QueryProgressEvent"
+SQL_START_EVENT = "org.apache.spark.sql.execution.ui.SparkListenerSQLExecutionStart"
+SQL_ADAPTIVE_EVENT = "org.apache.spark.sql.execution.ui.SparkListenerSQLAdaptiveExecutionUpdate"
+DRIVER_ACCUM_EVENT = "org.apache.spark.sql.execution.ui.SparkListenerDriverAccumUpdates"
+STAGE_FIELDS = ["shuffleReadBytes", "shuffleWriteBytes", "spillBytes", "gcMs", "inputBytes"]
+
+def open_log(path):
+  if path.endswith(".gz"):
+    return gzip.open(path, "rt", encoding="utf-8")
+  if path.endswith((".zstd", ".zst")):
+    import zstandard
+    return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+  if path.endswith((".lz4", ".lzf", ".snappy")):
+    raise ValueError("{}: Spark's {} stream format is not readable here, copy the log with " \
+                     "spark.eventLog.compress=false or use zstd".format(path, path.rsplit(".", 1)[1]))
+  return open(path, encoding="utf-8")
+
+def rolling_index(name):
+  match = re.match(r"events_(\d+)_", name)
+  return int(match.group(1)) if match else 0
+
+def event_logs(path):
+  """Lists of files, one list per application: a single log file, or the events_<n>_ files of a
+  rolling eventlog_v2_ folder in order."""
+  if os.path.isfile(path):
+    return [[path]]
+  logs = []
+  for root, dirs, files in os.walk(path):
+    dirs.sort()
+    if os.path.basename(root).startswith("eventlog_v2_"):
+      events = sorted([name for name in files if name.startswith("events_")], key=rolling_index)
+      logs.append([os.path.join(root, name) for name in events])
+      continue
+    logs += [[os.path.join(root, name)] for name in sorted(files) if name.startswith(("application_", "app-", "local-"))]
+  return logs
+
+def median(values):
+  ordered = sorted(values)
+  if not ordered:
+    return None
+  middle = len(ordered) // 2
+  return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def percentile(values, pct):
+  if not values:
+    return None
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def human_bytes(value):
+  for unit in ["B", "KB", "MB", "GB"]:
+    if abs(value) < 1024:
+      return "{:.1f}{}".format(value, unit)
+    value /= 1024.0
+  return "{:.1f}TB".format(value)
+
+class Application:
+  """Accumulates the events of one application's log."""
+
+  def __init__(self):
+    self.info = {}
+    self.jobs, self.stage_jobs, self.stages, self.tasks = {}, {}, {}, {}
+    self.progress = []
+    self.metric_nodes, self.accumulators = {}, {}
+
+  def add(self, event):
+    name = event.get("Event")
+    if name == "SparkListenerApplicationStart":
+      self.info.update(name=event.get("App Name"), id=event.get("App ID"), startTime=event.get("Timestamp"))
+    elif name == "SparkListenerApplicationEnd":
+      self.info["endTime"] = event.get("Timestamp")
+    elif name == "SparkListenerJobStart":
+      properties = event.get("Properties") or {}
+      batch_id = properties.get("streaming.sql.batchId")
+      self.jobs[event["Job ID"]] = {"submitted": event.get("Submission Time"), "completed": None, \
+        "batch": (properties.get("sql.streaming.queryId"), int(batch_id)) if batch_id is not None else None, \
+        "description": properties.get("spark.job.description")}
+      for stage_id in event.get("Stage IDs", []):
+        self.stage_jobs[stage_id] = event["Job ID"]
+    elif name == "SparkListenerJobEnd":
+      if event["Job ID"] in self.jobs:
+        self.jobs[event["Job ID"]]["completed"] = event.get("Completion Time")
+    elif name == "SparkListenerTaskEnd":
+      self.add_task(event)
+    elif name == "SparkListenerStageCompleted":
+      self.add_stage(event["Stage Info"])
+    elif name == PROGRESS_EVENT:
+      self.progress.append(event["progress"])
+    elif name in (SQL_START_EVENT, SQL_ADAPTIVE_EVENT):
+      self.add_plan(event.get("sparkPlanInfo") or {})
+    elif name == DRIVER_ACCUM_EVENT:
+      for accumulator_id, value in event.get("accumUpdates", []):
+        self.accumulators[accumulator_id] = self.accumulators.get(accumulator_id, 0) + value
+
+  def add_task(self, event):
+    info, metrics = event.get("Task Info") or {}, event.get("Task Metrics") or {}
+    stage = self.tasks.setdefault((event["Stage ID"], event.get("Stage Attempt ID", 0)), \
+      dict({field: 0 for field in STAGE_FIELDS}, durations=[], failed=0))
+    if info.get("Failed") or info.get("Killed"):
+      stage["failed"] += 1
+    if info.get("Finish Time") and info.get("Launch Time"):
+      stage["durations"].append(info["Finish Time"] - info["Launch Time"])
+    read, written = metrics.get("Shuffle Read Metrics") or {}, metrics.get("Shuffle Write Metrics") or {}
+    stage["shuffleReadBytes"] += read.get("Remote Bytes Read", 0) + read.get("Local Bytes Read", 0)
+    stage["shuffleWriteBytes"] += written.get("Shuffle Bytes Written", 0)
+    stage["spillBytes"] += metrics.get("Memory Bytes Spilled", 0) + metrics.get("Disk Bytes Spilled", 0)
+    stage["gcMs"] += metrics.get("JVM GC Time", 0)
+    stage["inputBytes"] += (metrics.get("Input Metrics") or {}).get("Bytes Read", 0)
+
+  def add_stage(self, info):
+    key = (info["Stage ID"], info.get("Stage Attempt ID", 0))
+    submitted, completed = info.get("Submission Time"), info.get("Completion Time")
+    self.stages[key] = {"stageId": key[0], "attempt": key[1], "name": (info.get("Stage Name") or "").split("\n")[0], \
+                        "numTasks": info.get("Number of Tasks"), \
+                        "wallMs": completed - submitted if submitted and completed else None}
+    # SQL metric accumulators hold the running total, the latest stage has the final value
+    for accumulable in info.get("Accumulables", []):
+      try:
+        self.accumulators[accumulable["ID"]] = float(accumulable.get("Value"))
+      except (TypeError, ValueError):
+        pass
+
+  def add_plan(self, node):
+    for metric in node.get("metrics", []):
+      if metric.get("metricType") in ("timing", "nsTiming"):
+        self.metric_nodes[metric["accumulatorId"]] = (node.get("nodeName"), metric.get("name"), metric["metricType"])
+    for child in node.get("children", []):
+      self.add_plan(child)
+
+  def stage_rows(self):
+    rows = []
+    for key, stage in sorted(self.stages.items()):
+      tasks = self.tasks.get(key, dict({field: 0 for field in STAGE_FIELDS}, durations=[], failed=0))
+      middle = median(tasks["durations"])
+      job = self.jobs.get(self.stage_jobs.get(key[0]), {})
+      rows.append(dict(stage, **{field: tasks[field] for field in STAGE_FIELDS}, failedTasks=tasks["failed"], \
+        medianTaskMs=middle, maxTaskMs=max(tasks["durations"]) if tasks["durations"] else None, \
+        skew=max(tasks["durations"]) / float(middle) if middle else None, \
+        batch=list(job["batch"]) if job.get("batch") else None, job=job.get("description")))
+    return rows
+
+  def batch_rows(self, stages):
+    by_batch = {}
+    for job in self.jobs.values():
+      if job["batch"] and job["submitted"] and job["completed"]:
+        batch = by_batch.setdefault(tuple(job["batch"]), {"submitted": job["submitted"], "completed": job["completed"]})
+        batch["submitted"], batch["completed"] = min(batch["submitted"], job["submitted"]), \
+                                                 max(batch["completed"], job["completed"])
+    progress = {(p.get("id"), p.get("batchId")): p for p in self.progress}
+    rows = []
+    for key in sorted(set(by_batch) | set(progress), key=lambda key: (str(key[0]), key[1])):
+      jobs, event = by_batch.get(key), progress.get(key)
+      row = {"queryId": key[0], "batchId": key[1], \
+             "wallMs": event.get("batchDuration") if event else jobs["completed"] - jobs["submitted"], \
+             "numInputRows": event.get("numInputRows") if event else None, \
+             "durationMs": event.get("durationMs") if event else None}
+      batch_stages = [stage for stage in stages if stage["batch"] == list(key)]
+      row.update({field: sum(stage[field] for stage in batch_stages) for field in STAGE_FIELDS})
+      rows.append(row)
+    return rows
+
+  def operator_rows(self):
+    totals = {}
+    for accumulator_id, (node, metric, metric_type) in self.metric_nodes.items():
+      value = self.accumulators.get(accumulator_id)
+      if value:
+        key = (node, metric)
+        totals[key] = totals.get(key, 0) + (value / 1e6 if metric_type == "nsTiming" else value)
+    return [{"operator": node, "metric": metric, "totalMs": round(total, 1)} \
+            for (node, metric), total in sorted(totals.items(), key=lambda item: -item[1])]
+
+  def report(self):
+    stages = self.stage_rows()
+    batches = self.batch_rows(stages)
+    batch_ms = [batch["wallMs"] for batch in batches if batch["wallMs"] is not None]
+    totals = {field: sum(stage[field] for stage in stages) for field in STAGE_FIELDS}
+    totals.update(stages=len(stages), stageWallMs=sum(stage["wallMs"] or 0 for stage in stages), \
+                  failedTasks=sum(stage["failedTasks"] for stage in stages), batches=len(batches), \
+                  batchWallMsP50=percentile(batch_ms, 50), batchWallMsP95=percentile(batch_ms, 95), \
+                  batchWallMsMax=max(batch_ms) if batch_ms else None)
+    return {"application": self.info, "totals": totals, "stages": stages, "batches": batches, \
+            "operators": self.operator_rows()}
+
+def analyze(files):
+  app = Application()
+  for path in files:
+    with open_log(path) as fp:
+      for line in fp:
+        line = line.strip()
+        if line:
+          try:
+            app.add(json.loads(line))
+          except ValueError:
+            # the last line of an in-progress log may be cut off
+            continue
+  return app.report()
+
+def print_report(report, top):
+  app, totals = report["application"], report["totals"]
+  print("\n{} ({})".format(app.get("name"), app.get("id")))
+  print("stages={stages} stageWall={stageWallMs}ms failedTasks={failedTasks} batches={batches} " \
+        "batchWall p50={batchWallMsP50} p95={batchWallMsP95} max={batchWallMsMax}ms".format(**totals))
+  print("shuffleRead={} shuffleWrite={} spill={} input={} gc={}ms".format(human_bytes(totals["shuffleReadBytes"]), \
+    human_bytes(totals["shuffleWriteBytes"]), human_bytes(totals["spillBytes"]), human_bytes(totals["inputBytes"]), \
+    totals["gcMs"]))
+
+  print("\nSlowest stages")
+  print("{:>6} {:>5} {:>9} {:>6} {:>8} {:>10} {:>10} {:>10} {:>7}  {}".format( \
+    "stage", "batch", "wall ms", "tasks", "skew", "shuf read", "shuf write", "spill", "gc ms", "name"))
+  for stage in sorted(report["stages"], key=lambda stage: -(stage["wallMs"] or 0))[:top]:
+    print("{:>6} {:>5} {:>9} {:>6} {:>8} {:>10} {:>10} {:>10} {:>7}  {}".format( \
+      "{}.{}".format(stage["stageId"], stage["attempt"]), stage["batch"][1] if stage["batch"] else "-", \
+      stage["wallMs"] if stage["wallMs"] is not None else "-", stage["numTasks"], \
+      "{:.1f}".format(stage["skew"]) if stage["skew"] else "-", human_bytes(stage["shuffleReadBytes"]), \
+      human_bytes(stage["shuffleWriteBytes"]), human_bytes(stage["spillBytes"]), stage["gcMs"], stage["name"][:60]))
+
+  if report["batches"]:
+    print("\nSlowest micro-batches")
+    print("{:>6} {:>9} {:>10} {:>10} {:>10} {:>10} {:>7}".format( \
+      "batch", "wall ms", "input rows", "shuf read", "shuf write", "spill", "gc ms"))
+    for batch in sorted(report["batches"], key=lambda batch: -(batch["wallMs"] or 0))[:top]:
+      print("{:>6} {:>9} {:>10} {:>10} {:>10} {:>10} {:>7}".format(batch["batchId"], batch["wallMs"], \
+        batch["numInputRows"] if batch["numInputRows"] is not None else "-", human_bytes(batch["shuffleReadBytes"]), \
+        human_bytes(batch["shuffleWriteBytes"]), human_bytes(batch["spillBytes"]), batch["gcMs"]))
+
+  if report["operators"]:
+    print("\nSlowest operators")
+    print("{:>12}  {:<32} {}".format("total ms", "operator", "metric"))
+    for operator in report["operators"][:top]:
+      print("{totalMs:>12}  {operator:<32} {metric}".format(**operator))
+
+def compare(baseline_path, reports):
+  with open(baseline_path) as fp:
+    baseline = {report["application"].get("name"): report for report in json.load(fp)["applications"]}
+  for report in reports:
+    before = baseline.get(report["application"].get("name"))
+    if not before:
+      continue
+    print("\nChange against {} for {}".format(baseline_path, report["application"].get("name")))
+    print("{:>16} {:>14} {:>14} {:>9}".format("metric", "before", "after", "change"))
+    for metric, new in sorted(report["totals"].items()):
+      old = before["totals"].get(metric)
+      if old and new is not None:
+        print("{:>16} {:>14.1f} {:>14.1f} {:>+8.1f}%".format(metric, old, new, (new - old) * 100.0 / old))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("path", help="event log file, rolling eventlog_v2_ folder, or a folder of logs")
+  parser.add_argument("--top", type=int, default=15, help="rows of each table")
+  parser.add_argument("--compare", help="report JSON of an earlier run to print the change against")
+  parser.add_argument("--output", default="event_log_report.json")
+  args = parser.parse_args()
+
+  reports = [analyze(files) for files in event_logs(args.path)]
+  if not reports:
+    parser.error("no event logs under {}".format(args.path))
+  for report in reports:
+    print_report(report, args.top)
+  with open(args.output, "w") as fp:
+    json.dump({"applications": reports}, fp, indent=2)
+  print("\nReport written to {}".format(args.output))
+  if args.compare:
+    compare(args.compare, reports)
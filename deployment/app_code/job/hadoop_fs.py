@@ -0,0 +1,101 @@
+# Small files next to the checkpoint, through the Hadoop FileSystem so s3:// paths work on EMR.
+
+def read_text(spark, path):
+  jvm = spark._jvm
+  fs_path = jvm.org.apache.hadoop.fs.Path(path)
+  fs = fs_path.getFileSystem(spark._jsc.hadoopConfiguration())
+  if not fs.exists(fs_path):
+    return None
+  stream = fs.open(fs_path)
+  try:
+    return jvm.org.apache.commons.io.IOUtils.toString(stream, "UTF-8")
+  finally:
+    stream.close()
+
+def write_text(spark, path, text):
+  jvm = spark._jvm
+  fs_path = jvm.org.apache.hadoop.fs.Path(path)
+  stream = fs_path.getFileSystem(spark._jsc.hadoopConfiguration()).create(fs_path, True)
+  try:
+    stream.write(bytearray(text.encode("utf-8")))
+  finally:
+    stream.close()
+
+def write_text_atomic(spark, path, text):
+  """Replaces path in one step, the way Spark writes its own checkpoint and metadata log files."""
+  jvm = spark._jvm
+  fs_path = jvm.org.apache.hadoop.fs.Path(path)
+  manager_class = getattr(jvm.org.apache.spark.sql.execution.streaming, "CheckpointFileManager$")
+  manager = getattr(manager_class, "MODULE$").create(fs_path, spark._jsc.hadoopConfiguration())
+  stream = manager.createAtomic(fs_path, True)
+  try:
+    stream.write(bytearray(text.encode("utf-8")))
+  except Exception:
+    stream.cancel()
+    raise
+  stream.close()
+
+def list_files(spark, path):
+  """Status of the entries directly under path, [] when it does not exist."""
+  jvm = spark._jvm
+  fs_path = jvm.org.apache.hadoop.fs.Path(path)
+  fs = fs_path.getFileSystem(spark._jsc.hadoopConfiguration())
+  if not fs.exists(fs_path):
+    return []
+  return [{
+    "path": status.getPath().toUri().toString(),
+    "name": status.getPath().getName(),
+    "size": status.getLen(),
+    "isDir": status.isDirectory(),
+    "modificationTime": status.getModificationTime(),
+    "blockReplication": status.getReplication(),
+    "blockSize": status.getBlockSize(),
+  } for status in fs.listStatus(fs_path)]
+
+def rename(spark, source, destination):
+  jvm = spark._jvm
+  source_path = jvm.org.apache.hadoop.fs.Path(source)
+  fs = source_path.getFileSystem(spark._jsc.hadoopConfiguration())
+  if not fs.rename(source_path, jvm.org.apache.hadoop.fs.Path(destination)):
+    raise IOError("Could not rename {} to {}".format(source, destination))
+
+def delete(spark, path, recursive=False):
+  jvm = spark._jvm
+  fs_path = jvm.org.apache.hadoop.fs.Path(path)
+  return fs_path.getFileSystem(spark._jsc.hadoopConfiguration()).delete(fs_path, recursive)
+
+def compression_codec(spark, name):
+  codec_class = getattr(spark._jvm.org.apache.spark.io, "CompressionCodec$")
+  return getattr(codec_class, "MODULE$").createCodec(spark._jsc.sc().conf(), name)
+
+def read_bytes(spark, path, codec=None):
+  """Whole file content, decompressed with a Spark compression codec name (lz4, zstd, ...) if given."""
+  jvm = spark._jvm
+  fs_path = jvm.org.apache.hadoop.fs.Path(path)
+  stream = fs_path.getFileSystem(spark._jsc.hadoopConfiguration()).open(fs_path)
+  if codec:
+    stream = compression_codec(spark, codec).compressedInputStream(stream)
+  try:
+    return bytes(jvm.org.apache.commons.io.IOUtils.toByteArray(stream))
+  finally:
+    stream.close()
+
+def write_bytes(spark, path, data, codec=None):
+  jvm = spark._jvm
+  fs_path = jvm.org.apache.hadoop.fs.Path(path)
+  stream = fs_path.getFileSystem(spark._jsc.hadoopConfiguration()).create(fs_path, False)
+  if codec:
+    stream = compression_codec(spark, codec).compressedOutputStream(stream)
+  try:
+    stream.write(bytearray(data))
+  finally:
+    stream.close()
+
+def copy(spark, source, destination):
+  """Copies a file or a folder tree."""
+  jvm = spark._jvm
+  conf = spark._jsc.hadoopConfiguration()
+  source_path, destination_path = jvm.org.apache.hadoop.fs.Path(source), jvm.org.apache.hadoop.fs.Path(destination)
+  if not jvm.org.apache.hadoop.fs.FileUtil.copy(source_path.getFileSystem(conf), source_path, \
+      destination_path.getFileSystem(conf), destination_path, False, conf):
+    raise IOError("Could not copy {} to {}".format(source, destination))
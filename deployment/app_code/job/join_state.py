@@ -0,0 +1,65 @@
+import threading
+from pyspark.sql.streaming import StreamingQueryListener
+from hadoop_fs import list_files
+from repartition_state import CODEC_CONF, load_partition_state
+
+# Rows kept per side of a stream-stream join. Progress events only report the sum of both sides,
+# so the sides are counted from the checkpoint's state files (HDFS-backed state store only).
+# Reading them lists and decodes every state file of the join, so the reporter samples them
+# every N batches on a thread of its own, never on the listener thread.
+
+JOIN_SIDES = ["left", "right"]
+
+def join_side_rows(spark, checkpoint_location, version, operator_id=0, codec=None):
+  """{"left": rows, "right": rows} in the join state at version (committed batch id + 1). The
+  codec defaults to the session's state store compression codec."""
+  codec = codec or spark.conf.get(CODEC_CONF, "lz4")
+  operator_dir = "{}/state/{}".format(checkpoint_location.rstrip("/"), operator_id)
+  rows = dict((side, 0) for side in JOIN_SIDES)
+  for partition in list_files(spark, operator_dir):
+    if not partition["name"].isdigit():
+      continue
+    for side in JOIN_SIDES:
+      store_dir = "{}/{}/{}-keyWithIndexToValue".format(operator_dir, partition["name"], side)
+      rows[side] += len(load_partition_state(spark, store_dir, version, codec))
+  return rows
+
+class JoinStateReporter(StreamingQueryListener):
+  """Prints the join operator's state rows and the rows it evicted after every batch, and the state
+  rows per side sampled every `every` batches."""
+
+  def __init__(self, spark, checkpoint_location, every=10, operator_name="symmetricHashJoin"):
+    self.spark, self.checkpoint_location = spark, checkpoint_location
+    self.every, self.operator_name = every, operator_name
+    self.evicted, self.sampler = 0, None
+
+  def onQueryStarted(self, event):
+    pass
+
+  def onQueryProgress(self, event):
+    progress = event.progress
+    # stateOperators is in the order of the operator ids, the folders under <checkpoint>/state
+    for operator_id, op in enumerate(progress.stateOperators):
+      if op.operatorName != self.operator_name:
+        continue
+      self.evicted += op.numRowsRemoved
+      print("batch={} join stateRows={} evicted={} evictedTotal={} droppedByWatermark={}".format( \
+        progress.batchId, op.numRowsTotal, op.numRowsRemoved, self.evicted, op.numRowsDroppedByWatermark))
+      # a sample is skipped while the previous one is still reading
+      if self.every and progress.batchId % self.every == 0 and not (self.sampler and self.sampler.is_alive()):
+        self.sampler = threading.Thread(target=self.sample_sides, args=(progress.batchId, operator_id), daemon=True)
+        self.sampler.start()
+
+  def sample_sides(self, batch_id, operator_id):
+    try:
+      rows = join_side_rows(self.spark, self.checkpoint_location, batch_id + 1, operator_id)
+      print("batch={} join leftRows={left} rightRows={right}".format(batch_id, **rows))
+    except Exception as e:
+      print("Join side rows not available: {}".format(e))
+      self.every = 0
+
+  def onQueryIdle(self, event):
+    pass
+
+  def onQueryTerminated(self, event):
+    pass
@@ -0,0 +1,24 @@
+from pyspark.sql.functions import col, date_format, hour, to_utc_timestamp
+
+# Streaming Parquet output partitioned by event date and hour in UTC, e.g. <path>/date=2024-01-31/hour=7/,
+# whatever the session time zone, as compact_lake.py expects.
+# Every trigger adds at least one file per written partition, compact_lake.py bin-packs the
+# partitions that no longer receive rows.
+
+PARTITION_COLUMNS = ["date", "hour"]
+
+def with_time_partitions(df, time_col):
+  # shifted so that the session time zone renders the UTC date and hour
+  time_value = to_utc_timestamp(col(time_col), df.sparkSession.conf.get("spark.sql.session.timeZone"))
+  return df.select("*", date_format(time_value, "yyyy-MM-dd").alias("date"), hour(time_value).alias("hour"))
+
+def lake_writer(df, path, checkpoint_location, time_col="window.start", compression="snappy"):
+  """Append-mode Parquet file sink, the caller sets the trigger and starts it."""
+  return with_time_partitions(df, time_col) \
+    .writeStream \
+    .outputMode("append") \
+    .format("parquet") \
+    .partitionBy(*PARTITION_COLUMNS) \
+    .option("path", path) \
+    .option("compression", compression) \
+    .option("checkpointLocation", checkpoint_location)
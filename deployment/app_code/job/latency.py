@@ -0,0 +1,64 @@
+import json
+from pyspark.sql.functions import count, expr, lit, max, min, percentile_approx
+from pyspark.sql.streaming import StreamingQueryListener
+
+# End-to-end latency from the producer to the output. Rides keep the Kafka record timestamp as
+# sourceTime next to the ingest time in `timestamp`, and the window aggregation carries the oldest
+# and newest sourceTime it counted. Each batch observes percentiles of its trigger time minus those
+# source times; adding the batch duration makes them output time minus source time, the output
+# being visible when the batch commits.
+#   oldest  output time minus minSourceTime, the ride of the window that waited longest
+#   newest  output time minus maxSourceTime, how fresh the newest ride in the output is
+
+SOURCE_TIME_COL = "sourceTime"
+LATENCY_METRICS = "latency"
+QUANTILES = [0.5, 0.95, 0.99]
+
+def window_aggregates(source_time_col=None):
+  """The window count, plus minSourceTime and maxSourceTime when source_time_col is given."""
+  aggregates = [count(lit(1)).alias("count")]
+  if source_time_col:
+    aggregates += [min(source_time_col).alias("minSourceTime"), max(source_time_col).alias("maxSourceTime")]
+  return aggregates
+
+def with_latency_metrics(df, oldest_col="minSourceTime", newest_col="maxSourceTime"):
+  """df observing the per-batch latency percentiles under the name LATENCY_METRICS."""
+  # current_timestamp() is the trigger time of the micro-batch
+  oldest = expr("unix_millis(current_timestamp()) - unix_millis(`{}`)".format(oldest_col))
+  newest = expr("unix_millis(current_timestamp()) - unix_millis(`{}`)".format(newest_col))
+  return df.observe(LATENCY_METRICS, count(lit(1)).alias("rows"), \
+    percentile_approx(oldest, QUANTILES).alias("oldest"), max(oldest).alias("oldestMax"), \
+    percentile_approx(newest, QUANTILES).alias("newest"), max(newest).alias("newestMax"))
+
+def latency_histogram(progress):
+  """{"rows", "oldest": {"p50", "p95", "p99", "max"}, "newest": {...}} in ms from a progress dict,
+  None when the batch observed no latency."""
+  metrics = progress.get("observedMetrics", {}).get(LATENCY_METRICS)
+  if not metrics or not metrics.get("rows"):
+    return None
+  histogram = {"rows": metrics["rows"]}
+  for name in ["oldest", "newest"]:
+    values = list(metrics[name]) + [metrics[name + "Max"]]
+    histogram[name] = {label: value + progress.get("durationMs", {}).get("triggerExecution", 0) \
+                       for label, value in zip(["p50", "p95", "p99", "max"], values)}
+  return histogram
+
+class LatencyReporter(StreamingQueryListener):
+  """Prints the latency percentiles of each batch."""
+
+  def onQueryStarted(self, event):
+    pass
+
+  def onQueryProgress(self, event):
+    progress = json.loads(event.progress.json)
+    histogram = latency_histogram(progress)
+    if histogram:
+      print("batch={} latency rows={} oldest p50={p50} p95={p95} p99={p99} max={max} ".format( \
+        progress["batchId"], histogram["rows"], **histogram["oldest"]) + \
+        "newest p50={p50} p95={p95} p99={p99} max={max}".format(**histogram["newest"]))
+
+  def onQueryIdle(self, event):
+    pass
+
+  def onQueryTerminated(self, event):
+    pass
@@ -0,0 +1,212 @@
+import argparse
+import gzip
+import multiprocessing
+import os
+import time
+import numpy as np
+
+# Synthetic taxi-ride producer. Every worker process emits a START and, after a random ride
+# duration, an END record per ride in taxiRidesSchema CSV order, paced to its share of --rate.
+# Usage: python load_generator.py kafka --bootstrap-servers $MSK_SERVER --rate 50000 --workers 4
+#        python load_generator.py files --output-dir /tmp/rides --rate 20000 --seconds 60
+
+NO_TIME = "1970-01-01 00:00:00"
+NYC_BOUNDS = (-74.05, 40.6, 0.3)  # west, south, size in degrees
+
+def driver_sampler(drivers, skew, rng):
+  """Draws driverIds with Zipf(skew) popularity over `drivers` ids, skew=0 is uniform."""
+  weights = 1.0 / np.arange(1, drivers + 1) ** skew
+  cdf = np.cumsum(weights / weights.sum())
+  ids = rng.permutation(drivers) + 2013000000  # hot drivers are not consecutive ids
+  return lambda size: ids[np.minimum(np.searchsorted(cdf, rng.random(size)), drivers - 1)]
+
+def format_times(epoch_seconds):
+  # UTC "yyyy-MM-dd HH:mm:ss", the format the consumer casts to TimestampType
+  stamps = np.datetime_as_string(np.asarray(epoch_seconds, dtype="float64").astype("datetime64[s]"), unit="s")
+  return np.char.replace(stamps, "T", " ")
+
+def format_records(rides, is_start, end_time=None):
+  """CSV lines of the START or END event of every ride."""
+  count = len(rides["rideId"])
+  start_times = format_times(rides["startedAt"])
+  end_times = [NO_TIME] * count if is_start else format_times(end_time)
+  event = "START" if is_start else "END"
+  return ["{},{},{},{},{:.6f},{:.6f},{:.6f},{:.6f},{},{},{}".format(*fields) for fields in zip( \
+    rides["rideId"].tolist(), [event] * count, end_times, start_times, \
+    rides["startLon"].tolist(), rides["startLat"].tolist(), rides["endLon"].tolist(), rides["endLat"].tolist(), \
+    rides["passengerCnt"].tolist(), rides["taxiId"].tolist(), rides["driverId"].tolist())]
+
+class RideSource:
+  """New rides for START events and the rides whose END is due, one batch at a time."""
+
+  def __init__(self, worker, workers, args):
+    self.rng = np.random.default_rng(args.seed + worker)
+    self.sample_drivers = driver_sampler(args.drivers, args.skew, self.rng)
+    self.next_id, self.step = worker, workers
+    self.args = args
+    self.open_rides = []
+
+  def late_offsets(self, count):
+    # a --late-fraction of the events carry an event time up to --late-seconds old, as if delivered late
+    late = self.rng.random(count) < self.args.late_fraction
+    return np.where(late, self.rng.random(count) * self.args.late_seconds, 0.0)
+
+  def new_rides(self, count, now):
+    rng, (west, south, size) = self.rng, NYC_BOUNDS
+    drivers = self.sample_drivers(count)
+    rides = {
+      "rideId": self.next_id + np.arange(count, dtype="int64") * self.step,
+      "startLon": west + rng.random(count) * size, "startLat": south + rng.random(count) * size,
+      "endLon": west + rng.random(count) * size, "endLat": south + rng.random(count) * size,
+      "passengerCnt": rng.integers(1, 7, count), "taxiId": drivers + 100000, "driverId": drivers,
+      "duration": rng.exponential(self.args.ride_seconds, count) + 1.0,
+    }
+    self.next_id += count * self.step
+    rides["startedAt"] = now - self.late_offsets(count)
+    rides["endsAt"] = rides["startedAt"] + rides["duration"]
+    self.open_rides.append(rides)
+    return rides
+
+  def due_rides(self, now):
+    due, still_open = [], []
+    for rides in self.open_rides:
+      done = rides["endsAt"] <= now
+      if done.any():
+        due.append({key: values[done] for key, values in rides.items()})
+      if not done.all():
+        still_open.append({key: values[~done] for key, values in rides.items()})
+    self.open_rides = still_open
+    return due
+
+  def batch(self, size, now):
+    lines = []
+    for rides in self.due_rides(now):
+      end_time = np.minimum(rides["endsAt"], now - self.late_offsets(len(rides["rideId"])))
+      lines += format_records(rides, False, np.maximum(end_time, rides["startedAt"]))
+    lines += format_records(self.new_rides(max(size - len(lines), 0), now), True)
+    return lines
+
+class KafkaSink:
+  def __init__(self, args):
+    try:
+      from confluent_kafka import Producer
+      self.producer = Producer({"bootstrap.servers": args.bootstrap_servers, \
+        "compression.type": args.compression, "linger.ms": args.linger_ms, \
+        "batch.size": args.batch_bytes, "queue.buffering.max.messages": 1000000})
+      self.send = self.send_confluent
+    except ImportError:
+      from kafka import KafkaProducer
+      self.producer = KafkaProducer(bootstrap_servers=args.bootstrap_servers.split(","), \
+        compression_type=None if args.compression == "none" else args.compression, \
+        linger_ms=args.linger_ms, batch_size=args.batch_bytes)
+      self.send = self.send_kafka_python
+    self.topic, self.key_index = args.topic, {"rideId": 0, "driverId": 10, "none": None}[args.key]
+
+  def key(self, line):
+    return None if self.key_index is None else line.split(",")[self.key_index].encode("utf-8")
+
+  def send_confluent(self, lines):
+    for line in lines:
+      while True:
+        try:
+          self.producer.produce(self.topic, line.encode("utf-8"), self.key(line))
+          break
+        except BufferError:
+          self.producer.poll(0.05)
+    self.producer.poll(0)
+
+  def send_kafka_python(self, lines):
+    for line in lines:
+      self.producer.send(self.topic, line.encode("utf-8"), self.key(line))
+
+  def close(self):
+    self.producer.flush()
+
+class FileSink:
+  """Rolls records into <output dir>/part-<worker>-<seq>.csv[.gz]. Files are renamed into
+  place when complete, so a Spark file source never reads a partial file."""
+
+  def __init__(self, args, worker):
+    os.makedirs(args.output_dir, exist_ok=True)
+    self.args, self.worker = args, worker
+    self.seq, self.buffered = 0, []
+
+  def send(self, lines):
+    self.buffered += lines
+    if len(self.buffered) >= self.args.records_per_file:
+      self.roll()
+
+  def roll(self):
+    if not self.buffered:
+      return
+    suffix = ".csv.gz" if self.args.compression == "gzip" else ".csv"
+    name = "part-{:03d}-{:06d}{}".format(self.worker, self.seq, suffix)
+    tmp_path = os.path.join(self.args.output_dir, "." + name + ".tmp")
+    data = ("\n".join(self.buffered) + "\n").encode("utf-8")
+    with open(tmp_path, "wb") as fp:
+      fp.write(gzip.compress(data) if self.args.compression == "gzip" else data)
+    os.replace(tmp_path, os.path.join(self.args.output_dir, name))
+    self.seq, self.buffered = self.seq + 1, []
+
+  def close(self):
+    self.roll()
+
+def run_worker(worker, args, sent, stop):
+  sink = KafkaSink(args) if args.sink == "kafka" else FileSink(args, worker)
+  source = RideSource(worker, args.workers, args)
+  rate = args.rate / float(args.workers)
+  interval = args.batch_size / rate
+  next_batch = time.time()
+  while not stop.is_set():
+    lines = source.batch(args.batch_size, time.time())
+    sink.send(lines)
+    with sent.get_lock():
+      sent.value += len(lines)
+    next_batch += interval
+    time.sleep(max(0.0, next_batch - time.time()))
+  sink.close()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("sink", choices=["kafka", "files"])
+  parser.add_argument("--bootstrap-servers")
+  parser.add_argument("--topic", default="taxirides")
+  parser.add_argument("--key", choices=["rideId", "driverId", "none"], default="rideId")
+  parser.add_argument("--output-dir", default="rides")
+  parser.add_argument("--records-per-file", type=int, default=100000)
+  parser.add_argument("--rate", type=float, default=10000, help="records per second over all workers")
+  parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+  parser.add_argument("--batch-size", type=int, default=1000, help="records per worker batch")
+  parser.add_argument("--compression", choices=["none", "gzip", "snappy", "lz4", "zstd"], default="lz4")
+  parser.add_argument("--linger-ms", type=int, default=20)
+  parser.add_argument("--batch-bytes", type=int, default=256 * 1024)
+  parser.add_argument("--drivers", type=int, default=10000, help="driverId cardinality")
+  parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent of driver popularity, 0 is uniform")
+  parser.add_argument("--ride-seconds", type=float, default=60, help="mean time between START and END")
+  parser.add_argument("--late-fraction", type=float, default=0.0)
+  parser.add_argument("--late-seconds", type=float, default=30)
+  parser.add_argument("--seconds", type=float, default=0, help="run time, 0 runs until interrupted")
+  parser.add_argument("--seed", type=int, default=42)
+  args = parser.parse_args()
+  if args.sink == "kafka" and not args.bootstrap_servers:
+    parser.error("--bootstrap-servers is required for the kafka sink")
+  if args.sink == "files" and args.compression not in ("none", "gzip"):
+    args.compression = "none"
+
+  sent, stop = multiprocessing.Value("q", 0), multiprocessing.Event()
+  workers = [multiprocessing.Process(target=run_worker, args=(idx, args, sent, stop)) for idx in range(args.workers)]
+  for worker in workers:
+    worker.start()
+  started, last_count, last_time = time.time(), 0, time.time()
+  try:
+    while not args.seconds or time.time() - started < args.seconds:
+      time.sleep(min(5, args.seconds - (time.time() - started)) if args.seconds else 5)
+      now, count = time.time(), sent.value
+      print("sent={} rate={:.0f}/s target={:.0f}/s".format(count, (count - last_count) / (now - last_time), args.rate))
+      last_count, last_time = count, now
+  except KeyboardInterrupt:
+    pass
+  stop.set()
+  for worker in workers:
+    worker.join()
+  print("sent={} in {:.1f}s".format(sent.value, time.time() - started))
@@ -0,0 +1,133 @@
+import json
+import os
+from datetime import datetime, timezone
+from pyspark.sql.streaming import StreamingQueryListener
+from latency import latency_histogram
+
+# Per-batch metrics of every streaming query, written to local disk as
+#   <dir>/progress.jsonl      one flattened record per QueryProgressEvent
+#   <dir>/spark_streaming.prom  latest values in Prometheus text format (node_exporter textfile collector)
+
+def parse_offsets(offsets):
+  if isinstance(offsets, str):
+    try:
+      offsets = json.loads(offsets)
+    except ValueError:
+      return {}
+  return offsets if isinstance(offsets, dict) else {}
+
+def kafka_lag(source):
+  """Offsets behind the latest available offset, per topic-partition, after the batch."""
+  end, latest = parse_offsets(source.get("endOffset")), parse_offsets(source.get("latestOffset"))
+  lag = {}
+  for topic, partitions in latest.items():
+    if not isinstance(partitions, dict):
+      continue
+    for partition, offset in partitions.items():
+      done = end.get(topic, {}).get(partition)
+      if done is not None:
+        lag["{}-{}".format(topic, partition)] = max(0, offset - done)
+  return lag
+
+def epoch_ms(timestamp):
+  if not timestamp:
+    return None
+  parsed = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+  return int(parsed.timestamp() * 1000)
+
+def progress_record(progress):
+  """Flatten one progress event (a dict, as in query.lastProgress) into the exported fields."""
+  return {
+    "id": progress.get("id"),
+    "name": progress.get("name"),
+    "batchId": progress.get("batchId"),
+    "timestamp": progress.get("timestamp"),
+    "numInputRows": progress.get("numInputRows"),
+    "inputRowsPerSecond": progress.get("inputRowsPerSecond"),
+    "processedRowsPerSecond": progress.get("processedRowsPerSecond"),
+    # the progress JSON has no batchDuration, the trigger's execution time is the same span
+    "batchDuration": progress.get("durationMs", {}).get("triggerExecution"),
+    "durationMs": progress.get("durationMs", {}),
+    "watermarkMs": epoch_ms(progress.get("eventTime", {}).get("watermark")),
+    "stateOperators": [{
+      "operatorName": op.get("operatorName"),
+      "numRowsTotal": op.get("numRowsTotal"),
+      "numRowsUpdated": op.get("numRowsUpdated"),
+      "numRowsRemoved": op.get("numRowsRemoved"),
+      "numRowsDroppedByWatermark": op.get("numRowsDroppedByWatermark"),
+      "memoryUsedBytes": op.get("memoryUsedBytes"),
+      "customMetrics": op.get("customMetrics", {}),
+    } for op in progress.get("stateOperators", [])],
+    "sources": [{
+      "description": source.get("description"),
+      "numInputRows": source.get("numInputRows"),
+      "startOffset": parse_offsets(source.get("startOffset")),
+      "endOffset": parse_offsets(source.get("endOffset")),
+      "lag": kafka_lag(source),
+      "metrics": source.get("metrics", {}),
+    } for source in progress.get("sources", [])],
+    "sinkOutputRows": progress.get("sink", {}).get("numOutputRows"),
+    "latencyMs": latency_histogram(progress),
+  }
+
+def prometheus_lines(record):
+  query = 'query="{}"'.format(record["name"] or record["id"])
+  lines = []
+
+  def gauge(name, value, labels=""):
+    if value is not None:
+      lines.append("spark_streaming_{}{{{}{}}} {}".format(name, query, labels, float(value)))
+
+  gauge("batch_id", record["batchId"])
+  gauge("input_rows", record["numInputRows"])
+  gauge("input_rows_per_second", record["inputRowsPerSecond"])
+  gauge("processed_rows_per_second", record["processedRowsPerSecond"])
+  gauge("batch_duration_ms", record["batchDuration"])
+  for phase, value in sorted(record["durationMs"].items()):
+    gauge("duration_ms", value, ',phase="{}"'.format(phase))
+  gauge("watermark_ms", record["watermarkMs"])
+  for idx, op in enumerate(record["stateOperators"]):
+    labels = ',operator="{}-{}"'.format(idx, op["operatorName"])
+    gauge("state_rows", op["numRowsTotal"], labels)
+    gauge("state_rows_updated", op["numRowsUpdated"], labels)
+    gauge("state_rows_removed", op["numRowsRemoved"], labels)
+    gauge("state_rows_dropped_by_watermark", op["numRowsDroppedByWatermark"], labels)
+    gauge("state_memory_bytes", op["memoryUsedBytes"], labels)
+  for source in record["sources"]:
+    for partition, lag in sorted(source["lag"].items()):
+      gauge("kafka_lag_offsets", lag, ',partition="{}"'.format(partition))
+  gauge("sink_output_rows", record["sinkOutputRows"])
+  for source, quantiles in sorted((record["latencyMs"] or {}).items()):
+    if source == "rows":
+      continue
+    for label, value in sorted(quantiles.items()):
+      gauge("latency_ms", value, ',source="{}",quantile="{}"'.format(source, label))
+  return lines
+
+class ProgressMetricsExporter(StreamingQueryListener):
+  def __init__(self, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    self.jsonl_path = os.path.join(output_dir, "progress.jsonl")
+    self.prom_path = os.path.join(output_dir, "spark_streaming.prom")
+    self.latest = {}
+
+  def onQueryStarted(self, event):
+    pass
+
+  def onQueryProgress(self, event):
+    record = progress_record(json.loads(event.progress.json))
+    with open(self.jsonl_path, "a") as fp:
+      fp.write(json.dumps(record) + "\n")
+    self.latest[record["id"]] = prometheus_lines(record)
+    # write-then-rename so the textfile collector never reads a partial file
+    tmp_path = self.prom_path + ".tmp"
+    with open(tmp_path, "w") as fp:
+      for lines in self.latest.values():
+        fp.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, self.prom_path)
+
+  def onQueryIdle(self, event):
+    pass
+
+  def onQueryTerminated(self, event):
+    self.latest.pop(str(event.id), None)
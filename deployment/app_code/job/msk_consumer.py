@@ -2,44 +2,242 @@ from pyspark.sql import SparkSession
 from pyspark.sql.types import *
 from pyspark.sql.functions import *
 import pyspark
+import argparse
 import sys
+from taxi_schema import taxiRidesSchema, taxiFaresSchema
+from stream_parser import parse_csv_value
+from rides_pipeline import driver_window_counts, ride_fare_join
+from state_store import STATE_STORE_PROVIDERS, state_store_conf, StateStoreReporter
+from triggers import TRIGGER_MODES, apply_trigger
+from backpressure import OffsetCapController
+from metrics import ProgressMetricsExporter
+from output_encoder import OUTPUT_FORMATS, OUTPUT_MODES, COMPRESSION_CODECS, encode_for_kafka, kafka_producer_options, \
+  window_key
+from fanout_sink import FanOutSink, parse_sinks
+from lake_sink import lake_writer
+from shuffle_partitions import configure_shuffle_partitions
+from join_state import JoinStateReporter
+from ride_pairing import pair_ride_events
+from dedup import DedupReporter, drop_duplicate_events
+from geo_grid import hotspot_counts
+from dimension import DimensionRefresher, DimensionTable
+from latency import SOURCE_TIME_COL, LatencyReporter, with_latency_metrics
 
-spark = SparkSession.builder \
+PARSE_METHODS = {"jvm": "split", "from_csv": "from_csv", "pandas": "pandas"}
+
+def parser_modes(spec):
+  # "pandas" applies to every topic, "taxirides=pandas,taxifares=jvm" picks per topic
+  modes = {}
+  for item in spec.split(","):
+    topic, _, mode = item.rpartition("=")
+    if mode not in PARSE_METHODS:
+      raise argparse.ArgumentTypeError("Unknown parser mode: {}".format(mode))
+    modes[topic or "*"] = mode
+  return modes
+
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument("bootstrap_servers")
+arg_parser.add_argument("checkpoint_location")
+arg_parser.add_argument("output_topic")
+arg_parser.add_argument("--pipeline", choices=["driver-counts", "ride-fares", "trips", "hotspots"], \
+  default="driver-counts", help="ride-fares joins START events with the fares topic on rideId, trips pairs the "
+  "START and END event of each ride into a trip record, hotspots counts rides per grid cell and window, "
+  "instead of counting rides per driver")
+arg_parser.add_argument("--fares-topic", default="taxifares")
+arg_parser.add_argument("--join-watermark", default="1 minute", help="event-time watermark delay of both join sides")
+arg_parser.add_argument("--join-bound", default="1 minute", \
+  help="a fare joins a ride whose startTime is within this interval of its own")
+arg_parser.add_argument("--join-state-every", type=int, default=0, \
+  help="count the join state rows per side from the checkpoint every N batches, HDFS state store only")
+arg_parser.add_argument("--trips-watermark", default="1 minute", help="event-time watermark delay of the trips pipeline")
+arg_parser.add_argument("--max-ride-duration", default="2 hours", \
+  help="a ride still missing its START or END this long after its event time is emitted as incomplete")
+arg_parser.add_argument("--grid-resolution", type=int, default=16, \
+  help="grid cells of the hotspot count, 2^r x 2^r over the world, 16 is about 460 x 300 m in New York")
+arg_parser.add_argument("--hotspots-topic", \
+  help="also run the hotspot count alongside the pipeline, as a second query writing to this topic")
+arg_parser.add_argument("--dedup-ttl", \
+  help="drop repeated (rideId, isStart) events arriving within this processing time of the first copy, " \
+       "e.g. 10 minutes, off by default")
+arg_parser.add_argument("--driver-dim", \
+  help="Parquet table (local or s3://) of driver attributes keyed by driverId, joined onto the output")
+arg_parser.add_argument("--taxi-dim", \
+  help="Parquet table (local or s3://) of taxi attributes keyed by taxiId, joined onto the output")
+arg_parser.add_argument("--dim-refresh-seconds", type=int, default=300, \
+  help="reload a dimension table after this long even if its files did not change")
+arg_parser.add_argument("--dim-check-seconds", type=int, default=60, \
+  help="list a dimension table's files to look for a new version at most this often")
+arg_parser.add_argument("--trace-latency", action="store_true", \
+  help="carry the oldest and newest Kafka source time of each window and report output-minus-source latency percentiles")
+arg_parser.add_argument("--parser", type=parser_modes, default={"*": "jvm"}, \
+  help="jvm, from_csv or pandas, either for all topics or per topic as topic=mode,...")
+arg_parser.add_argument("--arrow-batch-size", type=int, default=10000)
+arg_parser.add_argument("--aggregation", choices=["window", "pane"], default="window", \
+  help="pane counts non-overlapping panes and merges them into the sliding windows at emit time")
+arg_parser.add_argument("--window", default="10 seconds")
+arg_parser.add_argument("--slide", default="5 seconds")
+arg_parser.add_argument("--state-store", choices=list(STATE_STORE_PROVIDERS), default="hdfs", \
+  help="rocksdb keeps the window state off the executor heap, tuning is in state_store.py")
+arg_parser.add_argument("--shuffle-partitions", default="auto", \
+  help="partitions of the stateful aggregation, auto sizes a new checkpoint from the topic partitions and executor cores")
+arg_parser.add_argument("--trigger", choices=TRIGGER_MODES, default="default", \
+  help="continuous runs a map-only variant that parses and forwards rides without the window count")
+arg_parser.add_argument("--trigger-interval", \
+  help="processingTime interval, or the checkpoint interval of continuous mode")
+arg_parser.add_argument("--starting-offsets", default="latest", \
+  help="earliest for backfill runs with --trigger availableNow")
+arg_parser.add_argument("--max-offsets-per-trigger", type=int, \
+  help="cap on Kafka offsets per micro-batch, the starting cap when --adaptive-offsets is set")
+arg_parser.add_argument("--adaptive-offsets", action="store_true", \
+  help="adjust maxOffsetsPerTrigger towards --target-batch-seconds, restarting the query when it moves")
+arg_parser.add_argument("--target-batch-seconds", type=float, default=10.0)
+arg_parser.add_argument("--offset-state", \
+  help="where the adaptive cap is kept between runs, defaults to <checkpoint location>_offset_cap.json")
+arg_parser.add_argument("--output-mode", choices=OUTPUT_MODES, default="append", \
+  help="update emits a window's running count on every change instead of once the watermark passes its end")
+arg_parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="json", \
+  help="avro needs the spark-avro package, csv is the flattened row with epoch-millisecond timestamps")
+arg_parser.add_argument("--output-key", \
+  help="SQL expression of the Kafka record key, none for unkeyed records, defaults to cell for the hotspots "
+  "pipeline and driverId otherwise")
+arg_parser.add_argument("--output-compression", choices=COMPRESSION_CODECS, default="none")
+arg_parser.add_argument("--sinks", \
+  help="fan out each micro-batch with foreachBatch, e.g. kafka,parquet:s3://bucket/driver_counts,console")
+arg_parser.add_argument("--lake-path", \
+  help="write the counts to date/hour partitioned Parquet here instead of Kafka, compact it with compact_lake.py")
+arg_parser.add_argument("--metrics-dir", \
+  help="local folder for per-batch progress.jsonl and a Prometheus textfile")
+args = arg_parser.parse_args()
+if args.trigger == "continuous" and (args.aggregation != "window" or "pandas" in args.parser.values() or \
+                                    args.pipeline != "driver-counts"):
+  arg_parser.error("continuous trigger only supports the map-only JVM path")
+if args.trigger == "continuous" and (args.adaptive_offsets or args.max_offsets_per_trigger):
+  arg_parser.error("maxOffsetsPerTrigger does not apply to the continuous trigger")
+if args.trigger == "continuous" and (args.sinks or args.lake_path or args.dedup_ttl or args.hotspots_topic):
+  arg_parser.error("foreachBatch and file sinks, the dedup stage and hotspots do not run with the continuous trigger")
+if args.trigger == "continuous" and (args.driver_dim or args.taxi_dim):
+  arg_parser.error("dimension joins do not run with the continuous trigger")
+if args.taxi_dim and args.pipeline != "ride-fares":
+  arg_parser.error("--taxi-dim needs taxiId in the output, only the ride-fares pipeline has it")
+if args.driver_dim and args.pipeline == "hotspots":
+  arg_parser.error("--driver-dim needs driverId in the output, the hotspots pipeline has none")
+if args.sinks and args.lake_path:
+  arg_parser.error("--lake-path replaces the Kafka output, use parquet:<path> in --sinks to fan out instead")
+if args.output_mode == "update" and (args.pipeline not in ("driver-counts", "hotspots") or args.aggregation != "window"):
+  arg_parser.error("update mode needs the window aggregation of the driver-counts or hotspots pipeline")
+if args.output_mode == "update" and (args.lake_path or args.trigger == "continuous" or args.dedup_ttl):
+  arg_parser.error("the file sink, the continuous trigger and the dedup stage (an append-mode state operator " \
+                   "ahead of the aggregation) only run in append mode")
+if args.trace_latency and (args.pipeline not in ("driver-counts", "hotspots") or args.aggregation != "window" or \
+                           args.trigger == "continuous"):
+  arg_parser.error("--trace-latency needs the micro-batch window aggregation of the driver-counts or hotspots pipeline")
+if args.dedup_ttl and \
+   (args.pipeline == "trips" or (args.pipeline == "driver-counts" and args.aggregation == "pane")):
+  # Spark 3.4 rejects the plan: "Multiple applyInPandasWithStates are not supported on a streaming DataFrames/Datasets"
+  arg_parser.error("the dedup stage, the trips pairing and the pane aggregation each run in applyInPandasWithState, " \
+                   "and Spark 3.4 rejects a streaming query with more than one applyInPandasWithState")
+if args.output_key is None:
+  args.output_key = "cell" if args.pipeline == "hotspots" else "driverId"
+  if args.output_mode == "update":
+    args.output_key = window_key(args.output_key)
+
+source_time_col = SOURCE_TIME_COL if args.trace_latency else None
+
+def parse_method(topic):
+  return PARSE_METHODS[args.parser.get(topic, args.parser.get("*", "jvm"))]
+
+builder = SparkSession.builder \
   .appName("Spark Structured Streaming from Kafka") \
-  .getOrCreate()
-
-sdfRides = spark \
-  .readStream \
-  .format("kafka") \
-  .option("kafka.bootstrap.servers", sys.argv[1]) \
-  .option("subscribe", "taxirides") \
-  .option("startingOffsets", "latest") \
-  .option("auto.offset.reset", "latest") \
-  .load() \
-  .selectExpr("decode(CAST(value AS STRING),'utf-8') as value") 
+  .config("spark.sql.execution.arrow.maxRecordsPerBatch", args.arrow_batch_size)
+for key, value in state_store_conf(args.state_store).items():
+  builder = builder.config(key, value)
+spark = builder.getOrCreate()
+spark.streams.addListener(StateStoreReporter())
+if args.metrics_dir:
+  spark.streams.addListener(ProgressMetricsExporter(args.metrics_dir))
+# the output and the hotspots query each count their dropped copies in an accumulator of their own
+output_dedup = DedupReporter(spark.sparkContext.accumulator(0)) if args.dedup_ttl else None
+hotspots_dedup = DedupReporter(spark.sparkContext.accumulator(0)) if args.dedup_ttl and args.hotspots_topic else None
+for reporter in (output_dedup, hotspots_dedup):
+  if reporter is not None:
+    spark.streams.addListener(reporter)
+if args.trace_latency:
+  spark.streams.addListener(LatencyReporter())
+if args.pipeline == "ride-fares":
+  spark.streams.addListener(JoinStateReporter(spark, args.checkpoint_location, args.join_state_every))
+dimensions = []
+if args.driver_dim:
+  dimensions.append(DimensionTable(spark, "drivers", args.driver_dim, "driverId", refresh_seconds=args.dim_refresh_seconds, \
+                                   check_seconds=args.dim_check_seconds))
+if args.taxi_dim:
+  dimensions.append(DimensionTable(spark, "taxis", args.taxi_dim, "taxiId", refresh_seconds=args.dim_refresh_seconds, \
+                                   check_seconds=args.dim_check_seconds))
+refresher = DimensionRefresher(dimensions) if dimensions else None
+if refresher is not None:
+  spark.streams.addListener(refresher)
+if args.trigger != "continuous":
+  configure_shuffle_partitions(spark, args.checkpoint_location, args.bootstrap_servers, "taxirides", args.shuffle_partitions)
+
+def read_kafka(topic, max_offsets=None):
+  reader = spark \
+    .readStream \
+    .format("kafka") \
+    .option("kafka.bootstrap.servers", args.bootstrap_servers) \
+    .option("subscribe", topic) \
+    .option("startingOffsets", args.starting_offsets) \
+    .option("auto.offset.reset", "latest")
+  if max_offsets:
+    reader = reader.option("maxOffsetsPerTrigger", max_offsets)
+  return reader.load() \
+    .selectExpr("decode(CAST(value AS STRING),'utf-8') as value", "timestamp as kafkaTimestamp")
     
-taxiRidesSchema = StructType([ \
-  StructField("rideId", LongType()), StructField("isStart", StringType()), \
-  StructField("endTime", TimestampType()), StructField("startTime", TimestampType()), \
-  StructField("startLon", FloatType()), StructField("startLat", FloatType()), \
-  StructField("endLon", FloatType()), StructField("endLat", FloatType()), \
-  StructField("passengerCnt", ShortType()), StructField("taxiId", LongType()), \
-  StructField("driverId", LongType()),StructField("timestamp", TimestampType())])
-
-def parse_data_from_kafka_message(sdf, schema):
+def parse_data_from_kafka_message(sdf, schema, method="split"):
   assert sdf.isStreaming == True, "DataFrame doesn't receive streaming data"
-  col = split(sdf['value'], ',') 
-  for idx, field in enumerate(schema): 
-      sdf = sdf.withColumn(field.name, col.getItem(idx).cast(field.dataType)) 
-      if field.name=="timestamp":
-          sdf = sdf.withColumn(field.name, current_timestamp())
-  return sdf.select([field.name for field in schema])
+  # current_timestamp() is not available in continuous processing, the Kafka record time stands in for it
+  ingest_time = col("kafkaTimestamp") if args.trigger == "continuous" else current_timestamp()
+  # with --trace-latency the Kafka record time is kept apart from the ingest time as sourceTime
+  keep = [col("kafkaTimestamp").alias(source_time_col)] if source_time_col else None
+  return parse_csv_value(sdf, schema, method=method, overrides={"timestamp": ingest_time}, keep=keep)
+
+def read_rides(max_offsets=None, dedup=None):
+  sdfRides = parse_data_from_kafka_message(read_kafka("taxirides", max_offsets), taxiRidesSchema, parse_method("taxirides"))
+  if dedup is not None:
+    sdfRides = drop_duplicate_events(sdfRides, args.dedup_ttl, dropped=dedup.dropped)
+  return sdfRides
+
+def watch_dedup(query, dedup):
+  return dedup.watch(query) if dedup is not None else query
 
-sdfRides = parse_data_from_kafka_message(sdfRides, taxiRidesSchema)
-# sdfFares = parse_data_from_kafka_message(sdfFares, taxiFaresSchema)
+def watch_output(query):
+  if refresher is not None:
+    refresher.watch(query)
+  return watch_dedup(query, output_dedup)
 
-query = sdfRides.withWatermark("timestamp", "10 seconds") \
-                .groupBy("driverId", window("timestamp", "10 seconds", "5 seconds")).count()
+def enrich(query):
+  # joined onto the pipeline output rather than the raw rides: fewer rows to probe, same attributes
+  for table in dimensions:
+    query = table.join(query)
+  return query
+
+def trace(query):
+  return with_latency_metrics(query) if args.trace_latency else query
+
+def build_query(max_offsets=None):
+  return trace(enrich(pipeline_query(max_offsets)))
+
+def pipeline_query(max_offsets=None):
+  if args.trigger == "continuous":
+    return parse_data_from_kafka_message(read_kafka("taxirides"), taxiRidesSchema, parse_method("taxirides"))
+  sdfRides = read_rides(max_offsets, output_dedup)
+  if args.pipeline == "ride-fares":
+    sdfFares = parse_data_from_kafka_message(read_kafka(args.fares_topic, max_offsets), taxiFaresSchema, \
+                                             parse_method(args.fares_topic))
+    return ride_fare_join(sdfRides, sdfFares, args.join_watermark, args.join_watermark, args.join_bound)
+  if args.pipeline == "trips":
+    return pair_ride_events(sdfRides, args.trips_watermark, args.max_ride_duration)
+  if args.pipeline == "hotspots":
+    return hotspot_counts(sdfRides, args.grid_resolution, args.window, args.slide, source_time_col=source_time_col)
+  return driver_window_counts(sdfRides, args.aggregation, args.window, args.slide, source_time_col=source_time_col)
 
 # query.writeStream \
 #     .outputMode("append") \
@@ -49,14 +247,62 @@ query = sdfRides.withWatermark("timestamp", "10 seconds") \
 #     .start() \
 #     .awaitTermination()
 
-output=query.select(to_json(struct("*")).alias("value")) \
-  .selectExpr("CAST(value AS STRING)") \
-  .writeStream \
-  .outputMode("append") \
-  .format("kafka") \
-  .option("kafka.bootstrap.servers", sys.argv[1]) \
-  .option("topic", sys.argv[3]) \
-  .option("checkpointLocation", sys.argv[2]) \
-  .start()
-
-output.awaitTermination()
+def start_fanout(query):
+  sinks = parse_sinks(args.sinks, args.bootstrap_servers, args.output_topic, \
+    args.output_format, args.output_key, args.output_compression)
+  writer = query.writeStream \
+    .outputMode(args.output_mode) \
+    .foreachBatch(FanOutSink(spark, sinks, args.checkpoint_location.rstrip("/") + "_fanout")) \
+    .option("checkpointLocation", args.checkpoint_location)
+  return apply_trigger(writer, args.trigger, args.trigger_interval).start()
+
+def start_output(query):
+  if args.sinks:
+    return start_fanout(query)
+  if args.lake_path:
+    time_col = "window.start" if "window" in query.columns else "startTime"
+    return apply_trigger(lake_writer(query, args.lake_path, args.checkpoint_location, time_col), \
+                         args.trigger, args.trigger_interval).start()
+  writer=encode_for_kafka(query, args.output_format, args.output_key) \
+    .writeStream \
+    .outputMode(args.output_mode) \
+    .format("kafka") \
+    .option("kafka.bootstrap.servers", args.bootstrap_servers) \
+    .option("topic", args.output_topic) \
+    .option("checkpointLocation", args.checkpoint_location)
+  for key, value in kafka_producer_options(args.output_compression).items():
+    writer = writer.option(key, value)
+  return apply_trigger(writer, args.trigger, args.trigger_interval).start()
+
+def start_hotspots():
+  # a query of its own, it reads the rides topic a second time and keeps its own state
+  hotspots = hotspot_counts(read_rides(args.max_offsets_per_trigger, hotspots_dedup), args.grid_resolution, \
+                            args.window, args.slide, source_time_col=source_time_col)
+  writer = encode_for_kafka(trace(hotspots), args.output_format, \
+                            window_key("cell") if args.output_mode == "update" else "cell") \
+    .writeStream \
+    .outputMode(args.output_mode) \
+    .format("kafka") \
+    .option("kafka.bootstrap.servers", args.bootstrap_servers) \
+    .option("topic", args.hotspots_topic) \
+    .option("checkpointLocation", args.checkpoint_location.rstrip("/") + "_hotspots")
+  for key, value in kafka_producer_options(args.output_compression).items():
+    writer = writer.option(key, value)
+  return watch_dedup(apply_trigger(writer, args.trigger, args.trigger_interval).start(), hotspots_dedup)
+
+if args.hotspots_topic:
+  start_hotspots()
+
+if args.adaptive_offsets:
+  controller = OffsetCapController(spark, \
+    args.offset_state or args.checkpoint_location.rstrip("/") + "_offset_cap.json", \
+    args.target_batch_seconds, args.max_offsets_per_trigger or 100000)
+  spark.streams.addListener(controller)
+  restart = True
+  while restart:
+    output = watch_output(start_output(build_query(controller.cap)))
+    controller.query_started(output)
+    restart = controller.await_termination_or_restart(output)
+else:
+  output = watch_output(start_output(build_query(args.max_offsets_per_trigger)))
+  output.awaitTermination()
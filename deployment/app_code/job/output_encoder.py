@@ -0,0 +1,52 @@
+from pyspark.sql.functions import concat_ws, expr, struct, to_json
+from pyspark.sql.types import StructType, TimestampType
+
+# Key and value encoding of the Kafka sink.
+#   json  to_json of the whole row, nested window struct included (the original output)
+#   avro  binary Avro of the flattened row, needs the spark-avro package on the classpath
+#   csv   flattened row in fixed column order, timestamps as epoch milliseconds
+
+OUTPUT_FORMATS = ["json", "avro", "csv"]
+OUTPUT_MODES = ["append", "update"]
+COMPRESSION_CODECS = ["none", "gzip", "snappy", "lz4", "zstd"]
+
+def flat_columns(df):
+  """(name, Column) pairs of the row with struct fields lifted to <struct><Field> columns
+  and timestamps as epoch milliseconds, e.g. window.start -> windowStart."""
+  columns = []
+  for field in df.schema:
+    children = field.dataType if isinstance(field.dataType, StructType) else [None]
+    for child in children:
+      if child is None:
+        name, path, data_type = field.name, "`{}`".format(field.name), field.dataType
+      else:
+        name = field.name + child.name[:1].upper() + child.name[1:]
+        path, data_type = "`{}`.`{}`".format(field.name, child.name), child.dataType
+      columns.append((name, expr("unix_millis({})".format(path) if isinstance(data_type, TimestampType) else path)))
+  return columns
+
+def encode_value(df, output_format):
+  if output_format == "json":
+    return to_json(struct("*"))
+  columns = flat_columns(df)
+  if output_format == "avro":
+    from pyspark.sql.avro.functions import to_avro
+    return to_avro(struct([column.alias(name) for name, column in columns]))
+  if output_format == "csv":
+    return concat_ws(",", *[column.cast("string") for _, column in columns])
+  raise ValueError("Unknown output format: {}".format(output_format))
+
+def encode_for_kafka(df, output_format="json", key_expr="driverId"):
+  """key and value columns for the Kafka sink. key_expr is a SQL expression, "none" leaves the key null."""
+  columns = [encode_value(df, output_format).alias("value")]
+  if key_expr and key_expr != "none":
+    columns.insert(0, expr(key_expr).cast("string").alias("key"))
+  return df.select(columns)
+
+def window_key(key_col):
+  """Key expression of one record per key and window, e.g. 2013000042|1577836800000. In update mode a
+  window is written again on every change, and a compacted topic then keeps only the latest count."""
+  return "concat_ws('|', {}, unix_millis(window.start))".format(key_col)
+
+def kafka_producer_options(compression="none"):
+  return {} if compression == "none" else {"kafka.compression.type": compression}
@@ -0,0 +1,108 @@
+import math
+import numpy as np
+import pandas as pd
+from pyspark.sql.functions import col, expr, floor, struct
+from pyspark.sql.streaming.state import GroupStateTimeout
+from pyspark.sql.types import *
+
+# Sliding-window counts from non-overlapping panes. Each event updates exactly one pane
+# (width gcd(window, slide)) and the sliding windows are summed from panes when the
+# watermark passes their end, instead of writing every event into window/slide windows.
+
+DURATION_UNITS = {"millisecond": 1, "second": 1000, "minute": 60 * 1000, "hour": 3600 * 1000, "day": 86400 * 1000}
+
+def duration_ms(duration):
+  amount, unit = duration.split()
+  return int(float(amount) * DURATION_UNITS[unit.lower().rstrip("s")])
+
+PANE_STATE_SCHEMA = StructType([ \
+  StructField("paneStarts", ArrayType(LongType())), StructField("paneCounts", ArrayType(LongType())), \
+  StructField("emittedUntil", LongType())])
+
+def pane_output_schema(key_field):
+  # window bounds in epoch ms: Spark pads the output frames with all-None rows, which pandas 1.5
+  # cannot concatenate with a tz-aware datetime column
+  return StructType([key_field, StructField("windowStartMs", LongType()), \
+                     StructField("windowEndMs", LongType()), StructField("count", LongType())])
+
+def covering_window_ends(pane_starts, window_ms, slide_ms):
+  # sliding windows start on multiples of the slide, so a pane belongs to at most ceil(window/slide) of them
+  copies = -(-window_ms // slide_ms)
+  base = pane_starts // slide_ms * slide_ms
+  starts = np.concatenate([base - offset * slide_ms for offset in range(copies)])
+  starts = starts[starts > np.tile(pane_starts, copies) - window_ms]
+  return np.unique(starts + window_ms)
+
+def merge_panes(window_ms, slide_ms, key_name):
+  def last_window_end(pane_starts):
+    return pane_starts // slide_ms * slide_ms + window_ms
+
+  def merge(key, pdfs, state):
+    watermark = state.getCurrentWatermarkMs()
+    if state.exists:
+      starts, counts, emitted_until = state.get
+      panes = dict(zip(starts, counts))
+    else:
+      # Spark already dropped the rows whose last window ended before the previous batch's watermark
+      # (see lastWindowEnd), a new key has emitted nothing yet
+      panes, emitted_until = {}, 0
+
+    for pdf in pdfs:
+      new_starts, new_counts = np.unique(pdf["paneStart"].to_numpy(dtype="int64"), return_counts=True)
+      # a pane is only kept while one of the windows covering it is still open
+      useful = last_window_end(new_starts) > emitted_until
+      for start, count in zip(new_starts[useful].tolist(), new_counts[useful].tolist()):
+        panes[start] = panes.get(start, 0) + count
+
+    pane_starts = np.array(sorted(panes), dtype="int64")
+    pane_counts = np.array([panes[start] for start in pane_starts.tolist()], dtype="int64")
+    window_ends = covering_window_ends(pane_starts, window_ms, slide_ms)
+    closing = window_ends[(window_ends > emitted_until) & (window_ends <= watermark)]
+    if len(closing):
+      cumulative = np.concatenate([[0], np.cumsum(pane_counts)])
+      upper = np.searchsorted(pane_starts, closing, side="left")
+      lower = np.searchsorted(pane_starts, closing - window_ms, side="left")
+      yield pd.DataFrame({
+        key_name: [key[0]] * len(closing),
+        "windowStartMs": closing - window_ms,
+        "windowEndMs": closing,
+        "count": cumulative[upper] - cumulative[lower]})
+
+    emitted_until = max(emitted_until, watermark)
+    remaining = last_window_end(pane_starts) > emitted_until
+    if not remaining.any():
+      state.remove()
+      return
+    state.update((pane_starts[remaining].tolist(), pane_counts[remaining].tolist(), emitted_until))
+    # fire once the watermark passes the next window end, even if the key receives no more events
+    next_end = int(window_ends[window_ends > emitted_until].min())
+    state.setTimeoutTimestamp(max(next_end - 1, watermark + 1))
+
+  return merge
+
+def pane_window_count(sdf, key, time_col, window_duration, slide_duration):
+  """groupBy(key, window(time_col, window_duration, slide_duration)).count() in append mode,
+  computed from tumbling panes. `sdf` must already carry a watermark on time_col.
+
+  The watermark metadata moves to lastWindowEnd, the end of the row's latest covering window, so
+  Spark drops a late row only once all its windows have ended before the previous batch's
+  watermark, as the window aggregation drops its (row, window) pairs. One case still differs: a
+  late row whose earlier windows ended before that watermark, where the key has no other row in
+  them. The window aggregation leaves those windows out, the panes emit them."""
+  window_ms, slide_ms = duration_ms(window_duration), duration_ms(slide_duration)
+  pane_ms = math.gcd(window_ms, slide_ms)
+  merge = merge_panes(window_ms, slide_ms, key)
+  key_field = sdf.schema[key]
+  watermark = sdf.schema[time_col].metadata
+  if "spark.watermarkDelayMs" not in watermark:
+    raise ValueError("pane_window_count needs a watermark on {}".format(time_col))
+  time_ms = floor(col(time_col).cast("double") * 1000)
+  pane_start = (floor(time_ms / pane_ms) * pane_ms).cast("long")
+  last_window_end = ((floor(time_ms / slide_ms) * slide_ms + window_ms) / 1000).cast("timestamp")
+  return sdf.select(col(key), last_window_end.alias("lastWindowEnd", metadata=watermark), \
+                    pane_start.alias("paneStart")) \
+            .groupBy(key) \
+            .applyInPandasWithState(merge, pane_output_schema(key_field), PANE_STATE_SCHEMA, \
+                                    "append", GroupStateTimeout.EventTimeTimeout) \
+            .select(key, struct(expr("timestamp_millis(windowStartMs)").alias("start"), \
+                                expr("timestamp_millis(windowEndMs)").alias("end")).alias("window"), "count")
@@ -0,0 +1,227 @@
+import argparse
+import json
+import struct
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import expr
+from pyspark.sql.types import *
+from hadoop_fs import copy, list_files, read_bytes, read_text, write_bytes, write_text
+from shuffle_partitions import SHUFFLE_PARTITIONS
+
+# Offline re-partitioning of a stopped query's checkpoint into a new checkpoint with another
+# shuffle partition count. The state of the last committed batch is loaded from every old
+# partition, each key is assigned to pmod(hash(key), partitions), the same Murmur3 hash Spark's
+# shuffle uses, and one snapshot file per new partition is written. The offset and commit logs
+# are copied with the partition count in the latest offset log entry changed. The old checkpoint
+# is left as it is; start the consumer on the new one.
+#
+# Supports the HDFS-backed state store and operators with a single store per partition
+# (aggregations, deduplication, applyInPandasWithState), not RocksDB or stream-stream joins.
+# Usage: python repartition_state.py s3://${S3BUCKET}/stream/checkpoint/consumer_taxi \
+#          s3://${S3BUCKET}/stream/checkpoint/consumer_taxi_p48 --partitions 48
+
+HDFS_PROVIDER = "org.apache.spark.sql.execution.streaming.state.HDFSBackedStateStoreProvider"
+CODEC_CONF = "spark.sql.streaming.stateStore.compression.codec"
+
+def batch_ids(spark, folder):
+  return sorted(int(status["name"]) for status in list_files(spark, folder) if status["name"].isdigit())
+
+def read_utf(data, pos):
+  # java.io.DataInput.readUTF, schemas are ASCII JSON
+  size, = struct.unpack_from(">H", data, pos)
+  return data[pos + 2:pos + 2 + size].decode("utf-8"), pos + 2 + size
+
+def read_state_schema(spark, operator_dir):
+  """(key schema, value schema) of an operator from its _metadata/schema file, format v1 or v2."""
+  data = read_bytes(spark, operator_dir + "/_metadata/schema")
+  version, pos = read_utf(data, 0)
+  schemas = []
+  for _ in range(2):
+    if version == "v1":
+      text, pos = read_utf(data, pos)
+    else:
+      chunks, = struct.unpack_from(">i", data, pos)
+      pos, parts = pos + 4, []
+      for _ in range(chunks):
+        part, pos = read_utf(data, pos)
+        parts.append(part)
+      text = "".join(parts)
+    schemas.append(StructType.fromJson(json.loads(text)))
+  return schemas
+
+def read_unsafe_row(data, offset, schema):
+  """Python values of an UnsafeRow, timestamps and dates as their internal long and int."""
+  bitset_bytes = (len(schema.fields) + 63) // 64 * 8
+  values = []
+  for idx, field in enumerate(schema.fields):
+    if data[offset + idx // 8] >> (idx % 8) & 1:
+      values.append(None)
+      continue
+    slot = offset + bitset_bytes + idx * 8
+    data_type = field.dataType
+    if isinstance(data_type, (LongType, TimestampType, TimestampNTZType)):
+      values.append(struct.unpack_from("<q", data, slot)[0])
+    elif isinstance(data_type, (IntegerType, DateType)):
+      values.append(struct.unpack_from("<i", data, slot)[0])
+    elif isinstance(data_type, ShortType):
+      values.append(struct.unpack_from("<h", data, slot)[0])
+    elif isinstance(data_type, ByteType):
+      values.append(struct.unpack_from("<b", data, slot)[0])
+    elif isinstance(data_type, BooleanType):
+      values.append(data[slot] != 0)
+    elif isinstance(data_type, FloatType):
+      values.append(struct.unpack_from("<f", data, slot)[0])
+    elif isinstance(data_type, DoubleType):
+      values.append(struct.unpack_from("<d", data, slot)[0])
+    elif isinstance(data_type, (StringType, BinaryType, StructType)):
+      offset_and_size, = struct.unpack_from("<Q", data, slot)
+      start, size = offset + (offset_and_size >> 32), offset_and_size & 0xFFFFFFFF
+      if isinstance(data_type, StructType):
+        values.append(tuple(read_unsafe_row(data, start, data_type)))
+      else:
+        chunk = bytes(data[start:start + size])
+        values.append(chunk.decode("utf-8") if isinstance(data_type, StringType) else bytearray(chunk))
+    else:
+      raise ValueError("Unsupported state key type {} of {}".format(data_type.simpleString(), field.name))
+  return values
+
+def hash_schema(schema):
+  """schema with the types Spark hashes as long or int replaced by them, so that hash() over the
+  decoded values gives the same result as over the original columns."""
+  fields = []
+  for field in schema.fields:
+    data_type = field.dataType
+    if isinstance(data_type, (TimestampType, TimestampNTZType)):
+      data_type = LongType()
+    elif isinstance(data_type, DateType):
+      data_type = IntegerType()
+    elif isinstance(data_type, StructType):
+      data_type = hash_schema(data_type)
+    fields.append(StructField(field.name, data_type, True))
+  return StructType(fields)
+
+def read_records(data):
+  """(key, value) pairs of a state snapshot or delta file, value None for a removed key."""
+  pos = 0
+  while True:
+    key_size, = struct.unpack_from(">i", data, pos)
+    if key_size == -1:
+      return
+    key = data[pos + 4:pos + 4 + key_size]
+    value_size, = struct.unpack_from(">i", data, pos + 4 + key_size)
+    pos += 8 + key_size
+    if value_size < 0:
+      yield key, None
+    else:
+      yield key, data[pos:pos + value_size]
+      pos += value_size
+
+def write_records(pairs):
+  chunks = []
+  for key, value in pairs:
+    chunks += [struct.pack(">i", len(key)), key, struct.pack(">i", len(value)), value]
+  chunks.append(struct.pack(">i", -1))
+  return b"".join(chunks)
+
+def load_partition_state(spark, partition_dir, version, codec):
+  """The key -> value map of one partition at version: latest snapshot plus the deltas after it."""
+  names = set(status["name"] for status in list_files(spark, partition_dir))
+  if any(name.endswith(".zip") or name.endswith(".changelog") for name in names):
+    raise ValueError("{} is RocksDB state, only the HDFS-backed store is supported".format(partition_dir))
+  snapshots = [int(name.split(".")[0]) for name in names \
+               if name.endswith(".snapshot") and int(name.split(".")[0]) <= version]
+  first = max(snapshots) if snapshots else 0
+  state = {}
+  files = (["{}.snapshot".format(first)] if snapshots else []) + \
+          ["{}.delta".format(v) for v in range(first + 1, version + 1)]
+  for name in files:
+    if name not in names:
+      raise ValueError("{}/{} is missing, the state of version {} cannot be rebuilt".format(partition_dir, name, version))
+    for key, value in read_records(read_bytes(spark, "{}/{}".format(partition_dir, name), codec)):
+      if value is None:
+        state.pop(key, None)
+      else:
+        state[key] = value
+  return state
+
+def assign_partitions(spark, keys, key_schema, partitions):
+  if not keys:
+    return []
+  schema = StructType([StructField("__index", LongType(), False)] + hash_schema(key_schema).fields)
+  rows = [[idx] + read_unsafe_row(key, 0, key_schema) for idx, key in enumerate(keys)]
+  columns = ", ".join("`{}`".format(field.name) for field in key_schema.fields)
+  assigned = spark.createDataFrame(rows, schema) \
+    .select("__index", expr("pmod(hash({}), {})".format(columns, partitions)).alias("partition")) \
+    .collect()
+  return [row["partition"] for row in sorted(assigned, key=lambda row: row["__index"])]
+
+def repartition_operator(spark, source_dir, target_dir, version, partitions, codec):
+  old_partitions = [status["name"] for status in list_files(spark, source_dir) if status["name"].isdigit()]
+  for name in old_partitions:
+    if any(status["isDir"] for status in list_files(spark, "{}/{}".format(source_dir, name))):
+      raise ValueError("{} has several state stores per partition (a stream-stream join?), not supported".format(source_dir))
+  key_schema, _ = read_state_schema(spark, source_dir)
+  state = {}
+  for name in old_partitions:
+    state.update(load_partition_state(spark, "{}/{}".format(source_dir, name), version, codec))
+  keys = list(state)
+  new_state = [[] for _ in range(partitions)]
+  for key, partition in zip(keys, assign_partitions(spark, keys, key_schema, partitions)):
+    new_state[partition].append((key, state[key]))
+  # every partition gets a snapshot, an empty one too, so that each state store task finds its version
+  for partition, pairs in enumerate(new_state):
+    write_bytes(spark, "{}/{}/{}.snapshot".format(target_dir, partition, version), write_records(pairs), codec)
+  copy(spark, source_dir + "/_metadata", target_dir + "/_metadata")
+  print("{}: {} keys from {} to {} partitions, version {}".format(source_dir, len(keys), len(old_partitions), \
+    partitions, version))
+
+def repartition_checkpoint(spark, source, target, partitions, drop_uncommitted=False):
+  source, target = source.rstrip("/"), target.rstrip("/")
+  if list_files(spark, target):
+    raise ValueError("{} already exists".format(target))
+  offsets, commits = batch_ids(spark, source + "/offsets"), batch_ids(spark, source + "/commits")
+  if not commits:
+    raise ValueError("{} has no committed batch".format(source))
+  committed = commits[-1]
+  if offsets[-1] != committed and not drop_uncommitted:
+    raise ValueError("Batch {} of {} is planned but not committed, rerun with --drop-uncommitted to " \
+                     "leave it out (it is planned again from the committed offsets)".format(offsets[-1], source))
+
+  lines = read_text(spark, "{}/offsets/{}".format(source, committed)).splitlines()
+  metadata = json.loads(lines[1])
+  conf = metadata.setdefault("conf", {})
+  if conf.get("spark.sql.streaming.stateStore.providerClass", HDFS_PROVIDER) != HDFS_PROVIDER:
+    raise ValueError("Only the HDFS-backed state store is supported, the checkpoint uses {}".format( \
+      conf["spark.sql.streaming.stateStore.providerClass"]))
+  codec = conf.get(CODEC_CONF, "lz4")
+
+  for name in ["metadata", "sources"]:
+    if list_files(spark, "{}/{}".format(source, name)):
+      copy(spark, "{}/{}".format(source, name), "{}/{}".format(target, name))
+  for folder, ids in [("offsets", offsets), ("commits", commits)]:
+    for batch_id in ids:
+      if batch_id <= committed:
+        copy(spark, "{}/{}/{}".format(source, folder, batch_id), "{}/{}/{}".format(target, folder, batch_id))
+  print("{} shuffle partitions -> {}".format(conf.get(SHUFFLE_PARTITIONS), partitions))
+  conf[SHUFFLE_PARTITIONS] = str(partitions)
+  lines[1] = json.dumps(metadata, separators=(",", ":"))
+  write_text(spark, "{}/offsets/{}".format(target, committed), "\n".join(lines))
+
+  for operator in list_files(spark, source + "/state"):
+    if operator["name"].isdigit():
+      repartition_operator(spark, "{}/state/{}".format(source, operator["name"]), \
+        "{}/state/{}".format(target, operator["name"]), committed + 1, partitions, codec)
+  write_text(spark, target + "_shuffle_partitions.json", json.dumps({"shufflePartitions": partitions, \
+    "repartitionedFrom": source, "committedBatch": committed}))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("checkpoint_location", help="checkpoint of the stopped query")
+  parser.add_argument("new_checkpoint_location")
+  parser.add_argument("--partitions", type=int, required=True)
+  parser.add_argument("--drop-uncommitted", action="store_true")
+  args = parser.parse_args()
+
+  spark = SparkSession.builder.appName("State repartition").getOrCreate()
+  repartition_checkpoint(spark, args.checkpoint_location, args.new_checkpoint_location, args.partitions, \
+                         args.drop_uncommitted)
+  print("Start the consumer with checkpoint location {}".format(args.new_checkpoint_location))
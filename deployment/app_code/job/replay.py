@@ -0,0 +1,124 @@
+import argparse
+import gzip
+import io
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from load_generator import KafkaSink, NO_TIME
+
+# Replays nycTaxiRides.gz (or any taxiRidesSchema CSV) with its original inter-arrival pattern,
+# sped up by --speedup. The file is decompressed as a stream, so memory stays bounded by one
+# send batch whatever the file size.
+# Usage: python replay.py https://${S3BUCKET}.s3.${AWS_REGION}.amazonaws.com/app_code/data/nycTaxiRides.gz \
+#          --bootstrap-servers ${MSK_SERVER} --speedup 60 --key driverId
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def open_input(source, compressed):
+  if source == "-":
+    raw = sys.stdin.buffer
+  elif "://" in source:
+    raw = urllib.request.urlopen(source)
+  else:
+    raw = open(source, "rb")
+  if compressed is None:
+    compressed = source.endswith(".gz")
+  return io.TextIOWrapper(gzip.GzipFile(fileobj=raw) if compressed else raw, encoding="utf-8")
+
+def event_time(fields):
+  """START records carry the start time, END records the end time. The unset one is 1970-01-01."""
+  times = [value for value in fields[2:4] if value != NO_TIME]
+  return max(datetime.strptime(value, TIME_FORMAT).timestamp() for value in times) if times else None
+
+class StdoutSink:
+  def send(self, lines):
+    sys.stdout.write("\n".join(lines) + "\n")
+
+  def close(self):
+    sys.stdout.flush()
+
+class RateReport:
+  """Achieved send rate against the rate the recorded event times ask for at this speed-up."""
+
+  def __init__(self, speedup, interval):
+    self.speedup, self.interval = speedup, interval
+    self.total, self.last_report = 0, time.time()
+    self.count, self.first_event = 0, None
+
+  def record(self, count, last_event, behind_seconds):
+    self.total += count
+    self.count += count
+    if self.first_event is None:
+      self.first_event = last_event
+    now = time.time()
+    if now - self.last_report < self.interval:
+      return
+    span = (last_event - self.first_event) / self.speedup
+    print("sent={} achieved={:.0f}/s target={}/s behind={:.1f}s eventTime={}".format( \
+      self.total, self.count / (now - self.last_report), \
+      "{:.0f}".format(self.count / span) if span > 0 else "-", behind_seconds, \
+      datetime.fromtimestamp(last_event).strftime(TIME_FORMAT)), file=sys.stderr)
+    self.last_report, self.count, self.first_event = now, 0, None
+
+def replay(lines, sink, speedup, batch_size, report, limit=None):
+  first_event = started = None
+  batch, sent = [], 0
+
+  def flush(last_event, due_at):
+    sink.send(batch)
+    report.record(len(batch), last_event, max(0.0, time.time() - due_at))
+    return sent + len(batch), []
+
+  for line in lines:
+    line = line.rstrip("\n")
+    fields = line.split(",")
+    timestamp = event_time(fields) if len(fields) >= 11 else None
+    if timestamp is None:
+      continue
+    if first_event is None:
+      first_event, started = timestamp, time.time()
+    # wall clock time the record is due at, out-of-order records go out straight away
+    due_at = started + (timestamp - first_event) / speedup
+    wait = due_at - time.time()
+    if wait > 0:
+      if batch:
+        sent, batch = flush(last_event, last_due)
+      time.sleep(wait)
+    batch.append(line)
+    last_event, last_due = timestamp, due_at
+    if len(batch) >= batch_size or (limit and sent + len(batch) >= limit):
+      sent, batch = flush(last_event, last_due)
+      if limit and sent >= limit:
+        break
+  if batch:
+    sent, batch = flush(last_event, last_due)
+  sink.close()
+  return sent
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("source", help="local path, http(s) URL, or - for stdin")
+  parser.add_argument("--gzip", dest="compressed", action="store_true", default=None, \
+    help="force gzip decoding, by default decided by the .gz suffix")
+  parser.add_argument("--speedup", type=float, default=60.0, help="event time / wall clock time")
+  parser.add_argument("--sink", choices=["kafka", "stdout"], default="kafka")
+  parser.add_argument("--bootstrap-servers")
+  parser.add_argument("--topic", default="taxirides")
+  parser.add_argument("--key", choices=["rideId", "driverId", "none"], default="driverId", \
+    help="partition key, keeps a driver's or ride's records in one partition")
+  parser.add_argument("--compression", choices=["none", "gzip", "snappy", "lz4", "zstd"], default="lz4")
+  parser.add_argument("--linger-ms", type=int, default=20)
+  parser.add_argument("--batch-bytes", type=int, default=256 * 1024)
+  parser.add_argument("--batch-size", type=int, default=500, help="records per send")
+  parser.add_argument("--limit", type=int, help="stop after this many records")
+  parser.add_argument("--report-seconds", type=float, default=5)
+  args = parser.parse_args()
+  if args.sink == "kafka" and not args.bootstrap_servers:
+    parser.error("--bootstrap-servers is required for the kafka sink")
+
+  sink = KafkaSink(args) if args.sink == "kafka" else StdoutSink()
+  started = time.time()
+  sent = replay(open_input(args.source, args.compressed), sink, args.speedup, args.batch_size, \
+                RateReport(args.speedup, args.report_seconds), args.limit)
+  print("replayed {} records in {:.1f}s".format(sent, time.time() - started), file=sys.stderr)
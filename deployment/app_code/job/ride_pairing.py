@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from pyspark.sql.functions import col, expr, when
+from pyspark.sql.streaming.state import GroupStateTimeout
+from pyspark.sql.types import *
+from pane_window import duration_ms
+
+# Pairs the START and END event of each rideId into one trip record. A ride waits in state until
+# its other half arrives; when the watermark passes the ride's last event time plus the longest
+# ride we expect, it is flushed as an incomplete trip and evicted. The state is fixed-width
+# numbers, not the event rows: nine 8-byte slots per open ride. Events without a driverId are
+# dropped with the ones without rideId or event time, a null passengerCnt is kept as -1.
+
+SEEN_START, SEEN_END = 1, 2
+NO_PASSENGER_COUNT = -1
+
+PAIRING_STATE_SCHEMA = StructType([ \
+  StructField("seen", IntegerType()), StructField("startMs", LongType()), StructField("endMs", LongType()), \
+  StructField("startLon", FloatType()), StructField("startLat", FloatType()), \
+  StructField("endLon", FloatType()), StructField("endLat", FloatType()), \
+  StructField("passengerCnt", IntegerType()), StructField("driverId", LongType())])
+
+TRIP_SCHEMA = StructType([ \
+  StructField("rideId", LongType()), StructField("driverId", LongType()), \
+  StructField("startTime", TimestampType()), StructField("endTime", TimestampType()), \
+  StructField("durationSeconds", DoubleType()), StructField("distanceKm", DoubleType()), \
+  StructField("passengerCnt", IntegerType()), StructField("completed", BooleanType())])
+
+# the pandas side returns the times as epoch ms: Spark pads its output frames with all-None rows,
+# which pandas 1.5 cannot concatenate with a tz-aware datetime column
+PAIRED_SCHEMA = StructType([ \
+  StructField("rideId", LongType()), StructField("driverId", LongType()), \
+  StructField("startMs", LongType()), StructField("endMs", LongType()), \
+  StructField("durationSeconds", DoubleType()), StructField("distanceKm", DoubleType()), \
+  StructField("passengerCnt", IntegerType()), StructField("completed", BooleanType())])
+
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_km(lon1, lat1, lon2, lat2):
+  lon1, lat1, lon2, lat2 = [np.radians(np.asarray(value, dtype="float64")) for value in (lon1, lat1, lon2, lat2)]
+  a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def trip_record(ride_id, ride, completed):
+  seen, start_ms, end_ms, start_lon, start_lat, end_lon, end_lat, passengers, driver_id = ride
+  return pd.DataFrame({
+    "rideId": [ride_id], "driverId": [driver_id],
+    "startMs": [start_ms if seen & SEEN_START else None], "endMs": [end_ms if seen & SEEN_END else None],
+    "durationSeconds": [(end_ms - start_ms) / 1000.0 if completed else None],
+    "distanceKm": [float(haversine_km(start_lon, start_lat, end_lon, end_lat)) if completed else None],
+    "passengerCnt": [passengers if passengers != NO_PASSENGER_COUNT else None], "completed": [completed]})
+
+def pair_events(max_ride_ms):
+  def pair(key, pdfs, state):
+    ride_id = key[0]
+    if state.hasTimedOut:
+      ride = state.get
+      state.remove()
+      yield trip_record(ride_id, ride, False)
+      return
+
+    ride = list(state.get) if state.exists else [0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0, 0]
+    for pdf in pdfs:
+      for event in pdf.itertuples(index=False):
+        if event.isStart == "START":
+          ride[0] |= SEEN_START
+          ride[1], ride[3], ride[4] = int(event.startMs), float(event.startLon), float(event.startLat)
+        else:
+          ride[0] |= SEEN_END
+          ride[2], ride[5], ride[6] = int(event.endMs), float(event.endLon), float(event.endLat)
+        # pandas turns a null passengerCnt into NaN
+        passengers = event.passengerCnt
+        ride[7], ride[8] = NO_PASSENGER_COUNT if pd.isna(passengers) else int(passengers), int(event.driverId)
+
+    if ride[0] == SEEN_START | SEEN_END:
+      if state.exists:
+        state.remove()
+      yield trip_record(ride_id, ride, True)
+      return
+    state.update(tuple(ride))
+    # the other half is given until the watermark passes the known event time plus the longest ride
+    known_ms = ride[1] if ride[0] & SEEN_START else ride[2]
+    state.setTimeoutTimestamp(max(known_ms + max_ride_ms, state.getCurrentWatermarkMs() + 1))
+
+  return pair
+
+def pair_ride_events(rides, watermark="1 minute", max_ride_duration="2 hours"):
+  """One TRIP_SCHEMA record per rideId, completed=False for a ride whose other event never came."""
+  event_time = when(col("isStart") == "START", col("startTime")).otherwise(col("endTime"))
+  return rides \
+    .where(col("rideId").isNotNull() & col("driverId").isNotNull() & event_time.isNotNull()) \
+    .select("rideId", "isStart", expr("unix_millis(startTime)").alias("startMs"), \
+            expr("unix_millis(endTime)").alias("endMs"), "startLon", "startLat", "endLon", "endLat", \
+            col("passengerCnt").cast("int").alias("passengerCnt"), "driverId", event_time.alias("eventTime")) \
+    .withWatermark("eventTime", watermark) \
+    .groupBy("rideId") \
+    .applyInPandasWithState(pair_events(duration_ms(max_ride_duration)), PAIRED_SCHEMA, PAIRING_STATE_SCHEMA, \
+                            "append", GroupStateTimeout.EventTimeTimeout) \
+    .select("rideId", "driverId", expr("timestamp_millis(startMs)").alias("startTime"), \
+            expr("timestamp_millis(endMs)").alias("endTime"), "durationSeconds", "distanceKm", "passengerCnt", "completed")
@@ -0,0 +1,31 @@
+from pyspark.sql.functions import col, expr, window
+from pane_window import pane_window_count
+from latency import window_aggregates
+
+def driver_window_counts(rides, aggregation="window", window_duration="10 seconds", slide_duration="5 seconds", \
+                         watermark="10 seconds", source_time_col=None):
+  """The consumer's watermark and per-driver sliding-window count over parsed rides. With
+  source_time_col the window also carries minSourceTime and maxSourceTime of its rides."""
+  rides = rides.withWatermark("timestamp", watermark)
+  if aggregation == "pane":
+    if source_time_col:
+      raise ValueError("The pane aggregation does not carry source times")
+    return pane_window_count(rides, "driverId", "timestamp", window_duration, slide_duration)
+  return rides.groupBy("driverId", window("timestamp", window_duration, slide_duration)) \
+    .agg(*window_aggregates(source_time_col))
+
+def ride_fare_join(rides, fares, rides_watermark="1 minute", fares_watermark="1 minute", time_bound="1 minute"):
+  """START events joined with their fare on rideId. Both sides are watermarked on startTime and the
+  fare must start within time_bound of the ride, so a row leaves the join state once the watermark
+  is time_bound past it, matched or not."""
+  starts = rides.where(col("isStart") == "START") \
+    .withWatermark("startTime", rides_watermark) \
+    .alias("ride")
+  fares = fares.withWatermark("startTime", fares_watermark).alias("fare")
+  return starts.join(fares, expr("""
+      ride.rideId = fare.rideId AND
+      fare.startTime BETWEEN ride.startTime - INTERVAL {0} AND ride.startTime + INTERVAL {0}
+    """.format(time_bound))) \
+    .select("ride.rideId", "ride.startTime", "ride.startLon", "ride.startLat", "ride.passengerCnt", \
+            "ride.taxiId", "ride.driverId", "fare.paymentType", "fare.tip", "fare.tolls", "fare.totalFare", \
+            col("ride.timestamp").alias("timestamp"))
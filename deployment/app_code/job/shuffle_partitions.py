@@ -0,0 +1,80 @@
+import json
+import math
+import time
+from hadoop_fs import list_files, read_text, write_text
+
+# Shuffle partition count of the stateful aggregation. Each shuffle partition is one state store
+# task per micro-batch, and the count is recorded in the checkpoint's offset log: a restart keeps
+# the recorded value whatever spark.sql.shuffle.partitions says. So the count is chosen once, at
+# the first start of a checkpoint, from the Kafka partition count and the executor cores, and
+# compared with what the current cluster would get on every later start.
+
+SHUFFLE_PARTITIONS = "spark.sql.shuffle.partitions"
+
+def kafka_partition_count(spark, bootstrap_servers, topic):
+  """Partitions of topic, through the Kafka client that comes with the spark-sql-kafka package."""
+  jvm = spark._jvm
+  props = jvm.java.util.Properties()
+  props.setProperty("bootstrap.servers", bootstrap_servers)
+  props.setProperty("key.deserializer", "org.apache.kafka.common.serialization.ByteArrayDeserializer")
+  props.setProperty("value.deserializer", "org.apache.kafka.common.serialization.ByteArrayDeserializer")
+  consumer = jvm.org.apache.kafka.clients.consumer.KafkaConsumer(props)
+  try:
+    return len(consumer.partitionsFor(topic))
+  finally:
+    consumer.close()
+
+def executor_cores(spark):
+  conf = spark.sparkContext.getConf()
+  cores = int(conf.get("spark.executor.cores", "1"))
+  if conf.get("spark.dynamicAllocation.enabled", "false") == "true" and \
+     conf.get("spark.dynamicAllocation.maxExecutors", "").isdigit():
+    return int(conf.get("spark.dynamicAllocation.maxExecutors")) * cores
+  if conf.get("spark.executor.instances"):
+    return int(conf.get("spark.executor.instances")) * cores
+  return spark.sparkContext.defaultParallelism
+
+def choose_shuffle_partitions(kafka_partitions, cores):
+  """At least one partition per Kafka partition, rounded up to whole waves of tasks over the cores."""
+  cores = max(cores, 1)
+  return cores * int(math.ceil(max(kafka_partitions, cores) / float(cores)))
+
+def checkpoint_conf(spark, checkpoint_location):
+  """The session conf recorded with the latest batch of the checkpoint, None for a new checkpoint."""
+  batches = [int(status["name"]) for status in list_files(spark, checkpoint_location.rstrip("/") + "/offsets") \
+             if status["name"].isdigit()]
+  if not batches:
+    return None
+  lines = read_text(spark, "{}/offsets/{}".format(checkpoint_location.rstrip("/"), max(batches))).splitlines()
+  return json.loads(lines[1]).get("conf", {})
+
+def configure_shuffle_partitions(spark, checkpoint_location, bootstrap_servers, topic, requested="auto", record_path=None):
+  """Sets spark.sql.shuffle.partitions for the query about to start on checkpoint_location and returns it."""
+  record_path = record_path or checkpoint_location.rstrip("/") + "_shuffle_partitions.json"
+  if requested == "auto":
+    try:
+      kafka_partitions = kafka_partition_count(spark, bootstrap_servers, topic)
+    except Exception as e:
+      print("Could not describe topic {}, sizing from executor cores only: {}".format(topic, e))
+      kafka_partitions = 0
+    cores = executor_cores(spark)
+    wanted = choose_shuffle_partitions(kafka_partitions, cores)
+  else:
+    kafka_partitions, cores, wanted = None, None, int(requested)
+
+  recorded = (checkpoint_conf(spark, checkpoint_location) or {}).get(SHUFFLE_PARTITIONS)
+  if recorded is not None:
+    recorded = int(recorded)
+    if recorded != wanted:
+      print("WARN: checkpoint {} keeps {} shuffle partitions, {} would fit now (kafka partitions={} cores={}). " \
+            "Use repartition_state.py to move the state to a new checkpoint with {} partitions.".format( \
+            checkpoint_location, recorded, wanted, kafka_partitions, cores, wanted))
+    spark.conf.set(SHUFFLE_PARTITIONS, recorded)
+    return recorded
+
+  spark.conf.set(SHUFFLE_PARTITIONS, wanted)
+  write_text(spark, record_path, json.dumps({"shufflePartitions": wanted, "kafkaPartitions": kafka_partitions, \
+    "executorCores": cores, "topic": topic, "chosenAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}))
+  print("Shuffle partitions for new checkpoint {}: {} (kafka partitions={} cores={})".format( \
+    checkpoint_location, wanted, kafka_partitions, cores))
+  return wanted
@@ -0,0 +1,74 @@
+import pyspark
+from pyspark.sql.streaming import StreamingQueryListener
+
+# State store providers and their tuning, kept in one place for the consumer and the benchmarks.
+
+STATE_STORE_PROVIDERS = {
+  "hdfs": "org.apache.spark.sql.execution.streaming.state.HDFSBackedStateStoreProvider",
+  "rocksdb": "org.apache.spark.sql.execution.streaming.state.RocksDBStateStoreProvider",
+}
+
+ROCKSDB_PREFIX = "spark.sql.streaming.stateStore.rocksdb."
+
+ROCKSDB_TUNING = {
+  "blockCacheSizeMB": 64,
+  "compactOnCommit": "false",
+}
+
+# write buffers, the bounded memory and changelog checkpointing are read from Spark 3.5 on,
+# 3.4 ignores these keys
+ROCKSDB_TUNING_SPARK_3_5 = {
+  "writeBufferSizeMB": 64,
+  "maxWriteBufferNumber": 3,
+  "boundedMemoryUsage": "true",
+  "maxMemoryUsageMB": 512,
+  "changelogCheckpointing.enabled": "true",
+}
+
+def spark_version(version):
+  return tuple(int(part) for part in version.split(".")[:2])
+
+def state_store_conf(provider="hdfs", version=pyspark.__version__, **tuning):
+  """Spark conf for the chosen provider and Spark version. Keyword arguments override
+  ROCKSDB_TUNING, e.g. state_store_conf("rocksdb", blockCacheSizeMB=256)."""
+  conf = {"spark.sql.streaming.stateStore.providerClass": STATE_STORE_PROVIDERS[provider]}
+  if provider == "rocksdb":
+    defaults = dict(ROCKSDB_TUNING)
+    if spark_version(version) >= (3, 5):
+      defaults.update(ROCKSDB_TUNING_SPARK_3_5)
+    for key, value in dict(defaults, **tuning).items():
+      conf[ROCKSDB_PREFIX + key] = str(value)
+  return conf
+
+def state_operator_summary(progress):
+  """Per-operator state figures of one progress event (a dict, as in query.lastProgress)."""
+  return [{
+    "operator": op.get("operatorName"),
+    "numRowsTotal": op.get("numRowsTotal"),
+    "numRowsUpdated": op.get("numRowsUpdated"),
+    "numRowsRemoved": op.get("numRowsRemoved"),
+    "memoryUsedBytes": op.get("memoryUsedBytes"),
+    "commitTimeMs": op.get("commitTimeMs"),
+    "customMetrics": op.get("customMetrics", {}),
+  } for op in progress.get("stateOperators", [])]
+
+class StateStoreReporter(StreamingQueryListener):
+  """Prints state rows, memory and commit latency of every stateful operator after each batch."""
+
+  def onQueryStarted(self, event):
+    pass
+
+  def onQueryProgress(self, event):
+    progress = event.progress
+    for op in progress.stateOperators:
+      custom = op.customMetrics or {}
+      print("batch={} operator={} stateRows={} updated={} removed={} memoryBytes={} commitMs={} " \
+            "rocksdbSstBytes={} rocksdbPinnedBytes={}".format( \
+        progress.batchId, op.operatorName, op.numRowsTotal, op.numRowsUpdated, op.numRowsRemoved, op.memoryUsedBytes, \
+        op.commitTimeMs, custom.get("rocksdbSstFileSize"), custom.get("rocksdbPinnedBlocksMemoryUsage")))
+
+  def onQueryIdle(self, event):
+    pass
+
+  def onQueryTerminated(self, event):
+    pass
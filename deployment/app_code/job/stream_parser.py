@@ -0,0 +1,29 @@
+from pyspark.sql.functions import split, from_csv
+
+def schema_ddl(schema):
+  return ", ".join("`{}` {}".format(field.name, field.dataType.simpleString()) for field in schema)
+
+def parse_csv_value(sdf, schema, value_col="value", method="split", overrides=None, keep=None):
+  """Build the typed row of `schema` from a CSV string column in a single projection.
+
+  method="split" slices the string once and casts every item inside one select,
+  method="from_csv" hands the whole schema to Spark's CSV parser,
+  method="pandas" converts whole Arrow batches with a vectorized pandas_udf (see arrow_parser.py).
+  `overrides` maps a field name to a Column that replaces the parsed value, `keep` lists Columns
+  passed through after the parsed fields.
+  """
+  overrides = overrides or {}
+  if method == "split":
+    items = split(sdf[value_col], ',')
+    fields = [items.getItem(idx).cast(field.dataType) for idx, field in enumerate(schema)]
+  elif method == "from_csv":
+    row = from_csv(sdf[value_col], schema_ddl(schema), {"timestampFormat": "yyyy-MM-dd HH:mm:ss"})
+    fields = [row.getField(field.name) for field in schema]
+  elif method == "pandas":
+    from arrow_parser import csv_parser_udf
+    row = csv_parser_udf(schema)(sdf[value_col])
+    fields = [row.getField(field.name) for field in schema]
+  else:
+    raise ValueError("Unknown parse method: {}".format(method))
+  return sdf.select([overrides.get(field.name, parsed).alias(field.name) \
+                     for field, parsed in zip(schema, fields)] + list(keep or []))
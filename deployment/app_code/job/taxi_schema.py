@@ -0,0 +1,16 @@
+from pyspark.sql.types import *
+
+taxiRidesSchema = StructType([ \
+  StructField("rideId", LongType()), StructField("isStart", StringType()), \
+  StructField("endTime", TimestampType()), StructField("startTime", TimestampType()), \
+  StructField("startLon", FloatType()), StructField("startLat", FloatType()), \
+  StructField("endLon", FloatType()), StructField("endLat", FloatType()), \
+  StructField("passengerCnt", ShortType()), StructField("taxiId", LongType()), \
+  StructField("driverId", LongType()),StructField("timestamp", TimestampType())])
+
+taxiFaresSchema = StructType([ \
+  StructField("rideId", LongType()), StructField("taxiId", LongType()), \
+  StructField("driverId", LongType()), StructField("startTime", TimestampType()), \
+  StructField("paymentType", StringType()), StructField("tip", FloatType()), \
+  StructField("tolls", FloatType()), StructField("totalFare", FloatType()), \
+  StructField("timestamp", TimestampType())])
@@ -0,0 +1,23 @@
+# Trigger modes of the streaming queries:
+#   default         micro-batches back to back
+#   processingTime  one micro-batch per interval, for throughput batching
+#   availableNow    drain everything available at start in rate-limited batches, then stop
+#   continuous      low-latency continuous processing, map-only queries (no aggregation)
+
+TRIGGER_MODES = ["default", "processingTime", "availableNow", "continuous"]
+
+def trigger_options(mode, interval=None):
+  if mode == "default":
+    return {}
+  if mode == "processingTime":
+    return {"processingTime": interval or "10 seconds"}
+  if mode == "availableNow":
+    return {"availableNow": True}
+  if mode == "continuous":
+    # for continuous processing the interval is the checkpoint interval
+    return {"continuous": interval or "1 second"}
+  raise ValueError("Unknown trigger mode: {}".format(mode))
+
+def apply_trigger(writer, mode, interval=None):
+  options = trigger_options(mode, interval)
+  return writer.trigger(**options) if options else writer
@@ -0,0 +1,71 @@
+from collections import Counter
+import numpy as np
+import pandas as pd
+from pyspark.sql.functions import col, explode, lit, lower, spark_partition_id, split, sum, when
+from pyspark.sql.types import LongType, StringType, StructField, StructType
+
+# Tokenizer and word count of the wordcount job.
+#   legacy     explode(split(lower(text), ' ')): "Great", "great," and "great!" are three words
+#              and every empty string between two spaces is counted
+#   regex      one split on TOKEN_SEPARATOR: lower case, runs of anything but letters, digits and
+#              inner apostrophes, and the <br /> tags of the review bodies separate words
+# Combining before the shuffle:
+#   spark      explode to one row per token, Spark's partial aggregation combines them per task
+#   partition  a pandas pass counts the token arrays of a whole partition in one hash map and
+#              emits one row per distinct word, no row per token is ever built in the JVM
+# Salting spreads the heavy hitters (a sample's most frequent words) over several reducers with
+# a first aggregation on (word, salt), then sums the partial counts per word.
+
+# "<" is left out of the generic class unless it opens something other than a <br /> tag, or a
+# space or punctuation in front of the tag would take the "<" and leave "br" as a word
+TOKEN_SEPARATOR = r"(?:<br\s*/?>|'*(?:[^\p{L}\p{N}'<]|<(?!br\s*/?>))+'*|^'+|'+$)+"
+TOKENIZERS = ["legacy", "regex"]
+COMBINE_MODES = ["spark", "partition"]
+WORD_COUNT_SCHEMA = StructType([StructField("words", StringType()), StructField("count", LongType())])
+
+def token_arrays(df, text_col="review_body", tokenizer="regex"):
+  """One `tokens` array column per row."""
+  if tokenizer == "legacy":
+    return df.select(split(lower(col(text_col)), " ").alias("tokens"))
+  if tokenizer == "regex":
+    return df.select(split(lower(col(text_col)), TOKEN_SEPARATOR).alias("tokens"))
+  raise ValueError("Unknown tokenizer: {}".format(tokenizer))
+
+def words(df, text_col="review_body", tokenizer="regex"):
+  """One `words` row per token. The regex tokenizer drops the empty strings of leading separators."""
+  exploded = token_arrays(df, text_col, tokenizer).select(explode("tokens").alias("words"))
+  return exploded if tokenizer == "legacy" else exploded.where(col("words") != "")
+
+def count_partition(batches):
+  counts = Counter()
+  for pdf in batches:
+    for tokens in pdf["tokens"]:
+      if tokens is not None:
+        counts.update(tokens)
+  yield pd.DataFrame({"words": pd.Series(list(counts.keys()), dtype=object), \
+                      "count": np.fromiter(counts.values(), dtype=np.int64, count=len(counts))})
+
+def heavy_hitters(df, text_col="review_body", tokenizer="regex", fraction=0.01, top=50, seed=7):
+  """The `top` most frequent words of a sample of the rows."""
+  sample = words(df.sample(fraction=fraction, seed=seed), text_col, tokenizer)
+  return [row.words for row in sample.groupBy("words").count().orderBy(col("count").desc()).limit(top).collect()]
+
+def word_counts(df, text_col="review_body", tokenizer="regex", combine="spark", salt_buckets=0, heavy=None):
+  """`words`, `count` of every token in text_col. With salt_buckets the words in `heavy` are
+  aggregated in salt_buckets groups first."""
+  if combine == "partition":
+    counts = token_arrays(df, text_col, tokenizer).mapInPandas(count_partition, WORD_COUNT_SCHEMA)
+    counts = counts if tokenizer == "legacy" else counts.where(col("words") != "")
+  elif combine == "spark":
+    counts = words(df, text_col, tokenizer).select("words", lit(1).cast("long").alias("count"))
+  else:
+    raise ValueError("Unknown combine mode: {}".format(combine))
+  if salt_buckets and heavy:
+    # the task's partition id keeps the salt deterministic on a retry
+    salt = when(col("words").isin(heavy), spark_partition_id() % salt_buckets).otherwise(lit(0))
+    counts = counts.groupBy("words", salt.alias("salt")).agg(sum("count").alias("count"))
+  return counts.groupBy("words").agg(sum("count").alias("count"))
+
+def legacy_word_counts(df):
+  """The original query, kept for comparison."""
+  return df.selectExpr("explode(split(lower(review_body), ' ')) as words").groupBy("words").count()
@@ -1,6 +1,58 @@
-import sys
+import argparse
 from pyspark.sql import SparkSession
+from word_tokenizer import COMBINE_MODES, TOKENIZERS, heavy_hitters, word_counts
+from wordcount_table import IncrementalMerge, check_checkpoint, read_schemas, write_counts
+
+# Word count of the Amazon reviews' review_body, see word_tokenizer.py for the tokenizers, the
+# combine modes and salting. --incremental counts only the input files that arrived since the last
+# run and merges them into the output table, see wordcount_table.py for it and the output layout.
+# Usage: spark-submit --py-files job_libs.zip wordcount.py <input parquet> <output parquet> [--salt-buckets 16]
+
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument("input")
+arg_parser.add_argument("output")
+arg_parser.add_argument("--tokenizer", choices=TOKENIZERS, default="regex", \
+  help="legacy splits on single spaces only, as the original job did")
+arg_parser.add_argument("--combine", choices=COMBINE_MODES, default="spark", \
+  help="partition counts each partition's tokens in one pandas hash map before the shuffle")
+arg_parser.add_argument("--salt-buckets", type=int, default=0, \
+  help="spread the most frequent words over this many reducers, 0 disables salting")
+arg_parser.add_argument("--heavy-hitters", type=int, default=50, help="words salted, taken from a 1%% sample")
+arg_parser.add_argument("--incremental", action="store_true", \
+  help="count only new input files and merge them into the output table")
+arg_parser.add_argument("--checkpoint", help="files already counted, default <output>_checkpoint")
+arg_parser.add_argument("--max-files-per-trigger", type=int, help="input files per merge in incremental mode")
+arg_parser.add_argument("--compression", choices=["snappy", "gzip", "zstd", "lz4", "none"], default="snappy")
+arg_parser.add_argument("--prefix-length", type=int, default=0, \
+  help="partition the output into prefix=<first N letters of the word> folders, 0 writes one folder")
+arg_parser.add_argument("--target-file-mb", type=int, default=128, help="upper bound of the output file size")
+args = arg_parser.parse_args()
+layout = {"compression": args.compression, "prefix_length": args.prefix_length, "target_file_mb": args.target_file_mb}
+
 spark = SparkSession.builder.appName('Amazon reviews word count').getOrCreate()
-df = spark.read.parquet(sys.argv[1])
-df.selectExpr("explode(split(lower(review_body), ' ')) as words").groupBy("words").count().write.mode("overwrite").parquet(sys.argv[2])
-exit()
+# only review_body is scanned, the other columns of the reviews are never read
+df = spark.read.parquet(args.input).select("review_body")
+if args.incremental:
+  checkpoint = args.checkpoint or args.output.rstrip("/") + "_checkpoint"
+  check_checkpoint(spark, args.output, checkpoint)
+  reader = spark.readStream.schema(df.schema)
+  if args.max_files_per_trigger:
+    reader = reader.option("maxFilesPerTrigger", args.max_files_per_trigger)
+  query = reader.parquet(args.input).writeStream \
+    .foreachBatch(IncrementalMerge(spark, args.output, args.tokenizer, args.combine, args.salt_buckets, \
+                                   args.heavy_hitters, layout)) \
+    .option("checkpointLocation", checkpoint) \
+    .trigger(availableNow=True) \
+    .start()
+  query.awaitTermination()
+  print("merged batches={} rows={}".format(len(query.recentProgress), \
+    sum(progress["numInputRows"] for progress in query.recentProgress)))
+else:
+  heavy = heavy_hitters(df, tokenizer=args.tokenizer, top=args.heavy_hitters) if args.salt_buckets else None
+  counts = word_counts(df, tokenizer=args.tokenizer, combine=args.combine, salt_buckets=args.salt_buckets, heavy=heavy)
+  scans = read_schemas(counts)
+  print("scan ReadSchema: {}".format(scans))
+  if any(scan != "struct<review_body:string>" for scan in scans):
+    raise ValueError("The scan reads more than review_body: {}".format(scans))
+  write_counts(counts, args.output, **layout)
+spark.stop()
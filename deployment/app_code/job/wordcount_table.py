@@ -0,0 +1,136 @@
+import math
+import re
+from urllib.parse import unquote, urlparse
+from pyspark import StorageLevel
+from pyspark.sql.functions import avg, col, count, input_file_name, length, lit, substring, sum
+from hadoop_fs import delete, list_files, read_text, rename, write_text
+from word_tokenizer import heavy_hitters, word_counts
+
+# The word count table of wordcount.py and its incremental update. In incremental mode the input
+# is a file stream with an availableNow trigger: the file source log in the checkpoint remembers
+# the files already counted, so each run only reads the new ones. Every batch's counts are merged
+# into the table, whose size is the vocabulary and not the history:
+#   1. the table and the batch counts are summed into <table>_staging/<batch id>, with the batch id
+#      in its _batch_id file
+#   2. the table is replaced by the staging folder
+# A batch replayed after a failure finds the table or the staging folder already at its batch id
+# and is not merged twice.
+#
+# Layout: the table is range-partitioned and sorted on count descending, optionally under
+# prefix=<first letters> folders, so in every folder the files with the lowest part numbers hold
+# the highest counts and a top-N query only reads those (top_words). --target-file-mb caps the rows
+# per file at the target divided by a row's plain-encoded size, an upper bound of its Parquet size.
+
+BATCH_ID_FILE = "_batch_id"
+PREFIX_COL = "prefix"
+PARQUET_ROW_OVERHEAD = 12   # 4-byte length of the word and the 8-byte count
+PART_NUMBER = re.compile(r"^part-(\d+)")
+
+def write_counts(counts, path, compression="snappy", prefix_length=0, target_file_mb=0):
+  order = [col("count").desc(), col("words")]
+  if prefix_length:
+    counts = counts.withColumn(PREFIX_COL, substring("words", 1, prefix_length))
+    order.insert(0, col(PREFIX_COL))
+  records_per_file, cached = None, None
+  if target_file_mb:
+    counts = cached = counts.persist(StorageLevel.MEMORY_AND_DISK)
+    stats = counts.agg(count(lit(1)).alias("rows"), avg(length("words")).alias("wordLength")).first()
+    records_per_file = max(1, int(target_file_mb * 1024 * 1024 / ((stats.wordLength or 0) + PARQUET_ROW_OVERHEAD)))
+    counts = counts.repartitionByRange(max(1, math.ceil(stats.rows / records_per_file)), *order)
+  else:
+    counts = counts.repartitionByRange(*order)
+  writer = counts.sortWithinPartitions(*order).write.mode("overwrite").option("compression", compression)
+  if records_per_file:
+    writer = writer.option("maxRecordsPerFile", records_per_file)
+  if prefix_length:
+    writer = writer.partitionBy(PREFIX_COL)
+  writer.parquet(path)
+  if cached is not None:
+    cached.unpersist()
+
+def read_schemas(df):
+  """ReadSchema of every file scan in df's physical plan, e.g. ["struct<review_body:string>"]."""
+  return re.findall(r"ReadSchema: (struct<\S*>)", df._jdf.queryExecution().executedPlan().toString())
+
+def data_file_groups(spark, path):
+  """[[files of part 0], [files of part 1], ...] of every folder under path, data files only."""
+  groups, parts = [], {}
+  for status in list_files(spark, path):
+    if status["isDir"] and not status["name"].startswith(("_", ".")):
+      groups += data_file_groups(spark, status["path"])
+    match = PART_NUMBER.match(status["name"])
+    if match and not status["isDir"]:
+      parts.setdefault(int(match.group(1)), []).append(status)
+  return groups + ([[parts[part] for part in sorted(parts)]] if parts else [])
+
+def file_key(uri):
+  return unquote(urlparse(uri).path)
+
+def file_rows(spark, path, files):
+  """Rows per file, counted without reading any column."""
+  counts = spark.read.option("basePath", path).parquet(*files).groupBy(input_file_name()).count().collect()
+  return {file_key(row[0]): row[1] for row in counts}
+
+def top_words(spark, path, n=100):
+  """The n most frequent words of a table written by write_counts. Every folder is read from its
+  first part files until they hold n rows, a folder's top n are among them."""
+  folders = data_file_groups(spark, path)
+  next_part, rows, files = {idx: 0 for idx in range(len(folders))}, [0] * len(folders), []
+  while next_part:
+    parts = {idx: folders[idx][part] for idx, part in next_part.items()}
+    counts = file_rows(spark, path, [status["path"] for part in parts.values() for status in part])
+    for idx, part in parts.items():
+      for status in part:
+        files.append(status["path"])
+        rows[idx] += counts.get(file_key(status["path"]), 0)
+      next_part[idx] += 1
+      if rows[idx] >= n or next_part[idx] == len(folders[idx]):
+        del next_part[idx]
+  if not files:
+    return []
+  return spark.read.option("basePath", path).parquet(*files).select("words", "count") \
+    .orderBy(col("count").desc(), col("words")).limit(n).collect()
+
+def merged_batch(spark, path):
+  """Batch id the table at path includes, -1 when it was not written by an incremental run."""
+  text = read_text(spark, "{}/{}".format(path, BATCH_ID_FILE))
+  return int(text) if text else -1
+
+def check_checkpoint(spark, table, checkpoint):
+  """A table updated by earlier batches needs their checkpoint, or new batch ids would clash."""
+  if merged_batch(spark, table) >= 0 and not list_files(spark, checkpoint.rstrip("/") + "/commits"):
+    raise ValueError("{} was built from the files recorded in another checkpoint, restore it or delete the " \
+                     "table to count all files again".format(table))
+
+class IncrementalMerge:
+  """The function to pass to foreachBatch."""
+
+  def __init__(self, spark, table, tokenizer="regex", combine="spark", salt_buckets=0, top=50, layout=None):
+    self.spark, self.table = spark, table.rstrip("/")
+    self.tokenizer, self.combine, self.salt_buckets, self.top = tokenizer, combine, salt_buckets, top
+    self.layout = layout or {}
+
+  def counts(self, df):
+    heavy = heavy_hitters(df, tokenizer=self.tokenizer, top=self.top) if self.salt_buckets else None
+    return word_counts(df, tokenizer=self.tokenizer, combine=self.combine, salt_buckets=self.salt_buckets, heavy=heavy)
+
+  def __call__(self, df, batch_id):
+    if merged_batch(self.spark, self.table) >= batch_id:
+      print("batch={} already merged into {}".format(batch_id, self.table))
+      return
+    staging = "{}_staging/{}".format(self.table, batch_id)
+    if merged_batch(self.spark, staging) != batch_id:
+      if self.salt_buckets:
+        df.persist(StorageLevel.MEMORY_AND_DISK)
+      counts = self.counts(df)
+      if merged_batch(self.spark, self.table) >= 0:
+        counts = self.spark.read.parquet(self.table).select("words", "count").unionByName(counts) \
+          .groupBy("words").agg(sum("count").alias("count"))
+      elif list_files(self.spark, self.table):
+        print("WARN {} was not written by an incremental run, it is replaced".format(self.table))
+      write_counts(counts, staging, **self.layout)
+      write_text(self.spark, "{}/{}".format(staging, BATCH_ID_FILE), str(batch_id))
+      df.unpersist()
+    delete(self.spark, self.table, recursive=True)
+    rename(self.spark, staging, self.table)
+    print("batch={} merged into {}".format(batch_id, self.table))